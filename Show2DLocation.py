@@ -1,7 +1,8 @@
-import numpy as np
 import netCDF4 as nc
 import matplotlib.pyplot as plt
 
+from tes_scatter import ScatterIndex
+
 # Step 1: Read the NetCDF file
 filename = 'mask.nc'  # Replace with your file path if needed
 dataset = nc.Dataset(filename)
@@ -13,25 +14,10 @@ gridID = dataset.variables['gridID'][:].compressed()  # gridID values
 
 print(gridID)
 
-# Create an array with the same dimensions as the 2D domain
-# Initialize an array of zeros
-active_array = np.zeros((len(y_coords), len(x_coords)), dtype=int)
-
-# Flatten the active_array to 1D
-flattened_active_array = active_array.flatten()
-print(flattened_active_array.shape)
-
-# Create a set for active grid IDs
-active_grid_ids = set(gridID)  # Using a set for faster lookup
-
-# Update the flattened
-# active array based on active grid IDs
-for grid_id in gridID:
-    if grid_id < flattened_active_array.size:  # Ensure grid_id is within bounds
-        flattened_active_array[grid_id] = 1
-
-# Reshape the flattened array back to 2D
-reshaped_active_array = flattened_active_array.reshape(active_array.shape)
+# Scatter the active grid IDs onto the 2D domain (1 = active, 0 = inactive) in one assignment
+index = ScatterIndex.from_mask(filename)
+reshaped_active_array = index.active()
+print(reshaped_active_array.shape)
 
 # Plot the 2D map using matplotlib
 plt.imshow(reshaped_active_array, cmap='viridis', origin='lower')
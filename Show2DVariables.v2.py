@@ -2,6 +2,8 @@ import numpy as np
 import netCDF4 as nc
 import matplotlib.pyplot as plt
 
+from tes_scatter import ScatterIndex, SliceCache
+
 # Step 1: Read the domain file for the mask
 mask_filename = 'mask.nc'  # Replace with your file path if needed
 mask_dataset = nc.Dataset(mask_filename)
@@ -11,27 +13,18 @@ x_coords = mask_dataset.variables['x'][:]  # x coordinate values
 y_coords = mask_dataset.variables['y'][:]  # y coordinate values
 gridID = mask_dataset.variables['gridID'][:].compressed()  # gridID values
 
-# Create an array with the same dimensions as the 2D domain
-active_array = np.zeros((len(y_coords), len(x_coords)), dtype=int)
-
-# Flatten the active_array to 1D
-flattened_active_array = active_array.flatten()
-
-# Create a set for active grid IDs
-active_grid_ids = set(gridID)  # Using a set for faster lookup
-
-# Update the flattened active array based on active grid IDs
-for grid_id in gridID:
-    if grid_id < flattened_active_array.size:  # Ensure grid_id is within bounds
-        flattened_active_array[grid_id] = 1
-
-# Reshape the flattened array back to 2D
-reshaped_active_array = flattened_active_array.reshape(active_array.shape)
+# Precompute the 2D positions of the grid IDs once (cached per mask file)
+index = ScatterIndex.from_mask(mask_filename)
+reshaped_active_array = index.active()
 
 # Step 3: Read the variable data from the data.nc file
 data_filename = 'data.nc'  # Replace with your file path if needed
 data_dataset = nc.Dataset(data_filename)
 
+# Only the requested time slice is read (hyperslab); recently viewed slices are kept and the
+# neighbouring time steps are read in the background while a map is shown
+slices = None
+
 # Loop to allow the user to input multiple variable names until they choose to stop
 while True:
     variable_name = input("Enter the variable name to extract (or type 'exit' to stop): ")
@@ -40,70 +33,82 @@ while True:
         break  # Exit the loop if the user types 'exit'
     
     try:
-        variable = data_dataset.variables[variable_name][:]  # Get the data variable
-        variable_data = variable[:]  # Get the data variable
-        
+        variable = data_dataset.variables[variable_name]  # No data is read yet
+        if slices is not None:
+            slices.close()
+            slices = None
+
         # Handle time dimension if present
-        if variable_data.ndim == 3:
-            time_dim = variable_data.shape[0]
+        if variable.ndim == 3:
+            time_dim = variable.shape[0]
+            slices = SliceCache(index, variable)
             print(f"Variable '{variable_name}' has {time_dim} time steps (0 to {time_dim-1}).")
             time_step = int(input(f"Enter the time step to visualize (0 to {time_dim-1}): "))
             if not (0 <= time_step < time_dim):
                 print("Invalid time step. Skipping.")
                 continue
-            variable_data = variable_data[time_step]
-            print(f"Visualizing {variable_name} at time step {time_step}.")
-        elif variable_data.ndim == 2:
+        elif variable.ndim == 2:
             # No time dimension, use as is
-            pass
+            time_step = None
         else:
             print("Variable has unsupported number of dimensions.")
             continue
 
-        # If variable is a masked array, compress it
-        if hasattr(variable_data, 'compressed'):
-            variable_data = variable_data.compressed()
-
-
-
-        # Step 4: Create a masked version of the variable data
-        masked_variable_data = np.full(active_array.shape, np.nan)  # Fill with NaN
-        for i, grid_id in enumerate(gridID):
-            if grid_id < masked_variable_data.size:  # Ensure grid_id is within bounds
-                masked_variable_data[np.unravel_index(grid_id, masked_variable_data.shape)] = variable_data[i]
-
-        # Step 5: Plot the data
-        # Use a pcolormesh or imshow depending on the type of plot you want
-
-        '''x_min = 200
-        x_max = 500
-        y_min = 200
-        y_max = 500'''
-        # show the whole domain
-        x_min = 1
-        x_max = len(x_coords)
-        y_min = 1
-        y_max = len(y_coords)
-
-        # Create new x and y coordinates for the subdomain
-        sub_x_coords = x_coords[x_min-1:x_max]  # Since x_coords is 1-indexed
-        sub_y_coords = y_coords[y_min-1:y_max]  # Since y_coords is 1-indexed
-
-        # Select the corresponding data for the subdomain
-        sub_data = masked_variable_data[y_min-1:y_max, x_min-1:x_max]
-
-        plt.clf()  # Clear the previous plot
-        plt.pcolormesh(sub_x_coords, sub_y_coords, sub_data, shading='auto', cmap='viridis')
-        plt.colorbar(label=variable_name)
-        plt.title('Plot of {} '.format(variable_name))
-        plt.xlabel('X Coordinates')
-        plt.ylabel('Y Coordinates')
-        plt.show()
+        while True:
+            # Step 4: Create a masked version of the variable data (NaN outside the grid IDs)
+            if time_step is None:
+                masked_variable_data = index.fill(index.cells(variable[:]))
+            else:
+                masked_variable_data = slices.get(time_step)
+                print(f"Visualizing {variable_name} at time step {time_step}.")
+
+            # Step 5: Plot the data
+            # Use a pcolormesh or imshow depending on the type of plot you want
+
+            '''x_min = 200
+            x_max = 500
+            y_min = 200
+            y_max = 500'''
+            # show the whole domain
+            x_min = 1
+            x_max = len(x_coords)
+            y_min = 1
+            y_max = len(y_coords)
+
+            # Create new x and y coordinates for the subdomain
+            sub_x_coords = x_coords[x_min-1:x_max]  # Since x_coords is 1-indexed
+            sub_y_coords = y_coords[y_min-1:y_max]  # Since y_coords is 1-indexed
+
+            # Select the corresponding data for the subdomain
+            sub_data = masked_variable_data[y_min-1:y_max, x_min-1:x_max]
+
+            plt.clf()  # Clear the previous plot
+            plt.pcolormesh(sub_x_coords, sub_y_coords, sub_data, shading='auto', cmap='viridis')
+            plt.colorbar(label=variable_name)
+            plt.title('Plot of {} '.format(variable_name))
+            plt.xlabel('X Coordinates')
+            plt.ylabel('Y Coordinates')
+            plt.show()
+
+            # Step through time: the neighbouring slices are usually prefetched already
+            if time_step is None:
+                break
+            answer = input(f"Next time step (0 to {time_dim-1}, n=next, p=previous, Enter=new variable): ").strip().lower()
+            if answer == 'n':
+                time_step = min(time_step + 1, time_dim - 1)
+            elif answer == 'p':
+                time_step = max(time_step - 1, 0)
+            elif answer.isdigit() and int(answer) < time_dim:
+                time_step = int(answer)
+            else:
+                break
         
     except KeyError:
         print(f"Error: Variable '{variable_name}' does not exist in the dataset.")
 
 # Step 6: Close the datasets
+if slices is not None:
+    slices.close()
 mask_dataset.close()
 data_dataset.close()
 
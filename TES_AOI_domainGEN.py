@@ -10,6 +10,8 @@ import sys, os
 
 from datetime import datetime
 
+from tes_grid import GRID_DOMAIN_ENV, TESGrid, cell_order_setting
+
 # Get current date
 current_date = datetime.now()
 # Format date to mmddyyyy
@@ -34,34 +36,19 @@ def find_nearest_points(listA, listB):
     _, indices = tree.query(listA, k=1)
     return indices
 
-def main():
+DOMAIN_SOURCE = './domain.lnd.TES_SE.4km.1d.nc'
 
-    args = sys.argv[1:]
-    # Check the number of arguments
-    if len(sys.argv) != 4  or sys.argv[1] == '--help':  # sys.argv includes the script name as the first argument
-        print("Example use: python TES_AOI_domainGEN.py <input_path> <output_path> <AOI_points_file>")
-        print(" <input_path>: path to the AOI_points_file")
-        print(" <output_path>:  path for the 1D AOI output data directory")
-        print(" <AOI_points_file>:  <AOI>_gridID.nc (or.csv) or <AOI>_xcyc.csv or <AOI>_xcyc_lcc.csv")
-        print(" The code uses TES domain (./domain.lnd.TES_SE.4km.1d.c<yymmdd>.nc) to generation 1D AOI domain.nc")      
-        exit(0)
-    
-    input_path = args[0]
-    output_path = args[1]
-    AOI_gridcell_file = args[2]
-    '''
-
-    input_path = "./AKSP_info/"
-    output_path = "./temp"
-    #AOI_gridcell_file = 'AKSP_gridID.csv'
-    AOI_gridcell_file = 'AKSP_xcyc.csv'
-    AOI_gridcell_file = 'AKSP_xcyc_lcc.csv'
-    #AOI_gridcell_file = 'MOF21points_xcyc.csv' 
-    AOI=AOI_gridcell_file.split("_")[0]
-    '''
-    AOI=AOI_gridcell_file.split("_")[0]
-    AOI_gridcell_file = input_path +'/'+ AOI_gridcell_file    
+def source_grid(source_file, warm=None):
+    # TES raster of the entire domain; a super-AOI source domain is a sparse subset of it,
+    # so the raster comes from $TES_GRID_DOMAIN (the entire-domain file) when that is set
+    grid_domain = os.environ.get(GRID_DOMAIN_ENV) or source_file
+    if warm is not None and warm.grid is not None and warm.path == os.path.realpath(grid_domain):
+        return warm.grid
+    return TESGrid.from_domain(grid_domain)
 
+def AOI_domain_idx(src, AOI_gridcell_file, warm=None):
+    # positions of the AOI cells in the source domain, and the number of AOI points;
+    # warm (aoi_service.py) holds the gridID lookup and the KD-trees of an already loaded src
     if 'gridID' in AOI_gridcell_file:
         user_option = 1
     if AOI_gridcell_file.endswith('xcyc.csv'):
@@ -69,33 +56,20 @@ def main():
     if AOI_gridcell_file.endswith('xcyc_lcc.csv'):
         user_option = 3
 
-    # save to the 1D domain file
-    AOIdomain = output_path +'/'+str(AOI)+'_domain.lnd.TES_SE.4km.1d.c'+ formatted_date + '.nc'
-
-    # check if file exists then delete it
-    if os.path.exists(AOIdomain):
-        os.remove(AOIdomain)
-
-    source_file = './domain.lnd.TES_SE.4km.1d.nc'
-    dst = nc.Dataset(AOIdomain, 'w', format='NETCDF3_64BIT')
-
-    # open the 1D domain data
-    src = nc.Dataset(source_file, 'r', format='NETCDF3_64BIT')
-
-    # 3) Open a csv file to read a list of points (y, x)
-    #df = read_gridcells(AOI_gridcell_file)  
-
     if user_option == 1: # gridID is used directly
         #AOI_gridcell_file = AOI+'_gridID.csv'  # user provided gridcell IDs
         if AOI_gridcell_file.endswith('.csv'):
             df = pd.read_csv(AOI_gridcell_file, sep=",", skiprows=1, names = ['gridID'])
             #read gridIds
-       	    AOI_points = list(df['gridID'])
+            AOI_points = list(df['gridID'])
         if AOI_gridcell_file.endswith('.nc'):
             grid_src= nc.Dataset(AOI_gridcell_file, 'r', format='NETCDF3_64BIT')
             #read gridIds
             AOI_points = list(grid_src['gridID'][0][:])
 
+        if warm is not None:
+            return warm.positions(AOI_points), len(AOI_points)
+
         # read gridIDs
         TES_gridIDs = src.variables['gridID'][:]
         TES_gridcell_list = list(TES_gridIDs)
@@ -103,9 +77,6 @@ def main():
 
         domain_idx = np.where(np.in1d(TES_gridcell_list, AOI_points))[0]
 
-        TES_gridcell_arr = np.array(TES_gridIDs)
-        AOI_points_arr = np.array(AOI_points)
-
     if user_option == 2: # use lat lon coordinates
         #AOI_gridcell_file = AOI+'_xcyc.csv'  # user provided gridcell csv file  (xc, yc) (lon, lat)
         df = pd.read_csv(AOI_gridcell_file, sep=",", skiprows=1, names = ['xc', 'yc'], engine='python')
@@ -117,8 +88,6 @@ def main():
         # read yc, xc (y, x)
         TES_yc = src.variables['yc'][:]
         TES_xc = src.variables['xc'][:]
-        # create list for all land gridcell (lat, lon)
-        TES_gridcell_list = list(zip(TES_xc, TES_yc))
  
         # find the xc, yc boundary
         TES_xc_max, TES_xc_min = np.max(TES_xc), np.min(TES_xc)
@@ -135,10 +104,14 @@ def main():
 
         AOI_points_arr = np.array(AOI_points)
         print("AOI_points_arr", AOI_points_arr[0:5], "shape", AOI_points_arr.shape)
-        TES_gridcell_arr = np.squeeze(np.array(TES_gridcell_list)).transpose()    
-        print("TES_gridcell_arr", TES_gridcell_arr[0:5], "shape", TES_gridcell_arr.shape)
-
-        tree = cKDTree(TES_gridcell_arr)
+        if warm is not None:
+            tree = warm.trees['xcyc']
+        else:
+            # create list for all land gridcell (lat, lon)
+            TES_gridcell_list = list(zip(TES_xc, TES_yc))
+            TES_gridcell_arr = np.squeeze(np.array(TES_gridcell_list)).transpose()
+            print("TES_gridcell_arr", TES_gridcell_arr[0:5], "shape", TES_gridcell_arr.shape)
+            tree = cKDTree(TES_gridcell_arr)
         _, domain_idx = tree.query(AOI_points_arr, k=1)
 
     if user_option == 3: # xc_LCC and yc_LCC is used directly
@@ -153,10 +126,6 @@ def main():
         TES_yc_LCC = src.variables['yc_LCC'][:]
         TES_xc_LCC = src.variables['xc_LCC'][:]
 
-        # create list for all land gridcell (lat, lon)
-        TES_gridcell_list = list(zip(TES_xc_LCC, TES_yc_LCC))
-
-
         # find the xc, yc boundary
         TES_xc_LCC_max, TES_xc_LCC_min = np.max(TES_xc_LCC), np.min(TES_xc_LCC)
         TES_yc_LCC_max, TES_yc_LCC_min = np.max(TES_yc_LCC), np.min(TES_yc_LCC)
@@ -171,16 +140,50 @@ def main():
 
         AOI_points_arr = np.array(AOI_points)
         print("AOI_points_arr", AOI_points_arr[0:5], "shape", AOI_points_arr.shape)
-        TES_gridcell_arr = np.squeeze(np.array(TES_gridcell_list)).transpose()    
-        print("TES_gridcell_arr", TES_gridcell_arr[0:5], "shape", TES_gridcell_arr.shape)
-
-        tree = cKDTree(TES_gridcell_arr)
+        if warm is not None:
+            tree = warm.trees['lcc']
+        else:
+            # create list for all land gridcell (lat, lon)
+            TES_gridcell_list = list(zip(TES_xc_LCC, TES_yc_LCC))
+            TES_gridcell_arr = np.squeeze(np.array(TES_gridcell_list)).transpose()
+            print("TES_gridcell_arr", TES_gridcell_arr[0:5], "shape", TES_gridcell_arr.shape)
+            tree = cKDTree(TES_gridcell_arr)
         _, domain_idx = tree.query(AOI_points_arr, k=1)
 
-    AOI_mask = np.isin(TES_gridcell_arr, AOI_points_arr)
+    return domain_idx, len(AOI_points)
+
+def create_AOI_domain(input_path, output_path, AOI_gridcell_file, source_file=DOMAIN_SOURCE, warm=None):
+    # warm: the source domain already loaded by aoi_service.py (open(), positions(), trees, grid)
+    AOI=AOI_gridcell_file.split("_")[0]
+    AOI_gridcell_file = input_path +'/'+ AOI_gridcell_file    
+
+    # save to the 1D domain file
+    AOIdomain = output_path +'/'+str(AOI)+'_domain.lnd.TES_SE.4km.1d.c'+ formatted_date + '.nc'
+
+    # check if file exists then delete it
+    if os.path.exists(AOIdomain):
+        os.remove(AOIdomain)
+
+    dst = nc.Dataset(AOIdomain, 'w', format='NETCDF3_64BIT')
+
+    # open the 1D domain data
+    src = warm.open() if warm is not None else nc.Dataset(source_file, 'r', format='NETCDF3_64BIT')
+
+    # 3) Open a csv file to read a list of points (y, x)
+    #df = read_gridcells(AOI_gridcell_file)  
+
+    domain_idx, npoints = AOI_domain_idx(src, AOI_gridcell_file, warm)
 
     domain_idx = np.sort(domain_idx)
 
+    # optional space-filling-curve order of the AOI cells (AOI_CELL_ORDER=hilbert|morton);
+    # the surfdata, forcing and finidat generators follow the order of this AOI domain
+    cell_order = cell_order_setting()
+    if cell_order != 'source':
+        grid = source_grid(source_file, warm)
+        domain_idx = domain_idx[grid.cell_order(np.asarray(src['gridID'][:]).ravel()[domain_idx], cell_order)]
+        print("AOI cells ordered along a " + cell_order + " curve")
+
     print("gridID_idx", domain_idx.shape, domain_idx[0:20])
     
     #if not user_option==1:
@@ -189,6 +192,8 @@ def main():
     # Copy the global attributes from the source to the target
     for name in src.ncattrs():
         dst.setncattr(name, src.getncattr(name))
+    if cell_order != 'source':
+        dst.setncattr('cell_order', cell_order)
 
     # Copy the dimensions from the source to the target
     for name, dimension in src.dimensions.items():
@@ -198,7 +203,7 @@ def main():
         else:
             # Update the 'ni' dimension with the length of the list
             #dst.dimensions['ni'].set_length(len(AOI_points))
-            ni = dst.createDimension("ni", len(AOI_points))
+            ni = dst.createDimension("ni", npoints)
 
     # Copy the variables from the source to the target
     for name, variable in src.variables.items():
@@ -231,7 +236,7 @@ def main():
                 #AOI_data = np.copy(source_data[..., AOI_mask])  # mask out the source data with AOI_mask
     
                 # put the masked result into an array of (m,1, AOI_points)
-                data_arr = np.empty((d0, d1, len(AOI_points)))
+                data_arr = np.empty((d0, d1, npoints))
                 for i in range(d0):
                     AOI_data = np.copy(source_data[i, domain_idx])  # mask out the source data with AOI_mask  
                     data_arr[i, 0, :] = AOI_data[:]
@@ -253,6 +258,34 @@ def main():
     dst.close()
 
     print("Domain generation has done")
+    return AOIdomain
+
+def main(argv=None, warm=None):
+    args = sys.argv[1:] if argv is None else argv
+    # Check the number of arguments
+    if len(args) != 3  or args[0] == '--help':
+        print("Example use: python TES_AOI_domainGEN.py <input_path> <output_path> <AOI_points_file>")
+        print(" <input_path>: path to the AOI_points_file")
+        print(" <output_path>:  path for the 1D AOI output data directory")
+        print(" <AOI_points_file>:  <AOI>_gridID.nc (or.csv) or <AOI>_xcyc.csv or <AOI>_xcyc_lcc.csv")
+        print(" The code uses TES domain (./domain.lnd.TES_SE.4km.1d.c<yymmdd>.nc) to generation 1D AOI domain.nc")      
+        exit(0)
+    
+    input_path = args[0]
+    output_path = args[1]
+    AOI_gridcell_file = args[2]
+    '''
+
+    input_path = "./AKSP_info/"
+    output_path = "./temp"
+    #AOI_gridcell_file = 'AKSP_gridID.csv'
+    AOI_gridcell_file = 'AKSP_xcyc.csv'
+    AOI_gridcell_file = 'AKSP_xcyc_lcc.csv'
+    #AOI_gridcell_file = 'MOF21points_xcyc.csv' 
+    AOI=AOI_gridcell_file.split("_")[0]
+    '''
+    create_AOI_domain(input_path, output_path, AOI_gridcell_file, warm=warm)
+
 
 if __name__ == '__main__':
     main()
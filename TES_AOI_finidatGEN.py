@@ -0,0 +1,190 @@
+# create <AOI>_<restart>.nc: an AOI finidat subset from an entire-domain ELM restart
+
+# An ELM restart (.elm.r.*.nc) stores gridcells, topounits, landunits, columns and PFTs
+# along their own dimensions. Every sub-grid entity carries the 1-based index of its
+# gridcell (and of its topounit/landunit/column parents) in the <level>1d_* vectors, and
+# grid1d_ixy/jxy give the position of each gridcell in the 1D domain (ni, nj).
+# The AOI keeps the gridcells of the AOI domain, in AOI domain order, with all of their
+# sub-grid entities; parent indices are remapped to the new positions so the file is a
+# valid finidat for a run on the AOI domain/surfdata (skipping the accelerated and final spinup).
+
+import netCDF4 as nc
+import numpy as np
+import sys, os
+
+from datetime import datetime
+from time import time
+
+from TES_AOI_surfdataGEN import read_AOI_points
+from tes_grid import aoi_positions, file_cell_order
+
+# entity dimensions, parents first, with their <prefix>1d_ variable prefix
+LEVELS = [('gridcell', 'grid'), ('topounit', 'topo'), ('landunit', 'land'), ('column', 'cols'), ('pft', 'pfts')]
+# parent index vectors (<prefix>1d_<suffix>) and the dimension they point into
+PARENT_SUFFIXES = {'gridcell': 'gridcell', 'gi': 'gridcell', 'topounit': 'topounit', 'ti': 'topounit',
+                   'landunit': 'landunit', 'li': 'landunit', 'column': 'column', 'ci': 'column'}
+
+
+def restart_positions(src, domain_ni):
+    # 0-based position of every restart gridcell in the 1D entire domain
+    ixy = np.asarray(src['grid1d_ixy'][:], dtype=np.int64) - 1
+    if 'grid1d_jxy' in src.variables:
+        ixy = ixy + (np.asarray(src['grid1d_jxy'][:], dtype=np.int64) - 1) * domain_ni
+    return ixy
+
+
+def aoi_domain_positions(domain_file, AOI_points, keep_order=False):
+    # positions of the AOI gridcells in the entire domain, in domain order or in AOI domain order
+    with nc.Dataset(domain_file, 'r') as dom:
+        grid_ids = np.asarray(dom['gridID'][:]).ravel()
+        ni = len(dom.dimensions['ni'])
+    positions = aoi_positions(grid_ids, AOI_points, keep_order)
+    return positions, grid_ids[positions], ni
+
+
+def select_entities(src, positions, ni):
+    """Restart indices kept for every entity dimension, in output order, plus old->new lookups."""
+    rest_pos = restart_positions(src, ni)
+    lookup = np.full(max(int(rest_pos.max()), int(positions.max())) + 1, -1, dtype=np.int64)
+    lookup[rest_pos] = np.arange(rest_pos.size)
+    grid_sel = lookup[positions]
+    if (grid_sel < 0).any():
+        raise ValueError(f"{int((grid_sel < 0).sum())} AOI gridcells are not in the restart file")
+
+    selection, new_index = {}, {}
+    for dim, prefix in LEVELS:
+        if dim not in src.dimensions:
+            continue
+        n = len(src.dimensions[dim])
+        if dim == 'gridcell':
+            keep = grid_sel
+        else:
+            parent = np.asarray(src[prefix + '1d_gridcell'][:], dtype=np.int64) - 1
+            new_grid = new_index['gridcell'][parent]
+            members = np.flatnonzero(new_grid >= 0)
+            # grouped by new gridcell, original order within a gridcell
+            keep = members[np.argsort(new_grid[members], kind='stable')]
+        remap = np.full(n, -1, dtype=np.int64)
+        remap[keep] = np.arange(keep.size)
+        selection[dim], new_index[dim] = keep, remap
+    return selection, new_index
+
+
+def parent_dimension(name):
+    # dimension a <prefix>1d_<suffix> index vector points into, or None
+    for _, prefix in LEVELS:
+        if name.startswith(prefix + '1d_'):
+            return PARENT_SUFFIXES.get(name[len(prefix) + 3:])
+    return None
+
+
+def subset_values(name, variable, selection, new_index):
+    data = variable[...]
+    for axis, dim in enumerate(variable.dimensions):
+        if dim in selection:
+            data = np.take(data, selection[dim], axis=axis)
+    target = parent_dimension(name)
+    if target in new_index:
+        data = (new_index[target][np.asarray(data, dtype=np.int64) - 1] + 1).astype(variable.dtype)
+    elif name == 'grid1d_ixy':
+        # position in the AOI 1D domain
+        data = np.arange(1, data.size + 1, dtype=variable.dtype)
+    elif name.endswith('1d_jxy'):
+        data = np.ones_like(data)
+    return data
+
+
+def remap_ixy(dst):
+    # sub-grid ixy follow their gridcell's new position
+    for _, prefix in LEVELS[1:]:
+        name = prefix + '1d_ixy'
+        if name in dst.variables and prefix + '1d_gridcell' in dst.variables:
+            dst[name][:] = dst[prefix + '1d_gridcell'][:].astype(dst[name].dtype)
+
+
+def check_surfdata(surfdata_file, grid_ids, src_dims):
+    # the AOI surfdata must hold the same gridcells in the same order
+    with nc.Dataset(surfdata_file, 'r') as surf:
+        surf_ids = np.asarray(surf['gridID'][:]).ravel()
+    if surf_ids.size != grid_ids.size or not np.array_equal(surf_ids, grid_ids):
+        raise ValueError(f"{surfdata_file}: gridcells differ from the AOI finidat "
+                         f"({surf_ids.size} vs {grid_ids.size})")
+    print(f"AOI surfdata gridcells match ({surf_ids.size}); subgrid sizes: {src_dims}")
+
+
+def AOI_finidat_name(output_path, AOI, restart_file):
+    return output_path + '/' + str(AOI) + '_' + os.path.basename(restart_file)
+
+
+def create_AOI_finidat(restart_file, domain_file, AOIfinidat, AOI, AOI_points, keep_order=False):
+    start = time()
+    positions, grid_ids, ni = aoi_domain_positions(domain_file, AOI_points, keep_order)
+    if positions.size == 0:
+        raise ValueError("no AOI gridcell found in " + domain_file)
+
+    os.makedirs(os.path.dirname(AOIfinidat), exist_ok=True)
+    if os.path.exists(AOIfinidat):
+        os.remove(AOIfinidat)
+
+    with nc.Dataset(restart_file, 'r') as src:
+        src.set_auto_mask(False)
+        selection, new_index = select_entities(src, positions, ni)
+        sizes = {dim: int(keep.size) for dim, keep in selection.items()}
+        print("AOI subgrid sizes: " + ", ".join(f"{d}={s} (of {len(src.dimensions[d])})" for d, s in sizes.items()))
+
+        with nc.Dataset(AOIfinidat, 'w', format=src.data_model) as dst:
+            dst.set_auto_mask(False)
+            for name in src.ncattrs():
+                dst.setncattr(name, src.getncattr(name))
+            for name, dimension in src.dimensions.items():
+                dst.createDimension(name, None if dimension.isunlimited() else sizes.get(name, len(dimension)))
+            for name, variable in src.variables.items():
+                attrs = variable.__dict__
+                x = dst.createVariable(name, variable.datatype, variable.dimensions,
+                                       fill_value=attrs.get('_FillValue', None))
+                x.setncatts({k: v for k, v in attrs.items() if k != '_FillValue'})
+            for name, variable in src.variables.items():
+                dst[name][...] = subset_values(name, variable, selection, new_index)
+            remap_ixy(dst)
+
+            dst.setncattr('AOI', AOI)
+            dst.setncattr('source_restart', os.path.abspath(restart_file))
+            dst.setncattr('source_domain', os.path.abspath(domain_file))
+            dst.setncattr('history', datetime.now().strftime('%Y-%m-%d %H:%M:%S') +
+                          ' created by TES_AOI_finidatGEN.py')
+    print(f"Finished {AOIfinidat} in {time() - start:.2f}s")
+    return grid_ids, sizes
+
+
+def main():
+    args = sys.argv[1:]
+    if len(sys.argv) not in (6, 7) or sys.argv[1] == '--help':
+        print("Example use: python TES_AOI_finidatGEN.py <TES_restart> <TES_domain> <output_path> <AOI_file_path> <AOI_points_file> [<AOI_surfdata>]")
+        print(" <TES_restart>: entire-domain ELM restart (<case>.elm.r.<date>.nc)")
+        print(" <TES_domain>: 1D TES domain.nc of the run that wrote the restart")
+        print(" <output_path>:  path for the AOI finidat")
+        print(" <AOI_file_path>:  path to the <AOI_points_files>")
+        print(" <AOI_points_file>:  <AOI>_gridID.csv or <AOI>_domain.nc")
+        print(" <AOI_surfdata>:  optional AOI surfdata checked for the same gridcells")
+        print(" The code writes <output_path>/<AOI>_<TES_restart name> for use as finidat")
+        sys.exit(0)
+
+    restart_file = args[0]
+    domain_file = args[1]
+    output_path = args[2]
+    AOI_gridID_path = args[3]
+    if not AOI_gridID_path.endswith("/"): AOI_gridID_path += '/'
+    AOI_gridID_file = args[4]
+    AOI = AOI_gridID_file.split("_")[0]
+
+    AOI_points = read_AOI_points(AOI_gridID_path + AOI_gridID_file)
+    AOIfinidat = AOI_finidat_name(output_path, AOI, restart_file)
+    print("AOIfinidat:" + AOIfinidat)
+    keep_order = file_cell_order(AOI_gridID_path + AOI_gridID_file) != 'source'
+    grid_ids, sizes = create_AOI_finidat(restart_file, domain_file, AOIfinidat, AOI, AOI_points, keep_order)
+    if len(args) == 6:
+        check_surfdata(args[5], grid_ids, sizes)
+
+
+if __name__ == '__main__':
+    main()
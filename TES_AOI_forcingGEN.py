@@ -8,12 +8,14 @@ import pandas as pd
 from time import process_time
 from datetime import datetime
 
+from tes_grid import aoi_positions, file_cell_order
+
 # Get current date
 current_date = datetime.now()
 # Format date to mmddyyyy
 formatted_date = current_date.strftime('%y%m%d')
 
-def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
+def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path, keep_order=False):
     # Open a new NetCDF file to write the data to. For format, you can choose from
     # 'NETCDF3_CLASSIC', 'NETCDF3_64BIT', 'NETCDF4_CLASSIC', and 'NETCDF4'
     source_file = input_path + '/'+ file
@@ -23,14 +25,12 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
     #read gridIDs
     grid_ids = src['gridID'][...]    # gridID for all TES
  
-    #  
-    AOI_idx = np.where(np.in1d(grid_ids, AOI_points))[0]
-    
-    AOI_mask = np.isin(grid_ids, AOI_points)
-    #print(grid_ids.shape,AOI_points.shape, AOI_mask.shape)
+    # source order, or the AOI domain order when it carries a cell_order (see tes_grid.py)
+    AOI_idx = aoi_positions(grid_ids, AOI_points, keep_order)
     
-    # create the new_filename
-    dst_name = output_path + '/'+ AOI + '_'+file
+    # create the new_filename (a super-AOI source file <SUPER>_clmforc... keeps only the new AOI prefix)
+    from TES_AOI_forcingGEN_mpi import source_stem
+    dst_name = output_path + '/'+ AOI + '_'+source_stem(file)
     print ("Generating AOI file: ", dst_name)
     
     # check if file exists then delete it
@@ -79,7 +79,7 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
                                  #  4  320 second, 8: 205 seconds, 16: 
                 num_chunks = d0 // chunk_size + (d0 % chunk_size > 0)
                 
-                data_arr = np.empty((d0, d1, AOI_points.shape[1]))
+                data_arr = np.empty((d0, d1, AOI_idx.size))
                 
                 #print('data_arr.shape:' + str(data_arr.shape))
                 
@@ -94,7 +94,7 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
                 
                     print(f"Subsetting source data for chunk {chunk + 1} of {num_chunks}")
                     for i in range(start, end):
-                        AOI_data = np.copy(source_data[i - start, AOI_mask])  # mask out the source data with AOI_mask  
+                        AOI_data = np.copy(source_data[i - start][..., AOI_idx])  # AOI gridcells in AOI order
                         #print('data_arr[i,0,:].shape:' + str(data_arr[i, 0, :].shape) + str(AOI_data.shape))
                         data_arr[i, :, :] = AOI_data[:]
                 
@@ -166,6 +166,7 @@ def main():
         print("Error: Invalid AOI_points_file, see help.")
 
     print(AOI_gridID_file)
+    keep_order = file_cell_order(AOI_gridID_file) != 'source'
         
     '''files_nc = get_files(input_path)
 
@@ -198,7 +199,7 @@ def main():
                 #forcing_save_1dTES(root, file, var_name, period, time, new_dir)
 
                 start = process_time() 
-                AOI_forcing_save_1d(root, file, AOI, AOI_points, new_dir)
+                AOI_forcing_save_1d(root, file, AOI, AOI_points, new_dir, keep_order)
                 end = process_time()
                 print("Generating 1D forcing data for "+AOI+ " domain takes {}".format(end-start))
 
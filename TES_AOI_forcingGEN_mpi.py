@@ -2,12 +2,17 @@
 # TES_AOI_forcingGEN_mpi: MPI-parallel (with local multiprocessing fallback) forcing subsetting
 
 import os, sys
+import threading
 import netCDF4 as nc
 import numpy as np
 import pandas as pd
-from time import process_time
+from time import process_time, time
 from datetime import datetime
 
+from aoi_qa import file_qa
+from forcing_progress import ProgressTracker, file_event
+from tes_grid import aoi_positions, file_cell_order
+
 # Try MPI first
 try:
     from mpi4py import MPI  # type: ignore
@@ -29,12 +34,22 @@ except Exception:
     as_completed = None
 
 
+TAG_PROGRESS = 21
+
 # Get current date
 current_date = datetime.now()
 formatted_date = current_date.strftime('%y%m%d')
 
 
-def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
+def source_stem(file):
+    # forcing taken from a super-AOI experiment is named <SUPER>_clmforc...; keep one AOI prefix
+    idx = file.find('clmforc')
+    if idx > 0 and file[idx - 1] == '_':
+        return file[idx:]
+    return file
+
+
+def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path, keep_order=False):
     os.makedirs(output_path, exist_ok=True)
 
     source_file = input_path + '/' + file
@@ -43,10 +58,10 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
 
     grid_ids = src['gridID'][...]  # global gridID array
 
-    AOI_idx = np.where(np.in1d(grid_ids, AOI_points))[0]
-    AOI_mask = np.isin(grid_ids, AOI_points)
+    # source order, or the AOI domain order when it carries a cell_order (see tes_grid.py)
+    AOI_idx = aoi_positions(grid_ids, AOI_points, keep_order)
 
-    dst_name = output_path + '/' + AOI + '_' + file
+    dst_name = output_path + '/' + AOI + '_' + source_stem(file)
     print("Generating AOI file: ", dst_name)
 
     if os.path.exists(dst_name):
@@ -54,6 +69,8 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
 
     dst = nc.Dataset(dst_name, 'w', format='NETCDF3_64BIT')
     dst.title = dst_name + ' created from ' + source_file + ' on ' + formatted_date
+    # per-variable statistics of the AOI data, taken from the blocks as they are written
+    qa = file_qa(dst_name, source_file)
 
     # Copy global attrs
     for name in src.ncattrs():
@@ -76,9 +93,13 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
                 dst[name][...] = src[name][...]
 
             elif len(variable.dimensions) == 2:
-                dst[name][...] = src[name][:, AOI_idx]
+                data = src[name][:, AOI_idx]
+                if qa is not None:
+                    qa.variable(name, variable).update(data)
+                dst[name][...] = data
 
             elif len(variable.dimensions) == 3:
+                stats = qa.variable(name, variable) if qa is not None else None
                 d0, d1, d2 = variable.shape
                 chunk_size = 16
                 num_chunks = d0 // chunk_size + (d0 % chunk_size > 0)
@@ -91,9 +112,10 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
                     source_data = src[name][start:end, :, :]
 
                     print(f"Subsetting source data for chunk {chunk + 1} of {num_chunks}")
-                    for i in range(start, end):
-                        AOI_data = np.copy(source_data[i - start, AOI_mask])
-                        data_arr[i, :, :] = AOI_data[:]
+                    block = source_data[:, :, AOI_idx]
+                    data_arr[start:end, :, :] = block
+                    if stats is not None:
+                        stats.update(block)
 
                 print("Putting back data into netcdf")
                 dst[name][...] = data_arr
@@ -105,9 +127,19 @@ def AOI_forcing_save_1d(input_path, file, AOI, AOI_points, output_path):
 
     src.close()
     dst.close()
+    if qa is not None:
+        qa.close()  # sidecar <dst_name>.qa.json; raises QAError past the thresholds
 
 
 def _discover_tasks(input_path, output_path):
+    # listed from the forcing catalog when available (see forcing_shards.discover_forcing_files)
+    try:
+        from forcing_shards import discover_forcing_files
+    except ImportError:
+        discover_forcing_files = None
+    if discover_forcing_files is not None:
+        return [(input_path if f["dir"] == "." else os.path.join(input_path, f["dir"]), f["file"],
+                 os.path.join(output_path, f["dir"])) for f in discover_forcing_files(input_path)]
     tasks = []
     for root, dirs, files in os.walk(input_path):
         for file in files:
@@ -117,6 +149,39 @@ def _discover_tasks(input_path, output_path):
     return tasks
 
 
+def _process_task(root, file, AOI, AOI_points, new_dir, rank=None, keep_order=False):
+    # subset one file and return its progress event
+    os.makedirs(new_dir, exist_ok=True)
+    rank = os.getpid() if rank is None else rank
+    start = time()
+    AOI_forcing_save_1d(root, file, AOI, AOI_points, new_dir, keep_order)
+    return file_event(rank, root, file, os.path.getsize(os.path.join(root, file)), time() - start)
+
+
+def _total_bytes(tasks):
+    return sum(os.path.getsize(os.path.join(root, file)) for root, file, _ in tasks)
+
+
+def _receive_one(tracker):
+    # a failed rank reports once for all of its files that will never complete
+    event = COMM.recv(source=MPI.ANY_SOURCE, tag=TAG_PROGRESS)
+    tracker.file_done(event)
+    return event.get("unreported", 1)
+
+
+def _drain_progress(tracker):
+    # no listener thread: pick up whatever the other ranks reported so far
+    received = 0
+    while COMM.iprobe(source=MPI.ANY_SOURCE, tag=TAG_PROGRESS):
+        received += _receive_one(tracker)
+    return received
+
+
+def _receive_progress(tracker, count):
+    while count > 0:
+        count -= _receive_one(tracker)
+
+
 def _load_aoi_points(aoi_path, aoi_file):
     full = os.path.join(aoi_path, aoi_file)
     if full.endswith('.csv'):
@@ -148,6 +213,7 @@ def main():
     AOI = aoi_file.split('_')[0]
 
     AOI_points = _load_aoi_points(aoi_path, aoi_file)
+    keep_order = file_cell_order(os.path.join(aoi_path, aoi_file)) != 'source'
 
     # Build the task list and distribute
     if USING_MPI and SIZE > 1:
@@ -158,43 +224,84 @@ def main():
         tasks = COMM.bcast(tasks, root=0)
         local_tasks = [t for i, t in enumerate(tasks) if (i % SIZE) == RANK]
 
+        # ranks report every finished file to rank 0, which keeps the status file;
+        # a listener thread receives them if MPI allows it, otherwise rank 0 drains between files
+        tracker = listener = None
+        pending = []
+        if RANK == 0:
+            tracker = ProgressTracker(len(tasks), _total_bytes(tasks))
+            remote = len(tasks) - len(local_tasks)
+            if MPI.Query_thread() == MPI.THREAD_MULTIPLE:
+                listener = threading.Thread(target=_receive_progress, args=(tracker, remote), daemon=True)
+                listener.start()
+
         start_total = process_time()
-        for root, file, new_dir in local_tasks:
-            os.makedirs(new_dir, exist_ok=True)
-            parts = file.split('.')
-            var_name = parts[4] if len(parts) > 4 else ''
-            period = parts[5] if len(parts) > 5 else ''
-            print(f"[rank {RANK}/{SIZE}] processing {var_name} ({period}) in {file}")
-            start = process_time()
-            AOI_forcing_save_1d(root, file, AOI, AOI_points, new_dir)
-            end = process_time()
-            print(f"[rank {RANK}] Done {file} in {end-start:.2f}s")
+        try:
+            for root, file, new_dir in local_tasks:
+                parts = file.split('.')
+                var_name = parts[4] if len(parts) > 4 else ''
+                period = parts[5] if len(parts) > 5 else ''
+                print(f"[rank {RANK}/{SIZE}] processing {var_name} ({period}) in {file}")
+                start = process_time()
+                try:
+                    event = _process_task(root, file, AOI, AOI_points, new_dir, rank=RANK, keep_order=keep_order)
+                except Exception:
+                    if RANK != 0:
+                        failed = file_event(RANK, root, file, 0, 0.0, failed=True)
+                        failed["unreported"] = len(local_tasks) - len(pending)
+                        COMM.send(failed, dest=0, tag=TAG_PROGRESS)
+                    raise
+                end = process_time()
+                print(f"[rank {RANK}] Done {file} in {end-start:.2f}s")
+                if RANK == 0:
+                    tracker.file_done(event)
+                    if listener is None:
+                        remote -= _drain_progress(tracker)
+                else:
+                    pending.append(COMM.isend(event, dest=0, tag=TAG_PROGRESS))
+        except Exception:
+            if tracker is not None:
+                tracker.finish("failed")
+            raise
         end_total = process_time()
         print(f"[rank {RANK}] Finished {len(local_tasks)} files in {end_total-start_total:.2f}s")
 
+        if RANK == 0:
+            if listener is not None:
+                listener.join()
+            else:
+                _receive_progress(tracker, remote)
+            tracker.finish("failed" if tracker.failed else "finished")
+        else:
+            MPI.Request.Waitall(pending)
+
     else:
         # Local fallback: default 32 workers (override with FORCING_SERIAL_WORKERS)
         tasks = _discover_tasks(input_path, output_path)
         default_workers = int(os.environ.get('FORCING_SERIAL_WORKERS', '32'))
-        if ProcessPoolExecutor is None or default_workers <= 1:
-            for root, file, new_dir in tasks:
-                os.makedirs(new_dir, exist_ok=True)
-                parts = file.split('.')
-                var_name = parts[4] if len(parts) > 4 else ''
-                period = parts[5] if len(parts) > 5 else ''
-                print('processing ' + var_name + '(' + period + ') in the file ' + file)
-                start = process_time()
-                AOI_forcing_save_1d(root, file, AOI, AOI_points, new_dir)
-                end = process_time()
-                print("Generating 1D forcing data for " + AOI + " domain takes {}".format(end-start))
-        else:
-            with ProcessPoolExecutor(max_workers=default_workers) as executor:
-                futures = []
+        tracker = ProgressTracker(len(tasks), _total_bytes(tasks))
+        try:
+            if ProcessPoolExecutor is None or default_workers <= 1:
                 for root, file, new_dir in tasks:
-                    os.makedirs(new_dir, exist_ok=True)
-                    futures.append(executor.submit(AOI_forcing_save_1d, root, file, AOI, AOI_points, new_dir))
-                for fut in as_completed(futures):
-                    fut.result()
+                    parts = file.split('.')
+                    var_name = parts[4] if len(parts) > 4 else ''
+                    period = parts[5] if len(parts) > 5 else ''
+                    print('processing ' + var_name + '(' + period + ') in the file ' + file)
+                    start = process_time()
+                    tracker.file_done(_process_task(root, file, AOI, AOI_points, new_dir, rank=0, keep_order=keep_order))
+                    end = process_time()
+                    print("Generating 1D forcing data for " + AOI + " domain takes {}".format(end-start))
+            else:
+                with ProcessPoolExecutor(max_workers=default_workers) as executor:
+                    futures = []
+                    for root, file, new_dir in tasks:
+                        futures.append(executor.submit(_process_task, root, file, AOI, AOI_points, new_dir, None, keep_order))
+                    for fut in as_completed(futures):
+                        tracker.file_done(fut.result())
+        except Exception:
+            tracker.finish("failed")
+            raise
+        tracker.finish()
 
 
 if __name__ == '__main__':
@@ -10,15 +10,93 @@ import sys, os
 
 from datetime import datetime
 
+from aoi_qa import file_qa
+from tes_grid import aoi_positions, file_cell_order
+
 # Get current date
 current_date = datetime.now()
 # Format date to mmddyyyy
 formatted_date = current_date.strftime('%y%m%d')
 
-def main():
-    args = sys.argv[1:]
+def read_AOI_points(AOI_gridID_file):
+    if (AOI_gridID_file.endswith('gridID.csv')):
+        #AOI_gridcell_file = AOI+'_gridID.csv'  # user provided gridcell IDs
+        df = pd.read_csv(AOI_gridID_file, sep=",", skiprows=1, names = ['gridID'])
+        #read gridIds
+        AOI_points = np.array(df['gridID'])
+    elif 'domain' in AOI_gridID_file and AOI_gridID_file.endswith('.nc'):
+        src = nc.Dataset(AOI_gridID_file, 'r')
+        AOI_points = src['gridID'][:]
+    else:
+        print("Error: Invalid AOI_points_file, see help.")
+    return AOI_points
+
+def create_AOI_surfdata(src, AOIsurfdata, AOI_points):
+    # check if file exists then delete it
+    if os.path.exists(AOIsurfdata):
+        os.remove(AOIsurfdata)
+
+    dst = nc.Dataset(AOIsurfdata, 'w', format='NETCDF3_64BIT')
+
+    # Copy the global attributes from the source to the target
+    for name in src.ncattrs():
+        dst.setncattr(name, src.getncattr(name))
+
+    # Copy the dimensions from the source to the target
+    for name, dimension in src.dimensions.items():
+        if name != 'gridcell':
+            dst.createDimension(
+                name, (len(dimension) if not dimension.isunlimited() else None))
+        else:
+            # Update the 'ni' dimension with the length of the list
+            #dst.dimensions['ni'].set_length(len(AOI_points))
+            ni = dst.createDimension('gridcell', AOI_points.size)
+    return dst
+
+def is_gridcell_variable(variable):
+    return len(variable.dimensions) > 0 and variable.dimensions[-1] == 'gridcell'
+
+def define_variable(dst, src, name, variable):
+    # create the AOI variable with the same layout as the source, attributes included
+    if not is_gridcell_variable(variable):
+        x = dst.createVariable(name, variable.datatype, variable.dimensions)
+        # Copy variable attributes
+        dst[name].setncatts(src[name].__dict__)
+    else:
+        x = dst.createVariable(name, variable.datatype, variable.dimensions[:-1]+('gridcell',))
+        # Copy variable attributes (except _FillValue)
+        attrs = dict(src[name].__dict__)
+        attrs.pop('_FillValue', None)
+        dst[name].setncatts(attrs)
+    return x
+
+def subset_variable(variable, domain_idx):
+    # read one gridcell variable layer by layer and keep the AOI gridcells
+    if len(variable.dimensions) == 1:
+        return variable[domain_idx]
+    if len(variable.dimensions) == 2:
+        data = np.ma.empty((variable.shape[0], domain_idx.size), dtype=variable.dtype)
+        for index in range(variable.shape[0]):
+            # get all the source data (global)
+            data[index,:] = variable[index][domain_idx]
+        return data
+    if len(variable.dimensions) == 3:
+        data = np.ma.empty((variable.shape[0], variable.shape[1], domain_idx.size), dtype=variable.dtype)
+        for index1 in range(variable.shape[0]):
+            for index2 in range(variable.shape[1]):
+                # get all the source data (global)
+                data[index1,index2,:] = variable[index1][index2][domain_idx]
+            print('finished layer#: ' + str(index1))
+        return data
+    raise ValueError(f"Unsupported number of dimensions for {variable.name}: {variable.dimensions}")
+
+def AOI_surfdata_name(output_path, AOI):
+    return output_path +'/'+str(AOI)+'_surfdata.TES_SE.4km.1d.NLCD.c'+ formatted_date +'.nc'
+
+def main(argv=None):
+    args = sys.argv[1:] if argv is None else argv
     # Check the number of arguments
-    if len(sys.argv) != 6  or sys.argv[1] == '--help':  # sys.argv includes the script name as the first argument
+    if len(args) != 5  or args[0] == '--help':
         print("Example use: python TES_AOI_surfdataGEN.py <input_path> <TES_surfdata> <output_path> <AOI_file_path>  <AOI_points_file>")
         print(" <input_path>: path to the 1D surfdata source data directory")
         print(" <TES_surfdata>: 1D TES_surfdata.nc")
@@ -52,30 +130,15 @@ def main():
     # get the full path
     AOI_gridID_file = AOI_gridID_path + AOI_gridID_file
 
-    if (AOI_gridID_file.endswith('gridID.csv')):
-        #AOI_gridcell_file = AOI+'_gridID.csv'  # user provided gridcell IDs
-        df = pd.read_csv(AOI_gridID_file, sep=",", skiprows=1, names = ['gridID'])
-        #read gridIds
-        AOI_points = np.array(df['gridID'])
-    elif 'domain' in AOI_gridID_file and AOI_gridID_file.endswith('.nc'):
-        src = nc.Dataset(AOI_gridID_file, 'r')
-        AOI_points = src['gridID'][:]
-    else:
-        print("Error: Invalid AOI_points_file, see help.")
+    AOI_points = read_AOI_points(AOI_gridID_file)
 
     # save to the 1D domain file
     
-    AOIsurfdata = output_path +'/'+str(AOI)+'_surfdata.TES_SE.4km.1d.NLCD.c'+ formatted_date +'.nc'
+    AOIsurfdata = AOI_surfdata_name(output_path, AOI)
     print("AOIsurfdata:" + AOIsurfdata)
 
-    # check if file exists then delete it
-    if os.path.exists(AOIsurfdata):
-        os.remove(AOIsurfdata)
-
     source_file = input_path+ surfdata_file
 
-    dst = nc.Dataset(AOIsurfdata, 'w', format='NETCDF3_64BIT')
-
     # open the 1D domain data
     src = nc.Dataset(source_file, 'r', format='NETCDF3_64BIT')
 
@@ -84,75 +147,35 @@ def main():
     TES_gridcell_list = list(TES_gridIDs)
     print(TES_gridcell_list[0:5])
 
-    # get the index of AOI_points in the TES_gridcell_list
-    domain_idx = np.where(np.in1d(TES_gridcell_list, AOI_points))[0]
+    # get the index of AOI_points in the TES_gridcell_list (in AOI domain order if it has a cell_order)
+    domain_idx = aoi_positions(TES_gridIDs, AOI_points, file_cell_order(AOI_gridID_file) != 'source')
 
     # domain_idx = np.sort(domain_idx).squeeze()
     print("gridID_idx", domain_idx[0:10])
 
-    # Copy the global attributes from the source to the target
-    for name in src.ncattrs():
-        dst.setncattr(name, src.getncattr(name))
-
-    # Copy the dimensions from the source to the target
-    for name, dimension in src.dimensions.items():
-        if name != 'gridcell':
-            dst.createDimension(
-                name, (len(dimension) if not dimension.isunlimited() else None))
-        else:
-            # Update the 'ni' dimension with the length of the list
-            #dst.dimensions['ni'].set_length(len(AOI_points))
-            ni = dst.createDimension('gridcell', AOI_points.size)
+    dst = create_AOI_surfdata(src, AOIsurfdata, AOI_points)
+    # per-variable statistics of the AOI data, written to <AOIsurfdata>.qa.json
+    qa = file_qa(AOIsurfdata, source_file)
 
     count = 0 # record how may 2D layers have been processed 
     
     # Copy the variables from the source to the target
     for name, variable in src.variables.items():
 
-        if (len(variable.dimensions) == 0 or variable.dimensions[-1] != 'gridcell'):
-            x = dst.createVariable(name, variable.datatype, variable.dimensions)   
-            print(name, variable.dimensions)
-            # Copy variable attributes
-            dst[name].setncatts(src[name].__dict__)
+        define_variable(dst, src, name, variable)
+        print(name, dst[name].dimensions)
+
+        if not is_gridcell_variable(variable):
             # Copy the data
             dst[name][...] = src[name][...]
-
         else:
-            if len(variable.dimensions) == 1:
-                x = dst.createVariable(name, variable.datatype, ('gridcell',))   
-                print(name, dst[name].dimensions)           
-                dst[name][:] = src[name][domain_idx]
-            if len(variable.dimensions) == 2:
-                x = dst.createVariable(name, variable.datatype, variable.dimensions[:-1]+('gridcell',))   
-                print(name, dst[name].dimensions)               
-                for index in range(variable.shape[0]):
-                    # get all the source data (global)
-                    dst[name][index,:] = src[name][index][domain_idx]
-
-                    count = count +1
-
-            if len(variable.dimensions) == 3:
-                x = dst.createVariable(name, variable.datatype, variable.dimensions[:-1]+('gridcell',))   
-                print(name, dst[name].dimensions)   
-                for index1 in range(variable.shape[0]):
-                    for index2 in range(variable.shape[1]):
-                        # get all the source data (global)
-                        dst[name][index1,index2,:] = src[name][index1][index2][domain_idx]
-                    print('finished layer#: ' + str(index1))    
-                    count = count + variable.shape[1]
-
-            # Copy variable attributes (except _FillValue)
-            attrs = dict(src[name].__dict__)
-            attrs.pop('_FillValue', None)
-            dst[name].setncatts(attrs)
-
-        #if count > 80:
-            #dst.close()   # output the variable into a file to save memory
-
-            #dst = nc.Dataset(AOIsurfdata, 'a')
-
-            #count = 0
-        
+            data = subset_variable(variable, domain_idx)
+            if qa is not None:
+                qa.variable(name, variable).update(data)
+            dst[name][...] = data
+            if len(variable.dimensions) > 1:
+                count = count + int(np.prod(variable.shape[:-1]))
+
         print(count)
 
     dst.title = '1D surfdata for '+ AOI +', generated on ' +formatted_date + ' with ' + source_file
@@ -162,6 +185,8 @@ def main():
 
     # Save the target netCDF file
     dst.close()
+    if qa is not None:
+        qa.close()  # raises QAError past the configured thresholds
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,211 @@
+
+# TES_AOI_surfdataGEN_mpi: variable-parallel surfdata subsetting (MPI ranks or a local process pool)
+#
+# Workers each subset a share of the gridcell variables (balanced by source bytes) and
+# stream the AOI arrays to a single writer (rank 0 / the parent process) that owns the
+# output file. Arguments are identical to TES_AOI_surfdataGEN.py.
+
+import os, sys
+import netCDF4 as nc
+import numpy as np
+from time import process_time, time
+
+from aoi_qa import file_qa
+from tes_grid import aoi_positions, file_cell_order
+
+from TES_AOI_surfdataGEN import (
+    AOI_surfdata_name,
+    create_AOI_surfdata,
+    define_variable,
+    formatted_date,
+    is_gridcell_variable,
+    read_AOI_points,
+    subset_variable,
+)
+
+# Try MPI first
+try:
+    from mpi4py import MPI  # type: ignore
+    COMM = MPI.COMM_WORLD
+    RANK = COMM.Get_rank()
+    SIZE = COMM.Get_size()
+    USING_MPI = True
+except Exception:
+    COMM = None
+    RANK = 0
+    SIZE = 1
+    USING_MPI = False
+
+# Local CPU fallback
+try:
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+except Exception:
+    ProcessPoolExecutor = None
+    as_completed = None
+
+TAG_DATA = 11
+
+
+def variable_nbytes(variable):
+    return int(np.prod(variable.shape, dtype=np.int64)) * variable.dtype.itemsize
+
+
+def balance_by_bytes(items, nbins):
+    """Greedy longest-processing-time split of (name, nbytes) items into nbins lists."""
+    bins = [[] for _ in range(max(1, nbins))]
+    loads = [0] * len(bins)
+    for name, nbytes in sorted(items, key=lambda item: item[1], reverse=True):
+        k = loads.index(min(loads))
+        bins[k].append(name)
+        loads[k] += nbytes
+    return bins, loads
+
+
+def _plan_variables(source_file):
+    src = nc.Dataset(source_file, 'r')
+    items = [(name, variable_nbytes(variable)) for name, variable in src.variables.items()
+             if is_gridcell_variable(variable)]
+    src.close()
+    return items
+
+
+def _subset_worker(source_file, name, domain_idx):
+    # executed in a worker: returns the AOI array for one gridcell variable
+    src = nc.Dataset(source_file, 'r')
+    start = process_time()
+    data = subset_variable(src[name], domain_idx)
+    src.close()
+    return name, data, process_time() - start
+
+
+def _prepare_output(source_file, AOIsurfdata, AOI_points, keep_order=False):
+    """Open the source, create the AOI file with every variable defined and the
+    non-gridcell variables already copied. Returns (src, dst, domain_idx)."""
+    src = nc.Dataset(source_file, 'r', format='NETCDF3_64BIT')
+
+    TES_gridIDs = src.variables['gridID'][:]
+    domain_idx = aoi_positions(TES_gridIDs, AOI_points, keep_order)
+    print("gridID_idx", domain_idx[0:10])
+
+    dst = create_AOI_surfdata(src, AOIsurfdata, AOI_points)
+    # define all variables up front so the writer never re-enters define mode
+    for name, variable in src.variables.items():
+        define_variable(dst, src, name, variable)
+    for name, variable in src.variables.items():
+        if not is_gridcell_variable(variable):
+            dst[name][...] = src[name][...]
+    return src, dst, domain_idx
+
+
+def _write_variable(src, dst, qa, name, data):
+    # the writer also keeps the QA statistics, so workers only subset
+    if qa is not None:
+        qa.variable(name, src[name]).update(data)
+    dst[name][...] = data
+
+
+def _finish_output(src, dst, AOI, source_file, qa=None):
+    dst.title = '1D surfdata for '+ AOI +', generated on ' +formatted_date + ' with ' + source_file
+    src.close()
+    dst.close()
+    if qa is not None:
+        qa.close()  # <AOIsurfdata>.qa.json; raises QAError past the configured thresholds
+
+
+def run_mpi(source_file, AOIsurfdata, AOI, AOI_points, keep_order=False):
+    # rank 0 writes; ranks 1..SIZE-1 subset variables and send them to rank 0
+    nworkers = SIZE - 1
+    if RANK == 0:
+        items = _plan_variables(source_file)
+        bins, loads = balance_by_bytes(items, nworkers)
+        for k, load in enumerate(loads):
+            print(f"[rank {k + 1}/{SIZE}] assigned {len(bins[k])} variables, {load / 1e6:.1f} MB")
+        src, dst, domain_idx = _prepare_output(source_file, AOIsurfdata, AOI_points, keep_order)
+        qa = file_qa(AOIsurfdata, source_file)
+    else:
+        bins = None
+        domain_idx = None
+    bins = COMM.bcast(bins, root=0)
+    domain_idx = COMM.bcast(domain_idx, root=0)
+
+    if RANK == 0:
+        start = time()
+        expected = sum(len(b) for b in bins)
+        status = MPI.Status()
+        for received in range(expected):
+            name, data = COMM.recv(source=MPI.ANY_SOURCE, tag=TAG_DATA, status=status)
+            _write_variable(src, dst, qa, name, data)
+            print(f"[rank 0] wrote {name} from rank {status.Get_source()} ({received + 1}/{expected})")
+        _finish_output(src, dst, AOI, source_file, qa)
+        print(f"[rank 0] Finished {expected} gridcell variables in {time() - start:.2f}s")
+    else:
+        src = nc.Dataset(source_file, 'r')
+        for name in bins[RANK - 1]:
+            start = process_time()
+            data = subset_variable(src[name], domain_idx)
+            COMM.send((name, data), dest=0, tag=TAG_DATA)
+            print(f"[rank {RANK}] subset {name} in {process_time() - start:.2f}s")
+        src.close()
+
+
+def run_local(source_file, AOIsurfdata, AOI, AOI_points, workers, keep_order=False):
+    src, dst, domain_idx = _prepare_output(source_file, AOIsurfdata, AOI_points, keep_order)
+    qa = file_qa(AOIsurfdata, source_file)
+    items = _plan_variables(source_file)
+    start = time()
+    if ProcessPoolExecutor is None or workers <= 1:
+        for name, _ in items:
+            _write_variable(src, dst, qa, name, subset_variable(src[name], domain_idx))
+            print(name, dst[name].dimensions)
+    else:
+        # largest variables first so the pool stays balanced
+        ordered = sorted(items, key=lambda item: item[1], reverse=True)
+        with ProcessPoolExecutor(max_workers=min(workers, len(ordered))) as executor:
+            futures = [executor.submit(_subset_worker, source_file, name, domain_idx) for name, _ in ordered]
+            for fut in as_completed(futures):
+                name, data, elapsed = fut.result()
+                _write_variable(src, dst, qa, name, data)
+                print(f"wrote {name} {dst[name].dimensions} (subset in {elapsed:.2f}s)")
+    _finish_output(src, dst, AOI, source_file, qa)
+    print(f"Finished {len(items)} gridcell variables in {time() - start:.2f}s")
+
+
+def main():
+    args = sys.argv[1:]
+    if len(sys.argv) != 6 or sys.argv[1] == '--help':
+        print("Example use: python TES_AOI_surfdataGEN_mpi.py <input_path> <TES_surfdata> <output_path> <AOI_file_path>  <AOI_points_file>")
+        print(" <input_path>: path to the 1D surfdata source data directory")
+        print(" <TES_surfdata>: 1D TES_surfdata.nc")
+        print(" <output_path>:  path for the 1D AOI surface data directory")
+        print(" <AOI_file_path>:  path to the <AOI_points_files>")
+        print(" <AOI_points_file>:  <AOI>_gridID.csv or <AOI>_domain.nc")
+        print(" Runs on MPI ranks under srun (rank 0 writes), otherwise on SURFDATA_SERIAL_WORKERS local processes")
+        sys.exit(0)
+
+    input_path = args[0]
+    if not input_path.endswith("/"): input_path += '/'
+    surfdata_file = args[1]
+    output_path = args[2]
+    if not output_path.endswith("/"): output_path += '/'
+    AOI_gridID_path = args[3]
+    AOI_gridID_file = args[4]
+    AOI = AOI_gridID_file.split("_")[0]
+
+    source_file = input_path + surfdata_file
+    AOI_points = read_AOI_points(AOI_gridID_path + AOI_gridID_file) if RANK == 0 else None
+    # an AOI domain with a cell_order attribute fixes the gridcell order of the output
+    keep_order = RANK == 0 and file_cell_order(AOI_gridID_path + AOI_gridID_file) != 'source'
+    AOIsurfdata = AOI_surfdata_name(output_path, AOI)
+    if RANK == 0:
+        print("AOIsurfdata:" + AOIsurfdata)
+
+    if USING_MPI and SIZE > 1:
+        run_mpi(source_file, AOIsurfdata, AOI, AOI_points, keep_order)
+    else:
+        # Local fallback: default 8 workers (override with SURFDATA_SERIAL_WORKERS)
+        workers = int(os.environ.get('SURFDATA_SERIAL_WORKERS', '8'))
+        run_local(source_file, AOIsurfdata, AOI, AOI_points, workers, keep_order)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,8 @@ import matplotlib.pyplot as plt
 import rasterio
 from rasterio.transform import from_origin
 
+from tes_scatter import ScatterIndex
+
 # Step 1: Read the domain file for the mask
 mask_filename = 'mask.nc'  # Replace with your file path if needed
 mask_dataset = nc.Dataset(mask_filename)
@@ -13,22 +15,9 @@ x_coords = mask_dataset.variables['x'][:]  # x coordinate values
 y_coords = mask_dataset.variables['y'][:]  # y coordinate values
 gridID = mask_dataset.variables['gridID'][:].compressed()  # gridID values
 
-# Create an array with the same dimensions as the 2D domain
-active_array = np.zeros((len(y_coords), len(x_coords)), dtype=int)
-
-# Flatten the active_array to 1D
-flattened_active_array = active_array.flatten()
-
-# Create a set for active grid IDs
-active_grid_ids = set(gridID)  # Using a set for faster lookup
-
-# Update the flattened active array based on active grid IDs
-for grid_id in gridID:
-    if grid_id < flattened_active_array.size:  # Ensure grid_id is within bounds
-        flattened_active_array[grid_id] = 1
-
-# Reshape the flattened array back to 2D
-reshaped_active_array = flattened_active_array.reshape(active_array.shape)
+# Precompute the 2D positions of the grid IDs once (cached per mask file)
+index = ScatterIndex.from_mask(mask_filename)
+reshaped_active_array = index.active()
 
 # Step 3: Read the variable data from the data.nc file
 data_filename = 'data.nc'  # Replace with your file path if needed
@@ -43,13 +32,12 @@ while True:
     
     try:
         variable_data = data_dataset.variables[variable_name][:]  # Get the data variable
-        variable_data = variable_data.compressed()  # Assuming same compression as gridID
+        variable_data = index.cells(variable_data)  # Same compression as gridID, per time step if any
+        if variable_data.ndim > 1:
+            variable_data = variable_data.reshape(-1, index.ncells)[0]  # first time step
         
-        # Step 4: Create a masked version of the variable data
-        masked_variable_data = np.full(active_array.shape, np.nan)  # Fill with NaN
-        for i, grid_id in enumerate(gridID):
-            if grid_id < masked_variable_data.size:  # Ensure grid_id is within bounds
-                masked_variable_data[np.unravel_index(grid_id, masked_variable_data.shape)] = variable_data[i]
+        # Step 4: Create a masked version of the variable data (NaN outside the grid IDs)
+        masked_variable_data = index.fill(variable_data)
 
         # Step 5: Plot the data
         # Use a pcolormesh or imshow depending on the type of plot you want
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""Content-addressed store of AOI outputs shared across experiments.
+
+An entry holds the outputs of one stage (domain, surfdata or forcing) under a key
+
+    sha256(stage, source file identity, AOI gridID set, generator scripts, output options)
+
+so re-preparing the same AOI against the same sources, in the same or another
+experiment, links the cached files into <experiment_root> instead of regenerating
+them. Files are hard-linked (symlinked across file systems) and keep their permissions;
+the generators always delete an existing output before writing it, so a rerun never
+modifies a cached inode. The QA sidecars (<output>.qa.json, aoi_qa.py) of the outputs
+are stored and restored with them.
+
+Layout of the store (default: <experiment_root>/../.aoi_cache, or $AOI_CACHE_DIR):
+
+    objects/<key>/manifest.json
+    objects/<key>/files/<path relative to experiment_root>
+
+The manifest mtime is the last use; entries are evicted least recently used first
+once the store exceeds its size cap (cache.max_gb, default 200). Entries that an
+experiment still reaches through symlinks are never evicted.
+
+Example use:
+  python3 aoi_cache.py --dir <cache_dir> list
+  python3 aoi_cache.py --dir <cache_dir> evict --max-gb 100
+"""
+
+import argparse
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+CACHE_DIR_ENV = "AOI_CACHE_DIR"
+CACHED_STAGES = ("domain", "surfdata", "forcing")
+DEFAULT_MAX_GB = 200
+OUTPUT_FORMAT = "NETCDF3_64BIT"
+
+
+def cache_settings(cfg: dict) -> dict:
+    """Cache options from the optional "cache" config section and $AOI_CACHE_DIR."""
+    section = cfg.get("cache", {})
+    exp_root = Path(cfg["experiment_root"]).expanduser()
+    root = os.environ.get(CACHE_DIR_ENV) or section.get("dir") or (exp_root.parent / ".aoi_cache").as_posix()
+    return {
+        "enabled": bool(section.get("enabled", True)),
+        "dir": Path(root).expanduser(),
+        "max_bytes": int(float(section.get("max_gb", DEFAULT_MAX_GB)) * 1024 ** 3),
+        "link": section.get("link", "hardlink"),
+    }
+
+
+def gridid_set_digest(aoi_path: Path) -> str:
+    """Hash of the sorted unique AOI gridIDs, so renamed or reordered lists share entries.
+    Point lists given by coordinates (xcyc csv) are hashed by content."""
+    import numpy as np
+    name = aoi_path.name
+    if name.endswith("gridID.csv") or ("domain" in name and name.endswith(".nc")):
+        from TES_AOI_surfdataGEN import read_AOI_points
+        gridids = np.unique(np.asarray(read_AOI_points(aoi_path.as_posix()), dtype=np.int64))
+        return hashlib.sha256(gridids.tobytes()).hexdigest()
+    from aoi_pipeline import _sha256_file
+    return _sha256_file(aoi_path)
+
+
+def cache_key(stage, cfg: dict, scripts_dir: Path, gridid_digest: str) -> str:
+    from aoi_pipeline import input_identity
+
+    aoi_path = Path(cfg["aoi_points"]["dir"]).expanduser() / cfg["aoi_points"]["file"]
+    payload = {
+        "stage": stage.name,
+        # the AOI list itself enters through its gridID set, not its path or content
+        "sources": [input_identity(p) for p in stage.inputs
+                    if Path(p).expanduser() != aoi_path and not str(p).endswith(".json")],
+        "gridids": gridid_digest,
+        "generators": [input_identity(scripts_dir / s)[1] for s in stage.scripts],
+        "options": {"aoi_name": cfg["aoi_points"]["file"].split("_")[0], "format": OUTPUT_FORMAT},
+    }
+    if cfg.get("cell_order", "source") != "source":
+        # every output follows the AOI domain's gridcell order
+        payload["options"]["cell_order"] = cfg["cell_order"]
+    blob = json.dumps(payload, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+def _link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        shutil.copy2(src, dst)
+
+
+class AOICache:
+    def __init__(self, root: Path, max_bytes: int = DEFAULT_MAX_GB * 1024 ** 3, link: str = "hardlink"):
+        self.root = Path(root)
+        self.objects = self.root / "objects"
+        self.max_bytes = max_bytes
+        self.link = link
+
+    def _lock(self):
+        self.root.mkdir(parents=True, exist_ok=True)
+        lock = open(self.root / ".lock", "w")
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def _manifest_path(self, key: str) -> Path:
+        return self.objects / key / "manifest.json"
+
+    def lookup(self, key: str):
+        path = self._manifest_path(key)
+        if not path.exists():
+            return None
+        manifest = json.loads(path.read_text())
+        files = self.objects / key / "files"
+        if not all((files / f["path"]).exists() for f in manifest["files"]):
+            return None
+        return manifest
+
+    def materialize(self, key: str, exp_root: Path) -> list:
+        """Link the files of a cached entry into exp_root; returns the linked paths (None on a miss)."""
+        manifest = self.lookup(key)
+        if manifest is None:
+            return None
+        files = self.objects / key / "files"
+        linked, symlinked = [], False
+        for f in manifest["files"]:
+            src, dst = files / f["path"], exp_root / f["path"]
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            if dst.exists() and os.path.samefile(src, dst):
+                linked.append(dst)
+                continue
+            if dst.exists() or dst.is_symlink():
+                dst.unlink()
+            if self.link == "symlink":
+                os.symlink(src, dst)
+                symlinked = True
+            else:
+                try:
+                    os.link(src, dst)
+                except OSError as e:
+                    if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                        raise
+                    os.symlink(src, dst)
+                    symlinked = True
+            linked.append(dst)
+        with self._lock():
+            if symlinked:
+                manifest.setdefault("symlinked_into", [])
+                if exp_root.as_posix() not in manifest["symlinked_into"]:
+                    manifest["symlinked_into"].append(exp_root.as_posix())
+            manifest["hits"] = manifest.get("hits", 0) + 1
+            self._write_manifest(key, manifest)
+        return linked
+
+    def _write_manifest(self, key: str, manifest: dict) -> None:
+        path = self._manifest_path(key)
+        tmp = path.with_name(f"manifest.json.{os.getpid()}")
+        tmp.write_text(json.dumps(manifest, indent=1) + "\n")
+        os.replace(tmp, path)  # also refreshes the mtime used for LRU
+
+    def store(self, key: str, stage: str, exp_root: Path, patterns: list, description: str = "") -> dict:
+        """Add the files of exp_root matching patterns (and their QA sidecars) as entry key;
+        evicts down to the size cap."""
+        from aoi_qa import SIDECAR_SUFFIX
+
+        paths = {p for pattern in patterns for p in exp_root.glob(pattern) if p.is_file()}
+        paths |= {q for p in paths for q in [p.with_name(p.name + SIDECAR_SUFFIX)] if q.is_file()}
+        paths = sorted(paths)
+        if not paths or self.lookup(key) is not None:
+            return self.lookup(key)
+        tmp = self.objects / f".tmp-{key}-{os.getpid()}"
+        if tmp.exists():
+            shutil.rmtree(tmp)
+        entries = []
+        for p in paths:
+            rel = p.relative_to(exp_root)
+            dst = tmp / "files" / rel
+            dst.parent.mkdir(parents=True, exist_ok=True)
+            _link_or_copy(p.resolve(), dst)
+            entries.append({"path": rel.as_posix(), "size": dst.stat().st_size})
+        manifest = {
+            "key": key,
+            "stage": stage,
+            "description": description,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "source_experiment": exp_root.as_posix(),
+            "bytes": sum(e["size"] for e in entries),
+            "files": entries,
+        }
+        (tmp / "manifest.json").write_text(json.dumps(manifest, indent=1) + "\n")
+        with self._lock():
+            final = self.objects / key
+            if final.exists():
+                shutil.rmtree(tmp)  # stored concurrently by another experiment
+            else:
+                os.replace(tmp, final)
+        self.evict()
+        return manifest
+
+    def entries(self) -> list:
+        if not self.objects.exists():
+            return []
+        result = []
+        for entry in os.scandir(self.objects):
+            path = Path(entry.path) / "manifest.json"
+            if entry.name.startswith(".") or not path.exists():
+                continue
+            manifest = json.loads(path.read_text())
+            manifest["last_used"] = path.stat().st_mtime
+            result.append(manifest)
+        return sorted(result, key=lambda m: m["last_used"])
+
+    def _in_use(self, manifest: dict) -> bool:
+        prefix = (self.objects / manifest["key"]).as_posix() + os.sep
+        for exp in manifest.get("symlinked_into", []):
+            for f in manifest["files"]:
+                p = Path(exp) / f["path"]
+                if p.is_symlink() and os.readlink(p).startswith(prefix):
+                    return True
+        return False
+
+    def evict(self, max_bytes: int = None) -> list:
+        """Remove least recently used entries until the store fits in max_bytes."""
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        removed = []
+        with self._lock():
+            entries = self.entries()
+            total = sum(m["bytes"] for m in entries)
+            for manifest in entries:
+                if total <= max_bytes:
+                    break
+                if self._in_use(manifest):
+                    continue
+                shutil.rmtree(self.objects / manifest["key"])
+                total -= manifest["bytes"]
+                removed.append(manifest["key"])
+        return removed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Inspect and trim the shared AOI output cache.")
+    parser.add_argument("--dir", default=os.environ.get(CACHE_DIR_ENV), required=CACHE_DIR_ENV not in os.environ,
+                        help=f"Cache directory (default: ${CACHE_DIR_ENV})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="List entries, least recently used first")
+    p_evict = sub.add_parser("evict", help="Evict least recently used entries down to a size cap")
+    p_evict.add_argument("--max-gb", type=float, default=DEFAULT_MAX_GB)
+    args = parser.parse_args()
+
+    cache = AOICache(Path(args.dir).expanduser())
+    if args.command == "list":
+        entries = cache.entries()
+        for m in entries:
+            used = datetime.fromtimestamp(m["last_used"]).isoformat(timespec="seconds")
+            print(f"{m['key'][:16]}  {m['stage']:9s} {m['bytes'] / 1e9:8.2f} GB  {len(m['files']):5d} files  "
+                  f"hits {m.get('hits', 0):3d}  last used {used}  {m.get('description', '')}")
+        print(f"{len(entries)} entries, {sum(m['bytes'] for m in entries) / 1e9:.2f} GB")
+    elif args.command == "evict":
+        removed = cache.evict(int(args.max_gb * 1024 ** 3))
+        print(f"Evicted {len(removed)} entries")
+
+
+if __name__ == "__main__":
+    main()
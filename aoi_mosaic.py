@@ -0,0 +1,449 @@
+#!/usr/bin/env python3
+"""Mosaic the 1D outputs of many AOI (or tile) experiments onto the 2D TES raster.
+
+Every input is a 1D AOI file - domain, surfdata, forcing or ELM history - whose gridcells
+are given by its gridID variable or, for ELM history (lndgrid), by the AOI domain of the
+run. The raster is recovered from the entire-domain base domain (tes_grid.TESGrid) and
+each input's gridID -> raster position index is built once, so every variable and time
+step is placed with one vectorized assignment instead of per-cell loops.
+
+Inputs are grouped by file name with the AOI token removed, so
+<tile>_clmforc...PRECTmms.1980-01.nc of all tiles become one clmforc...PRECTmms.1980-01.nc
+mosaic. Within a group the inputs are read in parallel by worker processes, time chunk by
+time chunk; the main process scatters and writes the (..., y, x) outputs.
+
+Cells present in several inputs (overlapping AOIs) are resolved before any data is read,
+in the sorted order of the input paths: --overlap first (default) keeps the first input
+holding the cell, last the last one, mean averages floating-point variables over the
+inputs holding a value that is not the fill value (integer variables keep the first).
+Values are copied as stored, so packed variables keep their integers, scale_factor and
+add_offset. The result does not depend on the number of workers.
+
+Outputs are NetCDF with x/y LCC coordinates, the lambert_conformal_conic grid mapping and
+the raster window of all inputs (or the whole raster with --full). --geotiff also writes
+one multiband GeoTIFF stack per variable (rasterio, see geotiff_export.py).
+
+Example use:
+  python3 aoi_mosaic.py --domain <base_domain.nc> --output-dir mosaic A/domain_surfdata/A_surfdata*.nc B/domain_surfdata/B_surfdata*.nc
+  python3 aoi_mosaic.py --manifest <experiment_root>/tiles.json --output-dir mosaic 'forcing/*/*.nc' --workers 16
+  python3 aoi_mosaic.py --manifest <experiment_root>/tiles.json --output-dir mosaic 'run/*.elm.h0.*.nc' --variables GPP TSA --geotiff
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import time
+
+import numpy as np
+import netCDF4 as nc
+
+from tes_grid import GRID_MAPPING, TESGrid
+
+CELL_DIMS = ("gridcell", "lndgrid", "ni")  # 1D layouts; ("nj", "ni") with nj = 1 for domain/forcing
+OVERLAP = ("first", "last", "mean")
+TIME_CHUNK = 32  # time steps read and scattered together
+
+_INPUTS = None
+
+
+class MosaicInput:
+    """One 1D AOI file: its gridIDs, cell dimensions and the raster cells it owns in the mosaic."""
+
+    def __init__(self, path, aoi, gridid, cell_dims):
+        self.path = path
+        self.aoi = aoi
+        self.gridid = np.asarray(gridid, dtype=np.int64)
+        self.cell_dims = tuple(cell_dims)
+        self.keep = np.arange(self.gridid.size)  # cells written by this input (after overlaps)
+        self.flat = None  # their flat positions in the output window
+        self.rank = None  # position in the list shared with the reader processes
+
+    @property
+    def ncells(self):
+        return self.gridid.size
+
+
+def file_aoi(path):
+    # the AOI name is the filename prefix before the first '_'
+    return os.path.basename(path).split("_")[0]
+
+
+def cell_dims(src, ncells):
+    """Dimensions holding the gridcells of a 1D AOI file."""
+    dims = src.dimensions
+    if "nj" in dims and "ni" in dims and len(dims["nj"]) * len(dims["ni"]) == ncells:
+        return ("nj", "ni")
+    for name in CELL_DIMS:
+        if name in dims and len(dims[name]) == ncells:
+            return (name,)
+    raise ValueError(f"{src.filepath()}: no dimension of {ncells} gridcells ({', '.join(dims)})")
+
+
+def domain_gridids(domain_files):
+    """gridIDs of AOI domains by AOI name, for inputs without a gridID variable (ELM history)."""
+    gridids = {}
+    for path in domain_files:
+        with nc.Dataset(path, "r") as src:
+            gridids[file_aoi(path)] = np.asarray(src["gridID"][:]).reshape(-1)
+    return gridids
+
+
+def _history_aoi(path, ncells, domains):
+    # ELM case names embed the experiment id as a '_'/'.'-separated token
+    tokens = set(re.split(r"[_.]", os.path.basename(path)))
+    matches = [aoi for aoi, ids in domains.items() if aoi in tokens and ids.size == ncells]
+    if len(matches) != 1:
+        raise ValueError(f"{path}: {'no' if not matches else 'more than one'} AOI domain of {ncells} cells "
+                         f"matches the file name (known: {', '.join(sorted(domains)) or 'none'})")
+    return matches[0]
+
+
+def open_input(path, domains):
+    with nc.Dataset(path, "r") as src:
+        if "gridID" in src.variables:
+            gridid = np.asarray(src["gridID"][:]).reshape(-1)
+            aoi = file_aoi(path)
+        else:
+            size = max((len(src.dimensions[d]) for d in CELL_DIMS if d in src.dimensions), default=0)
+            aoi = _history_aoi(path, size, domains)
+            gridid = domains[aoi]
+        return MosaicInput(path, aoi, gridid, cell_dims(src, gridid.size))
+
+
+def group_key(item):
+    # file name without the AOI token: the same product of every AOI maps to one output
+    name = os.path.basename(item.path)
+    parts = [p for p in re.split(r"(_)", name)]
+    for i, part in enumerate(parts):
+        if part == item.aoi or part.startswith(item.aoi + "."):
+            parts[i] = part[len(item.aoi):]
+            break
+    return re.sub(r"_+", "_", "".join(parts)).strip("_").lstrip(".") or name
+
+
+def raster_window(grid, inputs, full=False):
+    """(r0, r1, c0, c1) of the raster holding every input cell (end exclusive)."""
+    if full:
+        return (0, grid.nrows, 0, grid.ncols)
+    rows, cols = grid.rowcol(np.concatenate([item.gridid for item in inputs]))
+    return (int(rows.min()), int(rows.max()) + 1, int(cols.min()), int(cols.max()) + 1)
+
+
+def resolve_overlaps(grid, window, inputs, overlap="first"):
+    """Set keep/flat of every input of a group; returns the number of cells held by several inputs."""
+    r0, r1, c0, c1 = window
+    nx = c1 - c0
+    flats = []
+    for item in inputs:
+        rows, cols = grid.rowcol(item.gridid)
+        inside = (rows >= r0) & (rows < r1) & (cols >= c0) & (cols < c1)
+        flats.append(np.where(inside, (rows - r0) * nx + (cols - c0), -1))
+    size = (r1 - r0) * nx
+    count = np.zeros(size, dtype=np.int32)
+    owner = np.full(size, -1, dtype=np.int64)
+    ranks = range(len(inputs)) if overlap == "last" else range(len(inputs) - 1, -1, -1)
+    for rank in ranks:
+        flat = flats[rank][flats[rank] >= 0]
+        count[flat] += 1
+        owner[flat] = rank  # the last assignment wins: ranks run so that the preferred input comes last
+    for rank, (item, flat) in enumerate(zip(inputs, flats)):
+        valid = flat >= 0
+        if overlap == "mean":
+            item.keep = np.flatnonzero(valid)
+        else:
+            item.keep = np.flatnonzero(valid & (owner[np.maximum(flat, 0)] == rank))
+        item.flat = flat[item.keep]
+    return int((count > 1).sum())
+
+
+def _init_worker(inputs):
+    global _INPUTS
+    _INPUTS = inputs
+
+
+def _cell_axis(dims, cells):
+    axis = dims.index(cells[0])
+    if dims[axis:axis + len(cells)] != cells:
+        raise ValueError(f"cell dimensions {cells} are not adjacent in {dims}")
+    return axis
+
+
+def read_cells(rank, variable, steps=None):
+    """Kept cells of one variable of input rank as (..., nkeep), optionally for a slice of time steps."""
+    item = _INPUTS[rank]
+    with nc.Dataset(item.path, "r") as src:
+        src.set_auto_maskandscale(False)  # stored values: packed integers stay packed, fills stay fills
+        var = src[variable]
+        data = var[steps] if steps is not None else var[...]
+        axis = _cell_axis(var.dimensions, item.cell_dims)
+    data = data.reshape(data.shape[:axis] + (-1,) + data.shape[axis + len(item.cell_dims):])
+    return np.moveaxis(data, axis, -1)[..., item.keep]
+
+
+def _is_record(var):
+    return bool(var.dimensions) and var.dimensions[0] == "time"
+
+
+def _fill_value(var):
+    if "_FillValue" in var.ncattrs():
+        return var.getncattr("_FillValue")
+    return nc.default_fillvals.get(var.dtype.str[1:], None)
+
+
+def plan_variables(src, item, variables=None):
+    """(cell variables, other variables) of the first input of a group."""
+    cell, other = [], []
+    for name, var in src.variables.items():
+        if var.dtype.kind not in "iuf" and item.cell_dims[0] in var.dimensions:
+            continue
+        if item.cell_dims[0] in var.dimensions:
+            if variables is None or name in variables:
+                cell.append(name)
+        elif variables is None or name in variables or not var.dimensions or name in src.dimensions:
+            other.append(name)
+    return cell, other
+
+
+def _time_runs(ntime, size=TIME_CHUNK):
+    return [slice(t, min(t + size, ntime)) for t in range(0, ntime, size)]
+
+
+def _create_output(path, first, item, grid, window, fmt):
+    r0, r1, c0, c1 = window
+    if os.path.exists(path):
+        os.remove(path)
+    dst = nc.Dataset(path, "w", format=fmt)
+    dst.setncatts({k: first.getncattr(k) for k in first.ncattrs()})
+    for name, dim in first.dimensions.items():
+        if name not in item.cell_dims:
+            dst.createDimension(name, None if dim.isunlimited() else len(dim))
+    dst.createDimension("y", r1 - r0)
+    dst.createDimension("x", c1 - c0)
+    rows, cols = np.arange(r0, r1), np.arange(c0, c1)
+    for name, values, axis in (("y", grid.y0 - rows * grid.dy, "Y"), ("x", grid.x0 + cols * grid.dx, "X")):
+        if name in first.variables:
+            continue
+        var = dst.createVariable(name, "f8", (name,))
+        var.setncatts({"units": "m", "axis": axis, "long_name": f"{name} coordinate of the LCC projection"})
+        var[:] = values
+    if GRID_MAPPING not in first.variables and grid.mapping_attrs:
+        var = dst.createVariable(GRID_MAPPING, "i4", ())
+        var.setncatts(grid.mapping_attrs)
+    return dst
+
+
+class _Inline:
+    """Executor stand-in for --workers 1: runs the read at once, in this process."""
+
+    class _Done:
+        def __init__(self, value):
+            self.value = value
+
+        def result(self):
+            return self.value
+
+    def submit(self, fn, *args):
+        return self._Done(fn(*args))
+
+
+def _output_dims(var, item):
+    axis = _cell_axis(var.dimensions, item.cell_dims)
+    return var.dimensions[:axis] + ("y", "x") + var.dimensions[axis + len(item.cell_dims):], axis
+
+
+def _copy_variable(dst, name, var, dims, **kw):
+    attrs = var.__dict__
+    out = dst.createVariable(name, var.datatype, dims, fill_value=attrs.get("_FillValue", kw.pop("fill", None)), **kw)
+    out.setncatts({k: v for k, v in attrs.items() if k != "_FillValue"})
+    out.set_auto_maskandscale(False)  # values are written as stored in the inputs
+    return out
+
+
+_VARIABLES = {}
+
+
+def _has_variable(item, name):
+    if item.path not in _VARIABLES:
+        with nc.Dataset(item.path, "r") as src:
+            _VARIABLES[item.path] = set(src.variables)
+    return name in _VARIABLES[item.path]
+
+
+def mosaic_group(key, inputs, grid, window, output_path, executor, variables=None, overlap="first",
+                 fmt="NETCDF3_64BIT"):
+    """Write output_path: every cell variable of the group's inputs scattered onto the raster window."""
+    start = time()
+    r0, r1, c0, c1 = window
+    size = (r1 - r0) * (c1 - c0)
+    with nc.Dataset(inputs[0].path, "r") as first:
+        first.set_auto_maskandscale(False)
+        cell, other = plan_variables(first, inputs[0], variables)
+        held = {name: [item for item in inputs if _has_variable(item, name)] for name in cell}
+        dst = _create_output(output_path, first, inputs[0], grid, window, fmt)
+        try:
+            for name in other:
+                var = first[name]
+                _copy_variable(dst, name, var, var.dimensions)[...] = var[...]
+            for name in cell:
+                var = first[name]
+                dims, axis = _output_dims(var, inputs[0])
+                fill = _fill_value(var)
+                kw = {"zlib": True, "complevel": 4} if fmt.startswith("NETCDF4") else {}
+                out = _copy_variable(dst, name, var, dims, fill=fill, **kw)
+                if GRID_MAPPING in dst.variables:
+                    out.grid_mapping = GRID_MAPPING
+                mean = overlap == "mean" and var.dtype.kind == "f"
+                # with --overlap mean every input keeps its overlaps: integers are written last to first
+                holders = held[name] if mean or overlap != "mean" else held[name][::-1]
+                trail = var.shape[axis + len(inputs[0].cell_dims):]
+                for steps in (_time_runs(var.shape[0]) if _is_record(var) else [None]):
+                    futures = [(item, executor.submit(read_cells, item.rank, name, steps)) for item in holders]
+                    lead = var.shape[:axis] if steps is None else (steps.stop - steps.start,) + var.shape[1:axis]
+                    raster = np.full(lead + trail + (size,), 0 if fill is None else fill, dtype=var.dtype)
+                    if mean:
+                        # average over the inputs holding a value: fill values and NaN do not count
+                        total = np.zeros(raster.shape, dtype=np.float64)
+                        cover = np.zeros(raster.shape, dtype=np.int32)
+                    for item, fut in futures:
+                        values = fut.result()
+                        if mean:
+                            valid = ~np.isnan(values) if fill is None else (values != fill) & ~np.isnan(values)
+                            total[..., item.flat] += np.where(valid, values, 0)
+                            cover[..., item.flat] += valid
+                        else:
+                            raster[..., item.flat] = values
+                    if mean:
+                        covered = cover > 0
+                        raster[covered] = total[covered] / cover[covered]
+                    raster = np.moveaxis(raster.reshape(raster.shape[:-1] + (r1 - r0, c1 - c0)),
+                                         (-2, -1), (len(lead), len(lead) + 1))
+                    out[steps if steps is not None else Ellipsis] = raster
+            dst.setncattr("mosaic_inputs", ", ".join(os.path.abspath(item.path) for item in inputs))
+            dst.setncattr("mosaic_overlap", overlap)
+            dst.setncattr("history", datetime.now().strftime("%Y-%m-%d %H:%M:%S") + " created by aoi_mosaic.py")
+        finally:
+            dst.close()
+    print(f"[mosaic] {os.path.basename(output_path)}: {len(inputs)} inputs, {len(cell)} variables "
+          f"in {time() - start:.1f}s")
+    return cell
+
+
+def write_geotiffs(nc_path, variables, grid, window, output_dir, opts):
+    """One GeoTIFF stack per variable of a mosaic: a band per time step/level (leading dims flattened)."""
+    from geotiff_export import close_geotiff, open_geotiff, write_band
+
+    transform = grid.geotransform(window)
+    stem = os.path.splitext(os.path.basename(nc_path))[0]
+    written = []
+    with nc.Dataset(nc_path, "r") as src:
+        for name in variables:
+            var = src[name]
+            if var.dimensions[-2:] != ("y", "x"):
+                print(f"[mosaic] {name}: dims {var.dimensions} do not end in (y, x); no GeoTIFF")
+                continue
+            data = np.ma.filled(np.ma.asarray(var[...], dtype=np.float64), np.nan)
+            data = data.reshape((-1,) + data.shape[-2:])
+            path = os.path.join(output_dir, f"{stem}.{name}.tif")
+            dst = open_geotiff(path, data.shape[1], data.shape[2], data.shape[0], transform, opts)
+            for band in range(data.shape[0]):
+                write_band(dst, band + 1, data[band], opts, band if data.shape[0] > 1 else None)
+            close_geotiff(dst, path, opts)
+            written.append(path)
+    return written
+
+
+def expand_inputs(patterns, manifest=None):
+    """Input files from glob patterns; with a tiles manifest, relative patterns are taken in every tile."""
+    paths = []
+    for pattern in patterns:
+        roots = [t["experiment_root"] for t in manifest["tiles"]] if manifest and not os.path.isabs(pattern) else [""]
+        for root in roots:
+            found = sorted(glob.glob(os.path.join(root, pattern)))
+            if not found and not glob.has_magic(pattern):
+                raise FileNotFoundError(os.path.join(root, pattern))
+            paths.extend(found)
+    return sorted(dict.fromkeys(os.path.abspath(p) for p in paths))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mosaic 1D AOI outputs onto the 2D TES raster.")
+    parser.add_argument("inputs", nargs="+", help="AOI files or glob patterns (relative to every tile with --manifest)")
+    parser.add_argument("--domain", help="Entire-domain 1D base domain giving the raster (default: from --manifest)")
+    parser.add_argument("--manifest", help="tiles.json of a tiled experiment (aoi_tiles.py)")
+    parser.add_argument("--aoi-domains", nargs="+", default=[],
+                        help="AOI domains (<AOI>_domain*.nc) for inputs without gridID, such as ELM history "
+                             "(default with --manifest: the domain of every tile)")
+    parser.add_argument("--output-dir", default=".", help="Output directory (default: .)")
+    parser.add_argument("--prefix", default="", help="Output file name prefix")
+    parser.add_argument("--variables", nargs="+", help="Cell variables to mosaic (default: all)")
+    parser.add_argument("--overlap", default="first", choices=OVERLAP,
+                        help="Cells in several inputs: first/last input in path order, or mean (default: first)")
+    parser.add_argument("--full", action="store_true", help="Write the whole raster instead of the inputs' window")
+    parser.add_argument("--format", default="NETCDF3_64BIT", choices=["NETCDF3_64BIT", "NETCDF4", "NETCDF4_CLASSIC"],
+                        help="NetCDF format; NETCDF4* outputs are compressed (default: NETCDF3_64BIT)")
+    parser.add_argument("--geotiff", action="store_true", help="Also write a multiband GeoTIFF per variable")
+    parser.add_argument("--cog", action="store_true", help="Cloud-optimized GeoTIFFs (see geotiff_export.py)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Reader processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    if args.geotiff:
+        try:
+            import rasterio  # noqa: F401
+        except ImportError:
+            parser.error("--geotiff needs rasterio")
+    manifest = None
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+    domain = args.domain or (manifest and manifest.get("source_origin", manifest["source"])["base_domain_file"])
+    if not domain:
+        parser.error("--domain is required without --manifest")
+    aoi_domains = [p for pattern in args.aoi_domains for p in sorted(glob.glob(pattern))]
+    if manifest and not aoi_domains:
+        aoi_domains = [p for t in manifest["tiles"]
+                       for p in sorted(glob.glob(os.path.join(t["experiment_root"], "domain_surfdata",
+                                                              t["name"] + "_domain*.nc")))]
+
+    grid = TESGrid.from_domain(domain)
+    domains = domain_gridids(aoi_domains)
+    inputs = [open_input(path, domains) for path in expand_inputs(args.inputs, manifest)]
+    if not inputs:
+        raise SystemExit("No input files found")
+    for rank, item in enumerate(inputs):
+        item.rank = rank
+    groups = {}
+    for item in inputs:
+        groups.setdefault(group_key(item), []).append(item)
+    window = raster_window(grid, inputs, args.full)
+    for key, items in groups.items():
+        shared = resolve_overlaps(grid, window, items, args.overlap)
+        if shared:
+            print(f"[mosaic] {key}: {shared} cells in more than one input (--overlap {args.overlap})")
+    print(f"[mosaic] {len(inputs)} inputs in {len(groups)} outputs on rows {window[0]}-{window[1] - 1}, "
+          f"cols {window[2]}-{window[3] - 1} of the {grid.nrows} x {grid.ncols} raster")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    opts = {"crs": grid.crs().to_wkt() if grid.mapping_attrs else None, "cog": args.cog, "compress": "deflate",
+            "tile": 512, "resampling": "average", "dtype": "float32", "nodata": float("nan")}
+    executor = ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(inputs,)) \
+        if args.workers > 1 else _Inline()
+    if args.workers <= 1:
+        _init_worker(inputs)
+    try:
+        for key, items in groups.items():
+            path = os.path.join(args.output_dir, args.prefix + key)
+            cell = mosaic_group(key, items, grid, window, path, executor, args.variables, args.overlap, args.format)
+            if args.geotiff:
+                for tif in write_geotiffs(path, cell, grid, window, args.output_dir, opts):
+                    print(f"[mosaic] wrote {tif}")
+    finally:
+        if args.workers > 1:
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    main()
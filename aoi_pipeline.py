@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""Make-style executor for a prepared AOI experiment.
+
+Stages and their dependencies:
+
+    domain -> surfdata
+    domain -> forcing -> links
+              forcing -> export   (only with timeseries_export in the config)
+
+Each stage is fingerprinted from its inputs (source files, AOI gridIDs, the relevant
+config section and the generator scripts in <experiment_root>/scripts) plus the
+fingerprints of the stages it depends on. A stage is skipped when its fingerprint
+matches the last successful run recorded in scripts/.pipeline_state.json and its
+outputs are still present. A stage that has to run is first looked up in the shared
+output cache (aoi_cache.py) and linked from there when another experiment already
+produced it; successful stages add their outputs to the cache.
+
+Backends:
+  local  run the wrappers as subprocesses; independent stages run concurrently
+  slurm  submit one job per stage chained with --dependency=afterok; each job
+         records its own success when it finishes
+"""
+
+import argparse
+import fcntl
+import hashlib
+import json
+import os
+import shlex
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+
+STATE_FILE = ".pipeline_state.json"
+CONFIG_COPY = "experiment_config.json"
+STAGE_ORDER = ("domain", "surfdata", "forcing", "links", "export")
+SHARD_PLAN = "forcing_shards.json"
+
+
+@dataclass
+class Stage:
+    name: str
+    command: list
+    deps: tuple = ()
+    inputs: list = field(default_factory=list)
+    scripts: list = field(default_factory=list)
+    params: dict = field(default_factory=dict)
+    outputs: list = field(default_factory=list)
+    env: dict = field(default_factory=dict)
+    time_limit: str = "1:00:00"
+    ntasks: int = 1  # tasks of its Slurm job (the surfdata stage runs srun -n inside it)
+
+
+def load_config(path: str) -> dict:
+    cfg = json.loads(Path(path).expanduser().read_text())
+    try:
+        from aoi_prepare_experiment import expand_config_vars
+    except ImportError:
+        # the copy written into <experiment_root>/scripts is already expanded
+        return cfg
+    return expand_config_vars(cfg)
+
+
+def _sha256_file(path: Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _tree_identity(root: Path, suffix: str = ".nc") -> list:
+    """(relpath, size, mtime_ns) for every file under root, without opening any of them."""
+    entries = []
+    stack = [root]
+    while stack:
+        current = stack.pop()
+        with os.scandir(current) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=True):
+                    stack.append(Path(entry.path))
+                elif entry.name.endswith(suffix):
+                    st = entry.stat()
+                    entries.append((os.path.relpath(entry.path, root), st.st_size, st.st_mtime_ns))
+    return sorted(entries)
+
+
+def input_identity(path) -> object:
+    """Cheap identity of a source input: stat for large data, content hash for small files."""
+    p = Path(path).expanduser()
+    if not p.exists():
+        return [str(p), None]
+    if p.is_dir():
+        return [str(p), _tree_identity(p)]
+    st = p.stat()
+    if st.st_size <= 64 * 1024 * 1024:
+        # AOI gridID lists, configs and scripts: hash the content so touching them is harmless
+        return [str(p), _sha256_file(p)]
+    return [str(p), st.st_size, st.st_mtime_ns]
+
+
+def build_stages(cfg: dict, exp_root: Path) -> dict:
+    src = cfg["source"]
+    aoi_dir = Path(cfg["aoi_points"]["dir"]).expanduser()
+    aoi_file = cfg["aoi_points"]["file"]
+    aoi_prefix = aoi_file.split("_")[0]
+    scheduler = cfg.get("scheduler", {})
+    surf_file = Path(src["surfdata_dir"]).expanduser() / src["surfdata_file"]
+    sharded = (exp_root / "scripts" / SHARD_PLAN).exists()
+    surfdata_tasks = int(os.environ.get("SCHED_SURFDATA_TASKS", scheduler.get("surfdata_tasks", 8)))
+    domain_params = {"aoi_points": cfg["aoi_points"], "base_domain_file": src["base_domain_file"]}
+    if cfg.get("cell_order", "source") != "source":
+        domain_params["cell_order"] = cfg["cell_order"]
+
+    stages = {
+        "domain": Stage(
+            name="domain",
+            command=["bash", "run_domain_surfdata.sh", "domain"],
+            inputs=[src["base_domain_file"], aoi_dir / aoi_file],
+            scripts=["TES_AOI_domainGEN.py"],
+            params=domain_params,
+            outputs=[f"domain_surfdata/{aoi_prefix}_domain.lnd.*.nc"],
+        ),
+        "surfdata": Stage(
+            name="surfdata",
+            command=["bash", "run_domain_surfdata.sh", "surfdata"],
+            deps=("domain",),
+            inputs=[surf_file],
+            scripts=["TES_AOI_surfdataGEN.py", "TES_AOI_surfdataGEN_mpi.py"],
+            params={"surfdata_dir": src["surfdata_dir"], "surfdata_file": src["surfdata_file"]},
+            outputs=[f"domain_surfdata/{aoi_prefix}_surfdata.*.nc"],
+            env={"SCHED_SURFDATA_TASKS": str(surfdata_tasks)},
+            ntasks=surfdata_tasks,
+        ),
+        "forcing": Stage(
+            name="forcing",
+            command=["bash", "run_forcing_array.sbatch", "local"] if sharded else ["bash", "run_forcing.sbatch"],
+            deps=("domain",),
+            inputs=[src["forcing_dir"]] + ([exp_root / "scripts" / SHARD_PLAN] if sharded else []),
+            scripts=["TES_AOI_forcingGEN_mpi.py"],
+            params={"forcing_dir": src["forcing_dir"]},
+            outputs=["forcing/**/*.nc"],
+            env={"FORCING_LAUNCH": "local"},
+            time_limit=scheduler.get("time", "2:00:00"),
+        ),
+        "links": Stage(
+            name="links",
+            command=["bash", "create_links.sh"],
+            deps=("domain", "forcing"),
+            scripts=["forcing_domain_link_creation.py", "forcing_links.py"],
+            outputs=["atm_forcing.datm7.km.1d/*"],
+            time_limit="0:30:00",
+        ),
+    }
+    export = cfg.get("timeseries_export")
+    if export:
+        # gridcell-major copy of the AOI forcing (forcing_timeseries_export.py)
+        output = export.get("output_dir", "timeseries")
+        command = ["python3", "forcing_timeseries_export.py", "--forcing-dir", "../forcing",
+                   "--output", output if os.path.isabs(output) else f"../{output}",
+                   "--format", export.get("format", "npy")]
+        for key in ("cells_per_shard", "memory_mb", "workers"):
+            if key in export:
+                command += ["--" + key.replace("_", "-"), str(export[key])]
+        if export.get("variables"):
+            command += ["--variables"] + list(export["variables"])
+        stages["export"] = Stage(
+            name="export",
+            command=command,
+            deps=("forcing",),
+            scripts=["forcing_timeseries_export.py"],
+            params=export,
+            outputs=[f"{output}/index.json"],
+            time_limit=scheduler.get("time", "2:00:00"),
+        )
+    return stages
+
+
+def stage_closure(stages: dict, targets) -> list:
+    """Targets plus everything they depend on, in execution order."""
+    wanted = set()
+
+    def _visit(name):
+        if name in wanted:
+            return
+        if name not in stages:
+            raise KeyError(f"Unknown stage: {name} (expected one of {', '.join(STAGE_ORDER)})")
+        wanted.add(name)
+        for dep in stages[name].deps:
+            _visit(dep)
+
+    for t in targets:
+        _visit(t)
+    return [name for name in STAGE_ORDER if name in wanted]
+
+
+def compute_fingerprints(stages: dict, order: list, scripts_dir: Path) -> dict:
+    fingerprints = {}
+    for name in order:
+        stage = stages[name]
+        payload = {
+            "stage": name,
+            "params": stage.params,
+            "inputs": [input_identity(p) for p in stage.inputs],
+            "scripts": [input_identity(scripts_dir / s) for s in stage.scripts],
+            "deps": {d: fingerprints[d] for d in stage.deps},
+        }
+        blob = json.dumps(payload, sort_keys=True, default=str).encode()
+        fingerprints[name] = hashlib.sha256(blob).hexdigest()
+    return fingerprints
+
+
+def read_state(scripts_dir: Path) -> dict:
+    path = scripts_dir / STATE_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text())
+
+
+def record_success(scripts_dir: Path, stage: str, fingerprint: str, backend: str, jobid: str = "") -> None:
+    # stages finish concurrently (threads locally, separate jobs under Slurm): serialise the update
+    with open(scripts_dir / (STATE_FILE + ".lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = read_state(scripts_dir)
+        state[stage] = {
+            "fingerprint": fingerprint,
+            "finished": datetime.now().isoformat(timespec="seconds"),
+            "backend": backend,
+            "jobid": jobid,
+        }
+        tmp = scripts_dir / (STATE_FILE + f".{os.getpid()}")
+        tmp.write_text(json.dumps(state, indent=2) + "\n")
+        os.replace(tmp, scripts_dir / STATE_FILE)
+
+
+def outputs_present(stage: Stage, exp_root: Path) -> bool:
+    return all(any(exp_root.glob(pattern)) for pattern in stage.outputs)
+
+
+def is_up_to_date(stage: Stage, fingerprint: str, state: dict, exp_root: Path) -> bool:
+    last = state.get(stage.name, {})
+    return last.get("fingerprint") == fingerprint and outputs_present(stage, exp_root)
+
+
+def open_cache(cfg: dict):
+    """The shared AOI output cache, or None when disabled (cache.enabled=false)."""
+    from aoi_cache import AOICache, cache_settings
+
+    settings = cache_settings(cfg)
+    if not settings["enabled"]:
+        return None
+    return AOICache(settings["dir"], settings["max_bytes"], settings["link"])
+
+
+def compute_cache_keys(cfg: dict, stages: dict, order: list, scripts_dir: Path) -> dict:
+    from aoi_cache import CACHED_STAGES, cache_key, gridid_set_digest
+
+    aoi_path = Path(cfg["aoi_points"]["dir"]).expanduser() / cfg["aoi_points"]["file"]
+    if not aoi_path.exists():
+        return {}
+    digest = gridid_set_digest(aoi_path)
+    return {name: cache_key(stages[name], cfg, scripts_dir, digest) for name in order if name in CACHED_STAGES}
+
+
+def store_outputs(cache, stage: Stage, key: str, exp_root: Path, expid: str) -> None:
+    try:
+        manifest = cache.store(key, stage.name, exp_root, stage.outputs, description=f"{expid} {stage.name}")
+    except OSError as e:
+        print(f"[pipeline] {stage.name}: not cached ({e})")
+        return
+    if manifest:
+        print(f"[pipeline] {stage.name}: cached {len(manifest['files'])} files as {key[:16]}")
+
+
+def _record_command(scripts_dir: Path, stage: str, fingerprint: str, backend: str, cache_key: str = "") -> str:
+    command = (f"python3 aoi_pipeline.py record --scripts-dir '{scripts_dir.as_posix()}' "
+               f"--stage {stage} --fingerprint {fingerprint} --backend {backend}")
+    if cache_key:
+        command += f" --cache-key {cache_key}"
+    return command
+
+
+class LocalBackend:
+    """Run stage wrappers as subprocesses; stages whose dependencies are met run concurrently."""
+
+    name = "local"
+
+    def __init__(self, exp_root: Path, cfg: dict, max_parallel: int = 2, cache=None, cache_keys=None):
+        self.exp_root = exp_root
+        self.scripts_dir = exp_root / "scripts"
+        self.expid = cfg["expid"]
+        self.max_parallel = max_parallel
+        self.cache = cache
+        self.cache_keys = cache_keys or {}
+        self.log_dir = self.scripts_dir / "pipeline_logs"
+
+    def _run_stage(self, stage: Stage, fingerprint: str) -> int:
+        self.log_dir.mkdir(parents=True, exist_ok=True)
+        log_path = self.log_dir / f"{stage.name}.log.{datetime.now().strftime('%y%m%d-%H%M')}"
+        env = dict(os.environ, **stage.env)
+        start = time.time()
+        print(f"[pipeline] {stage.name}: started ({' '.join(stage.command)}), log {log_path}")
+        with open(log_path, "w") as log:
+            rc = subprocess.call(stage.command, cwd=self.scripts_dir, env=env,
+                                 stdout=log, stderr=subprocess.STDOUT)
+        if rc == 0:
+            record_success(self.scripts_dir, stage.name, fingerprint, self.name)
+            if self.cache is not None and stage.name in self.cache_keys:
+                store_outputs(self.cache, stage, self.cache_keys[stage.name], self.exp_root, self.expid)
+        print(f"[pipeline] {stage.name}: {'done' if rc == 0 else f'FAILED (exit {rc})'} in {time.time() - start:.0f}s")
+        return rc
+
+    def execute(self, stages: dict, todo: list, fingerprints: dict, skipped: set) -> bool:
+        done = set(skipped)
+        failed = set()
+        pending = list(todo)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            while pending or running:
+                for name in list(pending):
+                    deps = stages[name].deps
+                    if any(d in failed for d in deps):
+                        print(f"[pipeline] {name}: not run, a dependency failed")
+                        pending.remove(name)
+                        failed.add(name)
+                    elif all(d in done for d in deps):
+                        pending.remove(name)
+                        running[pool.submit(self._run_stage, stages[name], fingerprints[name])] = name
+                if not running:
+                    break
+                finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    name = running.pop(fut)
+                    (done if fut.result() == 0 else failed).add(name)
+        return not failed
+
+
+class SlurmBackend:
+    """Submit one job per stage, chained with --dependency=afterok on the upstream jobs."""
+
+    name = "slurm"
+
+    def __init__(self, exp_root: Path, cfg: dict, dry_run: bool = False, cache_keys=None):
+        self.exp_root = exp_root
+        self.scripts_dir = exp_root / "scripts"
+        self.scheduler = cfg.get("scheduler", {})
+        self.expid = cfg["expid"]
+        self.dry_run = dry_run
+        self.cache_keys = cache_keys or {}
+
+    def _sbatch(self, args: list, label: str) -> str:
+        cmd = ["sbatch", "--parsable"] + args
+        print("[pipeline] " + " ".join(cmd))
+        if self.dry_run:
+            return f"<{label}>"
+        out = subprocess.run(cmd, cwd=self.scripts_dir, check=True, capture_output=True, text=True).stdout
+        return out.strip().split(";")[0]
+
+    def submit(self, stage: Stage, fingerprint: str, dep_jobs: list) -> str:
+        account = os.environ.get("SCHED_ACCOUNT", self.scheduler.get("account", ""))
+        partition = os.environ.get("SCHED_PARTITION", self.scheduler.get("partition", "batch"))
+        args = [f"--chdir={self.scripts_dir.as_posix()}"]
+        cache_key = self.cache_keys.get(stage.name, "")
+        if dep_jobs:
+            args.append("--dependency=afterok:" + ":".join(dep_jobs))
+        if stage.name == "forcing":
+            # the forcing scripts carry their own #SBATCH resources and record completion themselves
+            export = f"--export=ALL,PIPELINE_STAGE={stage.name},PIPELINE_FINGERPRINT={fingerprint}"
+            if cache_key:
+                export += f",PIPELINE_CACHE_KEY={cache_key}"
+            if (self.scripts_dir / SHARD_PLAN).exists():
+                array_job = self._sbatch(args + ["run_forcing_array.sbatch"], "forcing-array")
+                final_args = [args[0], f"--dependency=afterany:{array_job}", export, "run_forcing_finalize.sbatch"]
+                return self._sbatch(final_args, stage.name)
+            return self._sbatch(args + [export, "run_forcing.sbatch"], stage.name)
+        if account:
+            args += ["-A", account]
+        args += ["-p", partition, "-N", "1", f"--ntasks={stage.ntasks}", "-t", stage.time_limit,
+                 "-J", f"TES_{self.expid}_{stage.name}"]
+        # the stage env sizes what runs inside the allocation (srun -n $SCHED_SURFDATA_TASKS)
+        env = "".join(f"{k}={shlex.quote(v)} " for k, v in stage.env.items())
+        wrapped = env + " ".join(stage.command) + " && " + _record_command(self.scripts_dir, stage.name, fingerprint,
+                                                                           self.name, cache_key)
+        args += ["--wrap", wrapped]
+        return self._sbatch(args, stage.name)
+
+    def execute(self, stages: dict, todo: list, fingerprints: dict, skipped: set) -> bool:
+        jobs = {}
+        for name in todo:
+            dep_jobs = [jobs[d] for d in stages[name].deps if d in jobs]
+            jobs[name] = self.submit(stages[name], fingerprints[name], dep_jobs)
+            print(f"[pipeline] {name}: submitted as job {jobs[name]}")
+        return True
+
+
+def run_pipeline(cfg: dict, exp_root: Path, targets=None, backend: str = "local",
+                 force: bool = False, dry_run: bool = False, max_parallel: int = 2, use_cache: bool = True) -> bool:
+    scripts_dir = exp_root / "scripts"
+    stages = build_stages(cfg, exp_root)
+    order = stage_closure(stages, targets or list(stages))
+    fingerprints = compute_fingerprints(stages, order, scripts_dir)
+    state = read_state(scripts_dir)
+    cache = open_cache(cfg) if use_cache else None
+    cache_keys = compute_cache_keys(cfg, stages, order, scripts_dir) if cache is not None else {}
+
+    todo, skipped = [], set()
+    for name in order:
+        stale_dep = any(d in todo for d in stages[name].deps)
+        if not force and not stale_dep and is_up_to_date(stages[name], fingerprints[name], state, exp_root):
+            print(f"[pipeline] {name}: up to date, skipped")
+            skipped.add(name)
+        elif not force and not dry_run and name in cache_keys and cache.materialize(cache_keys[name], exp_root):
+            print(f"[pipeline] {name}: linked from cache {cache_keys[name][:16]} ({cache.root})")
+            record_success(scripts_dir, name, fingerprints[name], "cache")
+            skipped.add(name)
+        else:
+            todo.append(name)
+
+    if not todo:
+        print("[pipeline] nothing to do")
+        return True
+    if dry_run and backend == "local":
+        for name in todo:
+            print(f"[pipeline] {name}: would run {' '.join(stages[name].command)}")
+        return True
+
+    if backend == "slurm":
+        runner = SlurmBackend(exp_root, cfg, dry_run=dry_run, cache_keys=cache_keys)
+    else:
+        runner = LocalBackend(exp_root, cfg, max_parallel=max_parallel, cache=cache, cache_keys=cache_keys)
+    return runner.execute(stages, todo, fingerprints, skipped)
+
+
+def print_status(cfg: dict, exp_root: Path) -> None:
+    scripts_dir = exp_root / "scripts"
+    stages = build_stages(cfg, exp_root)
+    order = [name for name in STAGE_ORDER if name in stages]
+    fingerprints = compute_fingerprints(stages, order, scripts_dir)
+    state = read_state(scripts_dir)
+    for name in order:
+        last = state.get(name, {})
+        if is_up_to_date(stages[name], fingerprints[name], state, exp_root):
+            status = f"up to date (finished {last.get('finished')})"
+        elif last:
+            status = f"stale (last finished {last.get('finished')})"
+        else:
+            status = "never run"
+        print(f"{name:10s} {status}")
+
+
+def main() -> None:
+    default_config = Path(__file__).resolve().parent / CONFIG_COPY
+    parser = argparse.ArgumentParser(description="Run the AOI experiment pipeline (domain, surfdata, forcing, links, export).")
+    parser.add_argument("--config", default=default_config.as_posix(),
+                        help=f"Experiment config JSON (default: {CONFIG_COPY} next to this script)")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="Run out-of-date stages")
+    p_run.add_argument("--backend", choices=["local", "slurm"], default="local")
+    p_run.add_argument("--stages", nargs="+",
+                       help="Target stages; their dependencies are included (default: all configured)")
+    p_run.add_argument("--force", action="store_true", help="Run the stages even if they are up to date")
+    p_run.add_argument("--dry-run", action="store_true", help="Only print what would run/be submitted")
+    p_run.add_argument("--max-parallel", type=int, default=2, help="Concurrent stages for the local backend")
+    p_run.add_argument("--no-cache", action="store_true", help="Neither link from nor add to the shared output cache")
+
+    sub.add_parser("status", help="Show which stages are up to date")
+
+    p_rec = sub.add_parser("record", help="Record a successful stage (called by Slurm jobs)")
+    p_rec.add_argument("--scripts-dir", required=True)
+    p_rec.add_argument("--stage", required=True, choices=STAGE_ORDER)
+    p_rec.add_argument("--fingerprint", required=True)
+    p_rec.add_argument("--backend", default="slurm")
+    p_rec.add_argument("--cache-key", default="", help="Also add the stage outputs to the shared cache under this key")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_success(Path(args.scripts_dir), args.stage, args.fingerprint, args.backend,
+                       os.environ.get("SLURM_JOB_ID", ""))
+        if args.cache_key:
+            cfg = load_config(args.config)
+            cache = open_cache(cfg)
+            if cache is not None:
+                exp_root = Path(cfg["experiment_root"]).expanduser()
+                store_outputs(cache, build_stages(cfg, exp_root)[args.stage], args.cache_key, exp_root, cfg["expid"])
+        return
+
+    cfg = load_config(args.config)
+    exp_root = Path(cfg["experiment_root"]).expanduser()
+    if args.command == "status":
+        print_status(cfg, exp_root)
+        return
+
+    ok = run_pipeline(cfg, exp_root, targets=args.stages, backend=args.backend, force=args.force,
+                      dry_run=args.dry_run, max_parallel=args.max_parallel, use_cache=not args.no_cache)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
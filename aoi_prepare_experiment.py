@@ -43,6 +43,13 @@ def render_run_domain_surfdata_sh(cfg: dict, scripts_dir: Path, exp_root: Path)
     base_domain_file = cfg["source"]["base_domain_file"]
     surf_dir = cfg["source"]["surfdata_dir"].rstrip("/")
     surf_file = cfg["source"]["surfdata_file"]
+    surfdata_tasks = cfg.get("scheduler", {}).get("surfdata_tasks", 8)
+    # an entire-domain spinup restart is subset against the domain of the run that wrote it
+    finidat = cfg["source"].get("finidat", "")
+    cell_order = cfg.get("cell_order", "source")
+    # the TES raster (cell_order) is recovered from the entire domain, not a super-AOI source domain
+    grid_domain = cfg.get("source_origin", cfg["source"])["base_domain_file"]
+    finidat_domain = cfg["source"].get("finidat_domain") or grid_domain
 
 
     lines = []
@@ -53,6 +60,8 @@ def render_run_domain_surfdata_sh(cfg: dict, scripts_dir: Path, exp_root: Path)
     lines.append("# Source exported environment if present")
     lines.append("if [ -f ./export_env.sh ]; then . ./export_env.sh; fi")
     lines.append("")
+    lines.append("# Optional stage argument: all (default), domain, surfdata or finidat")
+    lines.append("STAGE=\"${1:-all}\"")
     lines.append("date_string=$(date +'%y%m%d-%H%M')")
     lines.append(f": \"${{EXPID:={expid}}}\"")
     lines.append(f'EXP_ROOT="{exp_root.as_posix()}"')
@@ -62,24 +71,58 @@ def render_run_domain_surfdata_sh(cfg: dict, scripts_dir: Path, exp_root: Path)
     lines.append(f": \"${{BASE_DOMAIN_FILE:={base_domain_file}}}\"")
     lines.append(f": \"${{SURFDATA_DIR:={surf_dir}}}\"")
     lines.append(f": \"${{SURFDATA_FILE:={surf_file}}}\"")
+    lines.append(f": \"${{FINIDAT_SOURCE:={finidat}}}\"")
+    lines.append(f": \"${{FINIDAT_DOMAIN_FILE:={finidat_domain}}}\"")
+    lines.append("# AOI gridcell order: source, hilbert or morton (applied by TES_AOI_domainGEN.py, followed by the other generators)")
+    lines.append(f"export AOI_CELL_ORDER=\"${{AOI_CELL_ORDER:-{cell_order}}}\"")
+    lines.append(f"export TES_GRID_DOMAIN=\"${{TES_GRID_DOMAIN:-{grid_domain}}}\"")
     lines.append("DOM_SURF_DIR=\"${EXP_ROOT}/domain_surfdata\"")
     lines.append("mkdir -p \"${DOM_SURF_DIR}\"")
+    lines.append("# AOI_SERVICE=1 sends the domain and serial surfdata jobs to a running aoi_service.py (run here when none is up)")
+    lines.append("if [ -n \"${AOI_SERVICE:-}\" ]; then")
+    lines.append("  DOMAIN_GEN=(python3 aoi_service.py run domain); SURFDATA_GEN=(python3 aoi_service.py run surfdata)")
+    lines.append("else")
+    lines.append("  DOMAIN_GEN=(python3 TES_AOI_domainGEN.py); SURFDATA_GEN=(python3 TES_AOI_surfdataGEN.py)")
+    lines.append("fi")
     lines.append("")
-    lines.append("# Ensure domain source file is available with expected local name")
-    lines.append("if [ ! -e domain.lnd.TES_SE.4km.1d.nc ]; then")
-    lines.append("  ln -sf \"${BASE_DOMAIN_FILE}\" domain.lnd.TES_SE.4km.1d.nc")
+    lines.append("# Ensure domain source file is available with expected local name (re-pointed if the source changed)")
+    lines.append("if [ ! -e domain.lnd.TES_SE.4km.1d.nc ] || [ -L domain.lnd.TES_SE.4km.1d.nc ]; then")
+    lines.append("  ln -sfn \"${BASE_DOMAIN_FILE}\" domain.lnd.TES_SE.4km.1d.nc")
     lines.append("fi")
     lines.append("")
-    lines.append("echo \"[1/2] Generating AOI domain...\"")
-    lines.append("python3 TES_AOI_domainGEN.py \"${AOI_POINTS_DIR}\" \"${DOM_SURF_DIR}\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_domaingen.log.${date_string}\"")
+    lines.append("if [ \"${STAGE}\" = all ] || [ \"${STAGE}\" = domain ]; then")
+    lines.append("  echo \"[1/2] Generating AOI domain...\"")
+    lines.append("  \"${DOMAIN_GEN[@]}\" \"${AOI_POINTS_DIR}\" \"${DOM_SURF_DIR}\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_domaingen.log.${date_string}\"")
+    lines.append("fi")
+    lines.append("if [ \"${STAGE}\" = domain ]; then echo 'Domain generation complete.'; exit 0; fi")
     lines.append("")
     lines.append("echo \"Resolving latest AOI domain file...\"")
     lines.append("AOI_PREFIX=\"$(echo \"${AOI_POINTS_FILE}\" | awk -F'_' '{print $1}')\"")
     lines.append("AOI_DOMAIN=$(ls -1 ${DOM_SURF_DIR}/${AOI_PREFIX}_domain.lnd.TES_SE.4km.1d.c*.nc 2>/dev/null | sort | tail -n1)")
     lines.append("if [ -z \"${AOI_DOMAIN}\" ]; then echo 'ERROR: AOI domain file not found'; exit 2; fi")
     lines.append("")
+    lines.append("# AOI finidat subset from an entire-domain spinup restart (source.finidat), checked against the AOI surfdata")
+    lines.append("make_finidat() {")
+    lines.append("  if [ -z \"${FINIDAT_SOURCE}\" ]; then echo 'No entire-domain restart configured (source.finidat); the AOI needs its own spinup.'; return 0; fi")
+    lines.append("  AOI_SURFDATA=$(ls -1 ${DOM_SURF_DIR}/${AOI_PREFIX}_surfdata.TES_SE.4km.1d.NLCD.c*.nc 2>/dev/null | sort | tail -n1)")
+    lines.append("  echo \"Subsetting AOI finidat from ${FINIDAT_SOURCE}...\"")
+    lines.append("  python3 TES_AOI_finidatGEN.py \"${FINIDAT_SOURCE}\" \"${FINIDAT_DOMAIN_FILE}\" \"${DOM_SURF_DIR}\" \"${DOM_SURF_DIR}/\" \"$(basename \"${AOI_DOMAIN}\")\" ${AOI_SURFDATA:+\"${AOI_SURFDATA}\"} 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_finidatgen.log.${date_string}\"")
+    lines.append("}")
+    lines.append("if [ \"${STAGE}\" = finidat ]; then make_finidat; exit 0; fi")
+    lines.append("")
     lines.append("echo \"[2/2] Generating AOI surfdata...\"")
-    lines.append("python3 TES_AOI_surfdataGEN.py \"${SURFDATA_DIR}\" \"${SURFDATA_FILE}\" \"${DOM_SURF_DIR}\" \"${DOM_SURF_DIR}/\" \"$(basename \"${AOI_DOMAIN}\")\" 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_surfdargen.log.${date_string}\"")
+    lines.append("# Variables are subset in parallel: MPI ranks inside a Slurm allocation, local processes otherwise")
+    lines.append(f"SURFDATA_TASKS=\"${{SCHED_SURFDATA_TASKS:-{surfdata_tasks}}}\"")
+    lines.append("SURFDATA_ARGS=(\"${SURFDATA_DIR}\" \"${SURFDATA_FILE}\" \"${DOM_SURF_DIR}\" \"${DOM_SURF_DIR}/\" \"$(basename \"${AOI_DOMAIN}\")\")")
+    lines.append("if [ \"${SURFDATA_TASKS}\" -le 1 ]; then")
+    lines.append("  \"${SURFDATA_GEN[@]}\" \"${SURFDATA_ARGS[@]}\" 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_surfdargen.log.${date_string}\"")
+    lines.append("elif [ -n \"${SLURM_JOB_ID:-}\" ]; then")
+    lines.append("  srun -n \"${SURFDATA_TASKS}\" python3 TES_AOI_surfdataGEN_mpi.py \"${SURFDATA_ARGS[@]}\" 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_surfdargen.log.${date_string}\"")
+    lines.append("else")
+    lines.append("  SURFDATA_SERIAL_WORKERS=\"${SURFDATA_TASKS}\" python3 TES_AOI_surfdataGEN_mpi.py \"${SURFDATA_ARGS[@]}\" 2>&1 | tee \"${DOM_SURF_DIR}/${EXPID}_surfdargen.log.${date_string}\"")
+    lines.append("fi")
+    lines.append("if [ \"${STAGE}\" = all ] && [ -n \"${FINIDAT_SOURCE}\" ]; then make_finidat; fi")
+    lines.append("python3 aoi_qa.py report \"${EXP_ROOT}\"")
     lines.append("")
     lines.append("echo 'Domain and surfdata generation complete.'")
     return "\n".join(lines) + "\n"
@@ -94,6 +137,8 @@ def render_run_forcing_sbatch(cfg: dict, scripts_dir: Path, exp_root: Path) -> s
     nodes = scheduler.get("nodes", 1)
     time_limit = scheduler.get("time", "2:00:00")
     mem = scheduler.get("mem", "128GB")
+    tasks = scheduler.get("tasks", 2)
+    ranks_per_node = scheduler.get("ranks_per_node")
 
 
     lines = []
@@ -105,6 +150,8 @@ def render_run_forcing_sbatch(cfg: dict, scripts_dir: Path, exp_root: Path) -> s
     lines.append(f"#SBATCH -N {nodes}")
     lines.append(f"#SBATCH -t {time_limit}")
     lines.append(f"#SBATCH --mem={mem}")
+    if ranks_per_node:
+        lines.append(f"#SBATCH --ntasks-per-node={ranks_per_node}")
     lines.append("")
     lines.append("set -euo pipefail")
 
@@ -130,21 +177,143 @@ def render_run_forcing_sbatch(cfg: dict, scripts_dir: Path, exp_root: Path) -> s
     lines.append("AOI_POINTS_FILE=$(ls -1 ${AOI_FILE_PATH}/*_domain.lnd.TES_SE.4km.1d.c*.nc 2>/dev/null | sort | tail -n1 | xargs -r basename)")
     lines.append("if [ -z \"${AOI_POINTS_FILE}\" ]; then echo 'ERROR: AOI domain file not found'; exit 2; fi")
     lines.append("")
-    lines.append("# If not running inside a Slurm allocation, run with srun using env SCHED_* overrides")
-    lines.append("if [ -z \"${SLURM_JOB_ID:-}\" ]; then")
+    lines.append("# FORCING_LAUNCH=local runs on this host with a process pool (aoi_pipeline.py local backend)")
+    lines.append("if [ \"${FORCING_LAUNCH:-}\" = local ]; then")
+    lines.append("  python3 TES_AOI_forcingGEN_mpi.py \"${FORCING_DIR}\" \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${OUT_DIR}/${EXPID}_forcinggen.log.${date_string}\"")
+    lines.append("elif [ -z \"${SLURM_JOB_ID:-}\" ]; then")
+    lines.append("  # Not inside a Slurm allocation: run with srun using env SCHED_* overrides")
     lines.append("  ACCOUNT=\"${SCHED_ACCOUNT:-" + account + "}\"")
     lines.append("  PARTITION=\"${SCHED_PARTITION:-" + partition + "}\"")
     lines.append("  NODES=\"${SCHED_NODES:-" + str(nodes) + "}\"")
     lines.append("  TIME=\"${SCHED_TIME:-" + time_limit + "}\"")
     lines.append("  MEM=\"${SCHED_MEM:-" + mem + "}\"")
-    lines.append("  SRUN_NTASKS=\"${SCHED_TASKS:-2}\"")
-    lines.append("  echo \"srun -A '${ACCOUNT}' -p '${PARTITION}' -N '${NODES}' -t '${TIME}' --mem='${MEM}' -n '${SRUN_NTASKS}' python3 TES_AOI_forcingGEN.py '${FORCING_DIR}' '${OUT_DIR}' '${AOI_FILE_PATH}/' '${AOI_POINTS_FILE}'\" | tee \"${OUT_DIR}/${EXPID}_forcinggen.cmd.${date_string}\"")
-    lines.append("  exec srun -A \"${ACCOUNT}\" -p \"${PARTITION}\" -N \"${NODES}\" -t \"${TIME}\" --mem=\"${MEM}\" -n \"${SRUN_NTASKS}\" python3 TES_AOI_forcingGEN_mpi.py \"${FORCING_DIR}\" \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${OUT_DIR}/${EXPID}_forcinggen.log.${date_string}\"")
+    lines.append("  SRUN_NTASKS=\"${SCHED_TASKS:-" + str(tasks) + "}\"")
+    lines.append("  echo \"srun -A '${ACCOUNT}' -p '${PARTITION}' -N '${NODES}' -t '${TIME}' --mem='${MEM}' -n '${SRUN_NTASKS}' python3 TES_AOI_forcingGEN_mpi.py '${FORCING_DIR}' '${OUT_DIR}' '${AOI_FILE_PATH}/' '${AOI_POINTS_FILE}'\" | tee \"${OUT_DIR}/${EXPID}_forcinggen.cmd.${date_string}\"")
+    lines.append("  srun -A \"${ACCOUNT}\" -p \"${PARTITION}\" -N \"${NODES}\" -t \"${TIME}\" --mem=\"${MEM}\" -n \"${SRUN_NTASKS}\" python3 TES_AOI_forcingGEN_mpi.py \"${FORCING_DIR}\" \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${OUT_DIR}/${EXPID}_forcinggen.log.${date_string}\"")
+    lines.append("else")
+    lines.append("  # Running under Slurm allocation")
+    lines.append("  echo \"srun -n '${SCHED_TASKS}' python3 TES_AOI_forcingGEN_mpi.py '${FORCING_DIR}' '${OUT_DIR}' '${AOI_FILE_PATH}/' '${AOI_POINTS_FILE}'\" | tee \"${OUT_DIR}/${EXPID}_forcinggen.cmd.${date_string}\"")
+    lines.append("  srun -n \"${SCHED_TASKS:-" + str(tasks) + "}\" python3 TES_AOI_forcingGEN_mpi.py \"${FORCING_DIR}\" \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${OUT_DIR}/${EXPID}_forcinggen.log.${date_string}\"")
     lines.append("fi")
+    lines.append("# set -o pipefail: a failed generator (python3 or srun) ends the script here, before the QA and record steps")
+    lines.append("")
+    lines.append("# Per-file QA sidecars written while subsetting, summed into ${EXP_ROOT}/qa_report.json")
+    lines.append("python3 aoi_qa.py report \"${EXP_ROOT}\"")
+    lines.append("")
+    lines.append("# Submitted by aoi_pipeline.py: record the successful stage")
+    lines.append("if [ -n \"${PIPELINE_FINGERPRINT:-}\" ]; then")
+    lines.append("  python3 aoi_pipeline.py record --scripts-dir \"${SCRIPT_DIR}\" --stage \"${PIPELINE_STAGE:-forcing}\" --fingerprint \"${PIPELINE_FINGERPRINT}\" ${PIPELINE_CACHE_KEY:+--cache-key \"${PIPELINE_CACHE_KEY}\"}")
+    lines.append("fi")
+    return "\n".join(lines) + "\n"
+
+
+def _render_forcing_inputs(lines: list, expid: str, forcing_dir: str, exp_root: Path) -> None:
+    # Shared preamble of the forcing job scripts: env, paths and the latest AOI domain
+    lines.append("# Source exported environment if present")
+    lines.append("if [ -f ./export_env.sh ]; then . ./export_env.sh; fi")
+    lines.append(f'EXP_ROOT="{exp_root.as_posix()}"')
+    lines.append(f'SCRIPT_DIR="{(exp_root / "scripts").as_posix()}"')
+    lines.append('cd "${SCRIPT_DIR}"')
+    lines.append("")
+    lines.append("date_string=$(date +'%y%m%d-%H%M')")
+    lines.append(f": \"${{EXPID:={expid}}}\"")
+    lines.append(f": \"${{FORCING_DIR:={forcing_dir}}}\"")
+    lines.append("OUT_DIR=\"${EXP_ROOT}/forcing\"")
+    lines.append("mkdir -p \"${OUT_DIR}\"")
+    lines.append("AOI_FILE_PATH=\"${EXP_ROOT}/domain_surfdata\"")
+    lines.append("AOI_POINTS_FILE=$(ls -1 ${AOI_FILE_PATH}/*_domain.lnd.TES_SE.4km.1d.c*.nc 2>/dev/null | sort | tail -n1 | xargs -r basename)")
+    lines.append("if [ -z \"${AOI_POINTS_FILE}\" ]; then echo 'ERROR: AOI domain file not found'; exit 2; fi")
+
+
+def render_run_forcing_array_sbatch(cfg: dict, exp_root: Path, nshards: int) -> str:
+    expid = cfg["expid"]
+    forcing_dir = cfg["source"]["forcing_dir"].rstrip("/")
+    scheduler = cfg.get("scheduler", {})
+    account = scheduler.get("account", "")
+    partition = scheduler.get("partition", "batch")
+    shard_time = scheduler.get("shard_time", scheduler.get("time", "2:00:00"))
+    shard_mem = scheduler.get("shard_mem", scheduler.get("mem", "128GB"))
+
+    lines = []
+    lines.append("#!/bin/bash")
+    if account:
+        lines.append(f"#SBATCH -A {account}")
+    lines.append(f"#SBATCH -J TES_{expid}_forcingShard")
+    lines.append(f"#SBATCH -p {partition}")
+    lines.append("#SBATCH -N 1")
+    lines.append("#SBATCH -n 1")
+    lines.append(f"#SBATCH -t {shard_time}")
+    lines.append(f"#SBATCH --mem={shard_mem}")
+    lines.append(f"#SBATCH --array=0-{nshards - 1}")
+    lines.append(f"#SBATCH -o {(exp_root / 'forcing' / '.shards').as_posix()}/slurm-%A_%a.out")
+    lines.append("")
+    lines.append("# One element of the forcing job array: subsets the files of shard ${SLURM_ARRAY_TASK_ID}")
+    lines.append("# listed in forcing_shards.json. Without Slurm: 'bash run_forcing_array.sbatch <shard>'")
+    lines.append("# runs one shard and 'bash run_forcing_array.sbatch local' runs the whole plan here.")
+    lines.append("set -euo pipefail")
+    lines.append("")
+    _render_forcing_inputs(lines, expid, forcing_dir, exp_root)
     lines.append("")
-    lines.append("# Running under Slurm allocation")
-    lines.append("echo \"srun -n '${SCHED_TASKS}' python3 TES_AOI_forcingGEN.py '${FORCING_DIR}' '${OUT_DIR}' '${AOI_FILE_PATH}/' '${AOI_POINTS_FILE}'\" | tee \"${OUT_DIR}/${EXPID}_forcinggen.cmd.${date_string}\"")
-    lines.append("srun -n \"${SCHED_TASKS:-2}\" python3 TES_AOI_forcingGEN.py \"${FORCING_DIR}\" \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${OUT_DIR}/${EXPID}_forcinggen.log.${date_string}\"")
+    lines.append("SHARD=\"${SLURM_ARRAY_TASK_ID:-${1:-}}\"")
+    lines.append("if [ -z \"${SHARD}\" ]; then echo 'usage: bash run_forcing_array.sbatch <shard>|local'; exit 2; fi")
+    lines.append("if [ \"${SHARD}\" = local ]; then")
+    lines.append("  python3 forcing_shards.py run-local --plan forcing_shards.json \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\" 2>&1 | tee \"${OUT_DIR}/${EXPID}_forcinggen.log.${date_string}\"")
+    lines.append("  python3 forcing_shards.py validate --plan forcing_shards.json \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\"")
+    lines.append("  python3 aoi_qa.py report \"${EXP_ROOT}\"")
+    lines.append("  exit 0")
+    lines.append("fi")
+    lines.append("python3 forcing_shards.py run --plan forcing_shards.json --shard \"${SHARD}\" \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\"")
+    return "\n".join(lines) + "\n"
+
+
+def render_run_forcing_finalize_sbatch(cfg: dict, exp_root: Path) -> str:
+    expid = cfg["expid"]
+    forcing_dir = cfg["source"]["forcing_dir"].rstrip("/")
+    scheduler = cfg.get("scheduler", {})
+    account = scheduler.get("account", "")
+    partition = scheduler.get("partition", "batch")
+
+    lines = []
+    lines.append("#!/bin/bash")
+    if account:
+        lines.append(f"#SBATCH -A {account}")
+    lines.append(f"#SBATCH -J TES_{expid}_forcingFinalize")
+    lines.append(f"#SBATCH -p {partition}")
+    lines.append("#SBATCH -N 1")
+    lines.append("#SBATCH -n 1")
+    lines.append("#SBATCH -t 0:30:00")
+    lines.append("")
+    lines.append("# Runs after the forcing job array: validates every shard, then creates the model links")
+    lines.append("set -euo pipefail")
+    lines.append("")
+    _render_forcing_inputs(lines, expid, forcing_dir, exp_root)
+    lines.append("")
+    lines.append("python3 forcing_shards.py validate --plan forcing_shards.json \"${OUT_DIR}\" \"${AOI_FILE_PATH}/\" \"${AOI_POINTS_FILE}\"")
+    lines.append("python3 aoi_qa.py report \"${EXP_ROOT}\"")
+    lines.append("bash create_links.sh")
+    lines.append("")
+    lines.append("# Submitted by aoi_pipeline.py: record the successful stage")
+    lines.append("if [ -n \"${PIPELINE_FINGERPRINT:-}\" ]; then")
+    lines.append("  python3 aoi_pipeline.py record --scripts-dir \"${SCRIPT_DIR}\" --stage \"${PIPELINE_STAGE:-forcing}\" --fingerprint \"${PIPELINE_FINGERPRINT}\" ${PIPELINE_CACHE_KEY:+--cache-key \"${PIPELINE_CACHE_KEY}\"}")
+    lines.append("fi")
+    return "\n".join(lines) + "\n"
+
+
+def render_submit_forcing_array_sh() -> str:
+    lines = []
+    lines.append("#!/bin/bash")
+    lines.append("# Submit the forcing job array and its dependent validate/link job.")
+    lines.append("# Optional argument: array indices to (re)submit, e.g. 'bash submit_forcing_array.sh 3,7'")
+    lines.append("set -euo pipefail")
+    lines.append("cd \"$(dirname \"$0\")\"")
+    lines.append("if [ -n \"${1:-}\" ]; then")
+    lines.append("  ARRAY_JOB=$(sbatch --parsable --array=\"$1\" run_forcing_array.sbatch)")
+    lines.append("else")
+    lines.append("  ARRAY_JOB=$(sbatch --parsable run_forcing_array.sbatch)")
+    lines.append("fi")
+    lines.append("# afterany: the finalize job also runs when shards fail and reports which ones to resubmit")
+    lines.append("FINAL_JOB=$(sbatch --parsable --dependency=afterany:${ARRAY_JOB} run_forcing_finalize.sbatch)")
+    lines.append("echo \"Submitted forcing array job ${ARRAY_JOB} and finalize job ${FINAL_JOB}\"")
     return "\n".join(lines) + "\n"
 
 
@@ -179,12 +348,15 @@ def render_export_env_sh(cfg: dict, exp_root: Path) -> str:
     lines.append(f"export SURFDATA_DIR=\"{surf_dir}\"")
     lines.append(f"export SURFDATA_FILE=\"{surf_file}\"")
     lines.append(f"export FORCING_DIR=\"{forcing_dir}\"")
+    if "qa" in cfg:
+        # thresholds checked by the generators while subsetting (aoi_qa.py)
+        lines.append(f"export AOI_QA_CONFIG=\"${{AOI_QA_CONFIG:-{(exp_root / 'scripts' / 'qa_config.json').as_posix()}}}\"")
     lines.append("")
-    # Optional scheduler exports for external use
+    # Optional scheduler exports for external use; values already set in the environment win
     if scheduler:
         for key, value in scheduler.items():
             var = f"SCHED_{key.upper()}"
-            lines.append(f"export {var}=\"{value}\"")
+            lines.append(f"export {var}=\"${{{var}:-{value}}}\"")
     return "\n".join(lines) + "\n"
 
 
@@ -301,7 +473,8 @@ def render_create_uelm_adspin_sh(cfg: dict, exp_root: Path) -> str:
 
 
 def _derive_template_vars_from_cfg(cfg: dict) -> tuple[str, str, str]:
-    base_domain_path = Path(cfg["source"]["base_domain_file"]).expanduser()
+    # a super-AOI source keeps the entire-domain paths in source_origin
+    base_domain_path = Path(cfg.get("source_origin", cfg["source"])["base_domain_file"]).expanduser()
     parts = base_domain_path.parts
     # Derive KILOCRAFT_ROOT (up to and including 'kiloCraft')
     if "kiloCraft" in parts:
@@ -442,6 +615,14 @@ def render_create_uelm_finalspin_sh(cfg: dict, exp_root: Path) -> str:
     lines.append("if [ -z \"${DOMAIN_FILE}\" ]; then echo 'ERROR: Domain file not found'; exit 2; fi")
     lines.append("SURFDATA_FILE=$(ls -1 ${CASE_DATA}/domain_surfdata/${EXPID}_surfdata.${TES_DATA_GROUP_ID}.4km.1d.NLCD.c*.nc 2>/dev/null | sort | tail -n1 | xargs -r basename)")
     lines.append("if [ -z \"${SURFDATA_FILE}\" ]; then echo 'ERROR: Surfdata file not found'; exit 2; fi")
+    lines.append("# An AOI finidat subset from an entire-domain spinup (TES_AOI_finidatGEN.py) replaces the adspin restart")
+    lines.append("AOI_FINIDAT=$(ls -1 ${CASE_DATA}/domain_surfdata/${EXPID}_*.elm.r.*.nc 2>/dev/null | sort | tail -n1)")
+    lines.append("if [ -n \"${AOI_FINIDAT}\" ]; then")
+    lines.append("  FINIDAT=\"${AOI_FINIDAT}\"")
+    lines.append("  echo \"Using AOI finidat ${FINIDAT}; create_uELM_adspin.sh is not needed\"")
+    lines.append("else")
+    lines.append("  FINIDAT=\"${KMELM_RUN_ROOT}/uELM_${EXPID}_${CASE_COMPSET}/run/uELM_${EXPID}_${CASE_COMPSET}.elm.r.0401-01-01-00000.nc\"")
+    lines.append("fi")
     lines.append("")
     lines.append("rm -rf \"${CASEDIR}\"")
     lines.append("")
@@ -477,7 +658,7 @@ def render_create_uelm_finalspin_sh(cfg: dict, exp_root: Path) -> str:
     lines.append("./xmlchange RUN_STARTDATE=\"0401-01-01\"")
     lines.append("")
     lines.append("cat >> user_nl_elm <<EOF")
-    lines.append("finidat = '${KMELM_RUN_ROOT}/uELM_${EXPID}_${CASE_COMPSET}/run/uELM_${EXPID}_${CASE_COMPSET}.elm.r.0401-01-01-00000.nc'")
+    lines.append("finidat = '${FINIDAT}'")
     lines.append("fsurdat = '${CASE_DATA}/domain_surfdata/${SURFDATA_FILE}'")
     lines.append("")
     lines.append("      spinup_state = 0")
@@ -539,6 +720,23 @@ def main() -> None:
     parser.add_argument("--config", required=True, help="Path to JSON config file")
     parser.add_argument("--run-domain-surfdata", action="store_true", help="Run domain and surfdata generation now")
     parser.add_argument("--submit-forcing", action="store_true", help="Submit forcing generation job now (sbatch)")
+    parser.add_argument("--forcing-shards", type=int, default=None,
+                        help="Plan the forcing files into N size-balanced shards and emit a Slurm job array "
+                             "(default: scheduler.forcing_shards, 0 = single srun job)")
+    parser.add_argument("--run-pipeline", choices=["local", "slurm"],
+                        help="Run all out-of-date stages now with aoi_pipeline.py (local processes or chained Slurm jobs)")
+    parser.add_argument("--static-resources", action="store_true",
+                        help="Use scheduler mem/time/tasks from the config verbatim instead of sizing them from the AOI "
+                             "and source data (also scheduler.auto_resources=false)")
+    parser.add_argument("--from-experiment", default=None,
+                        help="Subset from an existing experiment whose gridIDs contain the AOI: 'auto' searches the "
+                             "sibling experiments, 'none' always reads the entire-domain sources, or give a directory "
+                             "(default: source.from_experiment, else auto)")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always regenerate instead of linking outputs from the shared AOI cache (aoi_cache.py)")
+    parser.add_argument("--tiles", type=int, default=None,
+                        help="Split the AOI into N compact tiles, one experiment each, under <experiment_root> "
+                             "(default: tiles in the config, else 0 = one experiment)")
     args = parser.parse_args()
 
     scripts_root = Path(__file__).resolve().parent
@@ -547,6 +745,70 @@ def main() -> None:
     cfg = json.loads(cfg_path.read_text())
     cfg = expand_config_vars(cfg)
 
+    ntiles = args.tiles if args.tiles is not None else int(cfg.get("tiles", 0))
+    if ntiles > 1:
+        prepare_tiles(cfg, args, scripts_root, ntiles)
+    else:
+        prepare_experiment(cfg, args, scripts_root)
+
+
+def prepare_tiles(cfg: dict, args, scripts_root: Path, ntiles: int) -> None:
+    """One small experiment per compact tile of the AOI, a mosaic manifest and a one-pass generator."""
+    import copy
+
+    sys.path.insert(0, scripts_root.as_posix())
+    from aoi_source import aoi_gridids, resolve_source
+    from aoi_tiles import (TILE_GRIDID_DIR, generate, plan_tiles, record_tiles, tile_extent, tile_names,
+                           write_manifest, write_tile_gridids)
+    from tes_grid import TESGrid, cell_order_setting
+
+    exp_root = Path(cfg["experiment_root"]).expanduser()
+    ensure_dir(exp_root)
+    # tiles share the (possibly super-AOI) source of the whole AOI
+    cfg = resolve_source(cfg, args.from_experiment or cfg["source"].get("from_experiment", "auto"))
+    gridids = aoi_gridids(cfg)
+    if gridids is None:
+        raise ValueError("Tiling needs an AOI given by gridIDs (<AOI>_gridID.csv or an AOI domain .nc)")
+    grid = TESGrid.from_domain(Path(cfg.get("source_origin", cfg["source"])["base_domain_file"]).expanduser().as_posix())
+    parts = plan_tiles(grid, gridids, ntiles, cell_order_setting(cfg.get("cell_order")))
+
+    tile_args = argparse.Namespace(**dict(vars(args), run_domain_surfdata=False, submit_forcing=False,
+                                          run_pipeline=None, from_experiment="none", forcing_shards=0))
+    tiles = []
+    for name, ids in zip(tile_names(cfg["expid"], len(parts)), parts):
+        gridid_file = exp_root / TILE_GRIDID_DIR / f"{name}_gridID.csv"
+        write_tile_gridids(gridid_file, ids)
+        tile_cfg = copy.deepcopy(cfg)
+        tile_cfg.pop("tiles", None)
+        tile_cfg.update(expid=name, experiment_root=(exp_root / name).as_posix(), case_size_type="small",
+                        aoi_points={"dir": gridid_file.parent.as_posix(), "file": gridid_file.name})
+        prepare_experiment(tile_cfg, tile_args, scripts_root)
+        tiles.append(dict(name=name, experiment_root=(exp_root / name).as_posix(),
+                          gridid_file=gridid_file.as_posix(), ncells=int(ids.size), **tile_extent(grid, ids)))
+
+    manifest_path = write_manifest(exp_root, cfg, tiles)
+    run_tiles = exp_root / "run_tiles.sh"
+    write_text_file(run_tiles, "\n".join([
+        "#!/bin/bash",
+        "set -euo pipefail",
+        "# Domain, surfdata and forcing of every tile from one read of each source file",
+        f'python3 "{(scripts_root / "aoi_tiles.py").as_posix()}" generate --manifest "{manifest_path.as_posix()}" '
+        '--workers "${FORCING_SERIAL_WORKERS:-8}"',
+        "",
+    ]))
+    make_executable(run_tiles)
+    sizes = [t["ncells"] for t in tiles]
+    print(f"Prepared {len(tiles)} tiles of {min(sizes)}-{max(sizes)} cells; manifest {manifest_path}")
+
+    if args.run_domain_surfdata or args.submit_forcing or args.run_pipeline:
+        manifest = json.loads(manifest_path.read_text())
+        generate(manifest, int(os.environ.get("FORCING_SERIAL_WORKERS", "8")))
+        record_tiles(manifest)
+    else:
+        print(f"Generate the tile inputs with: bash {run_tiles.as_posix()}")
+
+
+def prepare_experiment(cfg: dict, args, scripts_root: Path) -> None:
     expid = cfg["expid"]
     exp_root = Path(cfg["experiment_root"]).expanduser()
     ensure_dir(exp_root)
@@ -562,11 +824,25 @@ def main() -> None:
     core_scripts = [
         "TES_AOI_domainGEN.py",
         "TES_AOI_surfdataGEN.py",
+        "TES_AOI_surfdataGEN_mpi.py",
         "TES_AOI_forcingGEN.py",
         "TES_AOI_forcingGEN_mpi.py",
+        "TES_AOI_finidatGEN.py",
+        "tes_grid.py",
         "forcing_domain_link_creation.py",
         "forcinglink_creation.py",
+        "forcing_links.py",
         "check_nc_compression.py",
+        "aoi_pipeline.py",
+        "aoi_cache.py",
+        "forcing_shards.py",
+        "forcing_catalog.py",
+        "forcing_progress.py",
+        "forcing_timeseries_export.py",
+        "aoi_qa.py",
+        "aoi_service.py",
+        "select_random_gridids.py",
+        "shape2gridID.py",
     ]
     for name in core_scripts:
         src = scripts_root / name
@@ -580,6 +856,33 @@ def main() -> None:
         if src.exists():
             copy_if_missing(src, user_scripts_dir / (name + ".orig"))
 
+    # Read from a generated super-AOI experiment instead of the entire domain when one contains the AOI
+    from_experiment = args.from_experiment or cfg["source"].get("from_experiment", "auto")
+    sys.path.insert(0, scripts_root.as_posix())
+    from aoi_source import resolve_source
+
+    cfg = resolve_source(cfg, from_experiment)
+
+    nshards = args.forcing_shards
+    if nshards is None:
+        nshards = int(cfg.get("scheduler", {}).get("forcing_shards", 0))
+
+    # Size mem/time/tasks from the AOI cell count and the source data; SCHED_* env overrides still win
+    if not args.static_resources and cfg.get("scheduler", {}).get("auto_resources", True):
+        sys.path.insert(0, scripts_root.as_posix())
+        from aoi_resources import apply_resource_estimate, estimate_resources
+
+        try:
+            estimate = estimate_resources(cfg, nshards=nshards)
+        except (OSError, KeyError) as e:
+            print(f"WARNING: cannot size resources from the source data ({e}); using the config scheduler values")
+        else:
+            cfg = apply_resource_estimate(cfg, estimate)
+            write_text_file(user_scripts_dir / "resource_estimate.json", json.dumps(estimate, indent=2) + "\n")
+            print(f"Sized forcing for {estimate['aoi_cells']} AOI cells, {estimate['forcing_files']} files: "
+                  f"{estimate['tasks']} ranks ({estimate['ranks_per_node']}/node) x {estimate['mem_per_rank']}, "
+                  f"--mem={estimate['mem']} -t {estimate['time']}; surfdata tasks {estimate['surfdata_tasks']}")
+
     # Generate customized wrappers
     run_domain_surfdata = render_run_domain_surfdata_sh(cfg, user_scripts_dir, exp_root)
     write_text_file(user_scripts_dir / "run_domain_surfdata.sh", run_domain_surfdata)
@@ -589,10 +892,34 @@ def main() -> None:
     write_text_file(user_scripts_dir / "run_forcing.sbatch", run_forcing_sbatch)
     make_executable(user_scripts_dir / "run_forcing.sbatch")
 
+    # Optional job-array sharding of the forcing generation
+    if nshards > 0:
+        sys.path.insert(0, scripts_root.as_posix())
+        from forcing_shards import discover_forcing_files, plan_shards, write_plan
+
+        forcing_src = cfg["source"]["forcing_dir"].rstrip("/")
+        files = discover_forcing_files(forcing_src)
+        if not files:
+            raise FileNotFoundError(f"No forcing files found under {forcing_src}; cannot plan shards")
+        plan = write_plan((user_scripts_dir / "forcing_shards.json").as_posix(), forcing_src, plan_shards(files, nshards))
+        ensure_dir(forcing_dir_out / ".shards")
+        for name, content in (
+            ("run_forcing_array.sbatch", render_run_forcing_array_sbatch(cfg, exp_root, plan["nshards"])),
+            ("run_forcing_finalize.sbatch", render_run_forcing_finalize_sbatch(cfg, exp_root)),
+            ("submit_forcing_array.sh", render_submit_forcing_array_sh()),
+        ):
+            write_text_file(user_scripts_dir / name, content)
+            make_executable(user_scripts_dir / name)
+        print(f"Planned {plan['total_files']} forcing files into {plan['nshards']} shards")
+
     create_links_sh = render_create_links_sh()
     write_text_file(user_scripts_dir / "create_links.sh", create_links_sh)
     make_executable(user_scripts_dir / "create_links.sh")
 
+    # QA thresholds for the generators, exported as AOI_QA_CONFIG by export_env.sh
+    if "qa" in cfg:
+        write_text_file(user_scripts_dir / "qa_config.json", json.dumps(cfg["qa"], indent=2) + "\n")
+
     export_env_sh = render_export_env_sh(cfg, exp_root)
     write_text_file(user_scripts_dir / "export_env.sh", export_env_sh)
     make_executable(user_scripts_dir / "export_env.sh")
@@ -608,12 +935,22 @@ def main() -> None:
     write_text_file(user_scripts_dir / "create_uELM_finalspin.sh", create_uelm_finalspin)
     make_executable(user_scripts_dir / "create_uELM_finalspin.sh")
 
-    # Optionally execute steps now
-    if args.run_domain_surfdata:
-        os.system(f"bash '{(user_scripts_dir / 'run_domain_surfdata.sh').as_posix()}'")
-
-    if args.submit_forcing:
-        os.system(f"sbatch '{(user_scripts_dir / 'run_forcing.sbatch').as_posix()}'")
+    # Expanded config for aoi_pipeline.py run from the scripts dir
+    write_text_file(user_scripts_dir / "experiment_config.json", json.dumps(cfg, indent=2) + "\n")
+
+    # Optionally execute steps now (stages that are already up to date are skipped)
+    if args.run_domain_surfdata or args.submit_forcing or args.run_pipeline:
+        sys.path.insert(0, scripts_root.as_posix())
+        from aoi_pipeline import run_pipeline
+
+        use_cache = not args.no_cache
+        if args.run_pipeline:
+            run_pipeline(cfg, exp_root, backend=args.run_pipeline, use_cache=use_cache)
+        else:
+            if args.run_domain_surfdata:
+                run_pipeline(cfg, exp_root, targets=["surfdata"], backend="local", use_cache=use_cache)
+            if args.submit_forcing:
+                run_pipeline(cfg, exp_root, targets=["forcing"], backend="slurm", use_cache=use_cache)
 
     print("Prepared experiment at:", exp_root)
     print("- domain_surfdata:", domain_surf_dir)
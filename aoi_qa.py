@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Data-quality statistics computed while the AOI files are subset.
+
+AOI_forcing_save_1d and the surfdata generators pass every block of AOI data they write
+through a FileQA, which keeps per-variable running statistics (count, min, max, mean,
+NaN count, fill-value count and counts below/above the physical range). When the output
+file is closed the statistics are written next to it as <output>.qa.json, and the
+thresholds of the QA settings are checked: a violation raises QAError, so the generator
+fails on the first bad file instead of after a separate checking pass.
+
+Settings are read from the JSON file named by $AOI_QA_CONFIG (aoi_prepare_experiment.py
+writes the config "qa" section to scripts/qa_config.json and exports it). Without
+settings the statistics are still written but nothing is checked; AOI_QA=off turns the
+scan off. Thresholds are fractions of the values of a variable in one file:
+
+  {"max_nan_fraction": 0.0, "max_fill_fraction": 0.0, "max_out_of_range_fraction": 0.001,
+   "fail": true, "ranges": {"TBOT": [180, 340]},
+   "variables": {"PCT_URBAN": {"max_fill_fraction": 1.0}}}
+
+Physical ranges come from "ranges", then the valid_min/valid_max/valid_range attributes
+of the source variable, then the defaults below.
+
+Example use:
+  python3 aoi_qa.py report <experiment_root>     # aggregate the sidecars into qa_report.json
+  python3 aoi_qa.py show <output>.nc.qa.json
+"""
+
+import argparse
+import fnmatch
+import json
+import math
+import os
+import sys
+from datetime import datetime
+
+import numpy as np
+
+QA_CONFIG_ENV = "AOI_QA_CONFIG"
+QA_SWITCH_ENV = "AOI_QA"
+SIDECAR_SUFFIX = ".qa.json"
+REPORT = "qa_report.json"
+THRESHOLDS = ("max_nan_fraction", "max_fill_fraction", "max_out_of_range_fraction")
+
+# physical ranges of the forcing and surfdata variables (fnmatch patterns, first match wins)
+DEFAULT_RANGES = {
+    "TBOT": (150.0, 350.0),        # K
+    "PRECTmms": (0.0, 0.1),        # mm/s
+    "FSDS": (0.0, 1500.0),         # W/m2
+    "FLDS": (0.0, 800.0),          # W/m2
+    "QBOT": (0.0, 0.1),            # kg/kg
+    "RH": (0.0, 105.0),            # %
+    "PSRF": (2.0e4, 1.1e5),        # Pa
+    "WIND": (0.0, 60.0),           # m/s
+    "PCT_*": (0.0, 100.0),         # %
+    "LATIXY": (-90.0, 90.0),
+    "LONGXY": (-180.0, 360.0),
+}
+
+
+class QAError(ValueError):
+    pass
+
+
+_settings = {}
+
+
+def load_settings() -> dict:
+    """QA settings of this process ({} without $AOI_QA_CONFIG, None when AOI_QA=off)."""
+    if os.environ.get(QA_SWITCH_ENV, "").lower() in ("off", "0", "false", "no"):
+        return None
+    # keyed by path: a long-running process (aoi_service.py) serves experiments with different configs
+    path = os.environ.get(QA_CONFIG_ENV, "")
+    if path not in _settings:
+        if path:
+            with open(path) as f:
+                _settings[path] = json.load(f)
+        else:
+            _settings[path] = {}
+    settings = _settings[path]
+    return None if settings.get("enabled", True) is False else settings
+
+
+def _attr_range(variable):
+    attrs = set(variable.ncattrs())
+    if "valid_range" in attrs:
+        lo, hi = variable.getncattr("valid_range")
+        return float(lo), float(hi)
+    if "valid_min" in attrs or "valid_max" in attrs:
+        lo = float(variable.getncattr("valid_min")) if "valid_min" in attrs else -math.inf
+        hi = float(variable.getncattr("valid_max")) if "valid_max" in attrs else math.inf
+        return lo, hi
+    return None
+
+
+def physical_range(name, variable=None, settings=None):
+    """(lo, hi) for variable name, or None when it has no known range."""
+    ranges = (settings or {}).get("ranges", {})
+    if name in ranges:
+        lo, hi = ranges[name]
+        return (-math.inf if lo is None else float(lo)), (math.inf if hi is None else float(hi))
+    if variable is not None:
+        found = _attr_range(variable)
+        if found is not None:
+            return found
+    for pattern, bounds in DEFAULT_RANGES.items():
+        if fnmatch.fnmatchcase(name, pattern):
+            return bounds
+    return None
+
+
+class VariableStats:
+    """Running statistics of one variable; update() takes (masked) blocks of any shape."""
+
+    def __init__(self, name, valid_range=None, fill_value=None):
+        self.name = name
+        self.range = valid_range
+        self.fill_value = fill_value
+        self.count = 0
+        self.valid = 0
+        self.nan = 0
+        self.fill = 0
+        self.below = 0
+        self.above = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.sum = 0.0
+
+    def update(self, data) -> None:
+        values = np.ma.getdata(data)
+        if values.dtype.kind not in "fiu":  # chars and strings carry no statistics
+            return
+        # everything netCDF4 masked on read (fill, missing_value, outside valid_*) counts as fill
+        mask = np.ma.getmaskarray(data) if np.ma.is_masked(data) else None
+        if self.fill_value is not None:
+            # auto-masking off: the fill value is still in the data
+            filled = values == self.fill_value
+            mask = filled if mask is None else (mask | filled)
+        self.count += values.size
+        if mask is not None:
+            self.fill += int(np.count_nonzero(mask))
+            values = values[~mask]
+        if values.dtype.kind == "f":
+            nan = np.isnan(values)
+            nnan = int(np.count_nonzero(nan))
+            if nnan:
+                self.nan += nnan
+                values = values[~nan]
+        if values.size == 0:
+            return
+        self.valid += values.size
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.sum += float(values.sum(dtype=np.float64))
+        if self.range is not None:
+            lo, hi = self.range
+            self.below += int(np.count_nonzero(values < lo))
+            self.above += int(np.count_nonzero(values > hi))
+
+    def as_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "valid": self.valid,
+            "min": self.min if self.valid else None,
+            "max": self.max if self.valid else None,
+            "mean": self.sum / self.valid if self.valid else None,
+            "nan": self.nan,
+            "fill": self.fill,
+            "below_range": self.below,
+            "above_range": self.above,
+            "range": list(self.range) if self.range is not None else None,
+        }
+
+
+def fractions(stats: dict) -> dict:
+    count = stats["count"] or 1
+    return {
+        "max_nan_fraction": stats["nan"] / count,
+        "max_fill_fraction": stats["fill"] / count,
+        "max_out_of_range_fraction": (stats["below_range"] + stats["above_range"]) / count,
+    }
+
+
+def check_thresholds(name, stats: dict, settings: dict) -> list:
+    """Violations [{variable, check, value, limit}] of one variable's statistics."""
+    limits = {key: settings[key] for key in THRESHOLDS if key in settings}
+    limits.update({key: value for key, value in settings.get("variables", {}).get(name, {}).items()
+                   if key in THRESHOLDS})
+    if not limits or not stats["count"]:
+        return []
+    found = fractions(stats)
+    return [{"variable": name, "check": key, "value": found[key], "limit": limit}
+            for key, limit in limits.items() if limit is not None and found[key] > limit]
+
+
+class FileQA:
+    """QA of one AOI output file: variable() to start a variable, update() per block, close()."""
+
+    def __init__(self, output, source="", settings=None):
+        self.output = output
+        self.source = source
+        self.settings = settings or {}
+        self.stats = {}
+
+    def variable(self, name, variable) -> VariableStats:
+        fill = None
+        if not variable.mask:
+            for attr in ("_FillValue", "missing_value"):
+                if attr in variable.ncattrs():
+                    fill = variable.getncattr(attr)
+                    break
+        stats = VariableStats(name, physical_range(name, variable, self.settings), fill)
+        self.stats[name] = stats
+        return stats
+
+    def update(self, name, data) -> None:
+        self.stats[name].update(data)
+
+    def close(self) -> dict:
+        """Write the sidecar; raises QAError when a threshold is exceeded and "fail" is set."""
+        variables = {name: stats.as_dict() for name, stats in self.stats.items()}
+        violations = [v for name, stats in variables.items()
+                      for v in check_thresholds(name, stats, self.settings)]
+        fail = bool(self.settings.get("fail", True))
+        record = {
+            "file": os.path.basename(self.output),
+            "source": self.source,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "thresholds": {key: self.settings[key] for key in THRESHOLDS if key in self.settings},
+            "fail": fail,
+            "variables": variables,
+            "violations": violations,
+        }
+        path = self.output + SIDECAR_SUFFIX
+        tmp = f"{path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(record, f, indent=1)
+            f.write("\n")
+        os.replace(tmp, path)
+        if violations:
+            text = "; ".join(f"{v['variable']} {v['check']} {v['value']:.4g} > {v['limit']}" for v in violations)
+            if fail:
+                raise QAError(f"QA failed for {self.output}: {text}")
+            print(f"QA WARNING for {self.output}: {text}")
+        return record
+
+
+def file_qa(output, source=""):
+    """FileQA for output with the settings of this process, or None when QA is off."""
+    settings = load_settings()
+    if settings is None:
+        if os.path.exists(output + SIDECAR_SUFFIX):
+            os.remove(output + SIDECAR_SUFFIX)  # would describe an earlier version of output
+        return None
+    return FileQA(output, source, settings)
+
+
+def _merge(total: dict, stats: dict) -> None:
+    for key in ("count", "valid", "nan", "fill", "below_range", "above_range"):
+        total[key] += stats[key]
+    if stats["valid"]:
+        total["sum"] += stats["mean"] * stats["valid"]
+        total["min"] = stats["min"] if total["min"] is None else min(total["min"], stats["min"])
+        total["max"] = stats["max"] if total["max"] is None else max(total["max"], stats["max"])
+
+
+def aggregate(exp_root) -> dict:
+    """Merge every <file>.qa.json below exp_root into per-variable totals plus all violations."""
+    totals, violations, files = {}, [], 0
+    for root, dirs, names in os.walk(exp_root):
+        # links (atm_forcing.datm7.km.1d, cached outputs) point at sidecars counted where they live
+        dirs[:] = sorted(d for d in dirs if not os.path.islink(os.path.join(root, d)))
+        for name in sorted(names):
+            if not name.endswith(SIDECAR_SUFFIX) or os.path.islink(os.path.join(root, name)):
+                continue
+            with open(os.path.join(root, name)) as f:
+                record = json.load(f)
+            files += 1
+            rel = os.path.relpath(os.path.join(root, record["file"]), exp_root)
+            for var, stats in record["variables"].items():
+                total = totals.setdefault(var, {"files": 0, "count": 0, "valid": 0, "nan": 0, "fill": 0,
+                                                "below_range": 0, "above_range": 0, "sum": 0.0,
+                                                "min": None, "max": None, "range": stats["range"]})
+                total["files"] += 1
+                _merge(total, stats)
+            violations.extend(dict(v, file=rel, fail=record.get("fail", True)) for v in record["violations"])
+    for total in totals.values():
+        total["mean"] = total.pop("sum") / total["valid"] if total["valid"] else None
+    return {
+        "experiment_root": os.path.abspath(exp_root),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "files": files,
+        "variables": dict(sorted(totals.items())),
+        "violations": violations,
+    }
+
+
+def _fmt(value):
+    return "-" if value is None else f"{value:.4g}"
+
+
+def print_variables(variables: dict) -> None:
+    print(f"{'variable':<16} {'files':>6} {'min':>11} {'max':>11} {'mean':>11} {'nan':>9} {'fill':>9} {'out_of_range':>12}")
+    for name, s in variables.items():
+        print(f"{name:<16} {s.get('files', 1):>6} {_fmt(s['min']):>11} {_fmt(s['max']):>11} {_fmt(s['mean']):>11} "
+              f"{s['nan']:>9} {s['fill']:>9} {s['below_range'] + s['above_range']:>12}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Summarize the QA sidecars written by the AOI generators")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_rep = sub.add_parser("report", help="Aggregate all sidecars of an experiment into qa_report.json")
+    p_rep.add_argument("exp_root", help="<experiment_root> (or any directory holding *.qa.json)")
+    p_rep.add_argument("--output", default=None, help=f"Report path (default <exp_root>/{REPORT})")
+    p_show = sub.add_parser("show", help="Print one sidecar")
+    p_show.add_argument("sidecar")
+    args = parser.parse_args()
+
+    if args.cmd == "show":
+        with open(args.sidecar) as f:
+            record = json.load(f)
+        print(f"{record['file']} from {record['source']} ({record['created']})")
+        print_variables(record["variables"])
+        violations = [dict(v, fail=record.get("fail", True)) for v in record["violations"]]
+    else:
+        report = aggregate(args.exp_root)
+        output = args.output or os.path.join(args.exp_root, REPORT)
+        with open(output, "w") as f:
+            json.dump(report, f, indent=1)
+            f.write("\n")
+        print(f"QA of {report['files']} files under {report['experiment_root']} -> {output}")
+        print_variables(report["variables"])
+        violations = report["violations"]
+    for v in violations:
+        level = "VIOLATION" if v["fail"] else "WARNING"
+        print(f"{level} {v.get('file', '')} {v['variable']}: {v['check']} {v['value']:.4g} > {v['limit']}")
+    # only thresholds configured to fail make the report fail
+    sys.exit(1 if any(v["fail"] for v in violations) else 0)
+
+
+if __name__ == "__main__":
+    main()
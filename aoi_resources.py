@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+"""Right-size the generated wrappers from the actual AOI and source data.
+
+The estimate uses the AOI cell count, the per-variable bytes of the forcing and
+surfdata sources and the number/size of the forcing files, and mirrors how the
+generators hold data in memory:
+
+  forcing rank  gridID/mask/index arrays over the entire domain
+                + one 16-step read chunk (data + mask)
+                + the float64 AOI array of a whole file (and its write copy)
+  surfdata      one entire-domain layer (data + mask) + one AOI variable per worker,
+                on the single compute node of the surfdata job
+
+Walltime is the larger of the aggregate-throughput bound and the slowest single file,
+times a safety margin. Tunables live under the optional "sizing" config section.
+
+Example use:
+  python3 aoi_resources.py --config aoi_helene_config.json
+"""
+
+import argparse
+import json
+import math
+import os
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+
+FORCING_CHUNK_STEPS = 16  # chunk_size in AOI_forcing_save_1d
+
+SIZING_DEFAULTS = {
+    "safety_margin": 1.5,          # multiplies memory and walltime
+    "rank_overhead_gb": 0.5,       # interpreter, numpy, netCDF4 buffers
+    "rank_read_mb_per_s": 100.0,   # sustained read rate of one rank
+    "aggregate_read_mb_per_s": 2000.0,  # file-system limit shared by all ranks
+    "cores_per_node": 128,         # node_mem (optional) defaults to scheduler.mem
+    "max_ranks_per_node": 32,
+    "min_time_minutes": 30,
+    "max_time_minutes": 48 * 60,
+    "startup_minutes": 10,
+    "max_surfdata_tasks": 16,
+}
+
+
+def _parse_mem_gb(value) -> float:
+    text = str(value).strip().upper()
+    for suffix, scale in (("TB", 1024.0), ("T", 1024.0), ("GB", 1.0), ("G", 1.0), ("MB", 1 / 1024.0), ("M", 1 / 1024.0)):
+        if text.endswith(suffix):
+            return float(text[: -len(suffix)]) * scale
+    return float(text) / 1024.0  # plain Slurm --mem numbers are MB
+
+
+def format_mem(gb: float) -> str:
+    return f"{max(1, int(math.ceil(gb)))}GB"
+
+
+def format_time(minutes: float) -> str:
+    minutes = int(math.ceil(minutes / 15.0) * 15)  # round up to quarter hours
+    return f"{minutes // 60}:{minutes % 60:02d}:00"
+
+
+def count_aoi_cells(aoi_path: Path) -> int:
+    """Number of AOI cells in a gridID/xcyc csv or a gridID/domain NetCDF."""
+    name = aoi_path.name
+    if name.endswith(".csv"):
+        with open(aoi_path) as f:
+            return max(0, sum(1 for line in f if line.strip()) - 1)  # minus the header line
+    import netCDF4 as nc
+    with nc.Dataset(aoi_path, "r") as ds:
+        return int(ds["gridID"].size)
+
+
+def forcing_source_stats(forcing_dir: str) -> dict:
+    """File count/bytes plus the layout of one file per stream (from the forcing catalog, or header reads)."""
+    try:
+        from forcing_catalog import catalog_files
+        rows = catalog_files(forcing_dir)
+    except (ImportError, OSError, ValueError, sqlite3.Error):
+        rows = None
+    if rows is None:
+        return _forcing_source_stats_walk(forcing_dir)
+    streams = {}
+    for r in rows:
+        stream = streams.setdefault(r["dir"], {"files": 0, "bytes": 0, "max_file_bytes": 0, "sample": r["file"],
+                                               "ncells": 0, "time_steps": 1, "itemsize": 4})
+        stream["files"] += 1
+        stream["bytes"] += r["size"]
+        stream["max_file_bytes"] = max(stream["max_file_bytes"], r["size"])
+        stream["ncells"] = max(stream["ncells"], r["ncells"])
+        for variable in r["variables"].values():
+            if len(variable["dims"]) == 3:
+                stream["time_steps"] = max(stream["time_steps"], variable["shape"][0])
+                stream["itemsize"] = max(stream["itemsize"], np.dtype(variable["dtype"]).itemsize)
+    return {
+        "files": len(rows),
+        "bytes": sum(r["size"] for r in rows),
+        "max_file_bytes": max((r["size"] for r in rows), default=0),
+        "streams": streams,
+    }
+
+
+def _forcing_source_stats_walk(forcing_dir: str) -> dict:
+    """forcing_source_stats without the catalog: one header read per stream."""
+    import netCDF4 as nc
+    from forcing_shards import discover_forcing_files
+
+    files = discover_forcing_files(forcing_dir)
+    streams = {}
+    for f in files:
+        stream = streams.setdefault(f["dir"], {"files": 0, "bytes": 0, "max_file_bytes": 0, "sample": f["file"]})
+        stream["files"] += 1
+        stream["bytes"] += f["size"]
+        stream["max_file_bytes"] = max(stream["max_file_bytes"], f["size"])
+    for rel_dir, stream in streams.items():
+        with nc.Dataset(os.path.join(forcing_dir, rel_dir, stream["sample"]), "r") as src:
+            ncells = len(src.dimensions.get("ni") or src.dimensions["gridcell"])
+            steps, itemsize = 1, 4
+            for variable in src.variables.values():
+                if len(variable.dimensions) == 3:
+                    steps = max(steps, variable.shape[0])
+                    itemsize = max(itemsize, variable.dtype.itemsize)
+        stream.update({"ncells": ncells, "time_steps": steps, "itemsize": itemsize})
+    return {
+        "files": len(files),
+        "bytes": sum(f["size"] for f in files),
+        "max_file_bytes": max((f["size"] for f in files), default=0),
+        "streams": streams,
+    }
+
+
+def surfdata_source_stats(surfdata_file: Path) -> dict:
+    import netCDF4 as nc
+    with nc.Dataset(surfdata_file, "r") as src:
+        ncells = len(src.dimensions["gridcell"])
+        layers = [int(np.prod(v.shape[:-1], dtype=np.int64)) for v in src.variables.values()
+                  if v.dimensions and v.dimensions[-1] == "gridcell"]
+        itemsize = max((v.dtype.itemsize for v in src.variables.values()), default=8)
+    return {"ncells": ncells, "gridcell_variables": len(layers), "max_layers": max(layers, default=1), "itemsize": itemsize}
+
+
+def estimate_resources(cfg: dict, nshards=None) -> dict:
+    """Derive memory per rank, ranks per node and walltime for forcing and surfdata.
+    nshards (default scheduler.forcing_shards) adds the per-element job-array resources."""
+    sizing = dict(SIZING_DEFAULTS, **cfg.get("sizing", {}))
+    scheduler = cfg.get("scheduler", {})
+    margin = float(sizing["safety_margin"])
+    gb = 1024.0 ** 3
+
+    aoi_path = Path(cfg["aoi_points"]["dir"]).expanduser() / cfg["aoi_points"]["file"]
+    n_aoi = count_aoi_cells(aoi_path)
+
+    forcing = forcing_source_stats(cfg["source"]["forcing_dir"].rstrip("/"))
+    rank_bytes = 0
+    for stream in forcing["streams"].values():
+        ni, steps, item = stream["ncells"], stream["time_steps"], stream["itemsize"]
+        index_arrays = ni * (8 + 1 + 8)                       # grid_ids, AOI_mask, AOI_idx
+        read_chunk = FORCING_CHUNK_STEPS * ni * (item + 1)    # masked read of 16 steps
+        aoi_array = 2 * steps * n_aoi * 8                     # float64 data_arr and its write copy
+        rank_bytes = max(rank_bytes, index_arrays + read_chunk + aoi_array)
+    mem_per_rank = (rank_bytes / gb + float(sizing["rank_overhead_gb"])) * margin
+
+    node_mem = _parse_mem_gb(sizing.get("node_mem") or scheduler.get("mem", "500GB"))
+    nodes = int(scheduler.get("nodes", 1))
+    ranks_per_node = int(min(sizing["cores_per_node"], sizing["max_ranks_per_node"],
+                             max(1, node_mem // mem_per_rank)))
+    tasks = max(1, min(ranks_per_node * nodes, forcing["files"]))
+    ranks_per_node = min(ranks_per_node, tasks)
+
+    mb = 1024.0 ** 2
+    rank_rate = float(sizing["rank_read_mb_per_s"]) * mb
+    aggregate_rate = min(float(sizing["aggregate_read_mb_per_s"]) * mb, rank_rate * tasks)
+    seconds = max(forcing["bytes"] / aggregate_rate, forcing["max_file_bytes"] / rank_rate)
+    minutes = seconds / 60.0 * margin + float(sizing["startup_minutes"])
+    minutes = min(max(minutes, float(sizing["min_time_minutes"])), float(sizing["max_time_minutes"]))
+
+    # one shard of a job array runs on a single rank
+    if nshards is None:
+        nshards = int(scheduler.get("forcing_shards", 0) or 0)
+    shard_minutes = None
+    if nshards > 0:
+        shard_seconds = max(forcing["bytes"] / nshards, forcing["max_file_bytes"]) / rank_rate
+        shard_minutes = min(max(shard_seconds / 60.0 * margin + float(sizing["startup_minutes"]),
+                                float(sizing["min_time_minutes"])), float(sizing["max_time_minutes"]))
+
+    surf_file = Path(cfg["source"]["surfdata_dir"]).expanduser() / cfg["source"]["surfdata_file"]
+    surf = surfdata_source_stats(surf_file)
+    worker_bytes = surf["ncells"] * (surf["itemsize"] + 1) + surf["max_layers"] * n_aoi * surf["itemsize"]
+    surf_worker_gb = (worker_bytes / gb + float(sizing["rank_overhead_gb"])) * margin
+    # the surfdata job runs on one compute node, not on the host preparing the experiment
+    surfdata_tasks = int(max(1, min(sizing["max_surfdata_tasks"], surf["gridcell_variables"],
+                                    sizing["cores_per_node"], node_mem // surf_worker_gb)))
+
+    estimate = {
+        "aoi_cells": n_aoi,
+        "forcing_files": forcing["files"],
+        "forcing_bytes": forcing["bytes"],
+        "forcing_max_file_bytes": forcing["max_file_bytes"],
+        "mem_per_rank": format_mem(mem_per_rank),
+        "ranks_per_node": ranks_per_node,
+        "tasks": tasks,
+        "nodes": nodes,
+        "mem": format_mem(mem_per_rank * ranks_per_node),
+        "time": format_time(minutes),
+        "surfdata_tasks": surfdata_tasks,
+        "surfdata_mem_per_task": format_mem(surf_worker_gb),
+        "sizing": sizing,
+    }
+    if shard_minutes is not None:
+        estimate["shard_mem"] = format_mem(mem_per_rank)
+        estimate["shard_time"] = format_time(shard_minutes)
+    return estimate
+
+
+def apply_resource_estimate(cfg: dict, estimate: dict) -> dict:
+    """Return a copy of cfg whose scheduler section carries the derived resources."""
+    cfg = json.loads(json.dumps(cfg))
+    scheduler = cfg.setdefault("scheduler", {})
+    for key in ("mem", "time", "tasks", "ranks_per_node", "surfdata_tasks", "shard_mem", "shard_time"):
+        if key in estimate:
+            scheduler[key] = estimate[key]
+    return cfg
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Estimate forcing/surfdata resources for an AOI experiment config.")
+    parser.add_argument("--config", required=True, help="Path to JSON config file")
+    args = parser.parse_args()
+
+    from aoi_prepare_experiment import expand_config_vars
+
+    cfg = expand_config_vars(json.loads(Path(args.config).read_text()))
+    estimate = estimate_resources(cfg)
+    estimate.pop("sizing")
+    print(json.dumps(estimate, indent=2))
+
+
+if __name__ == "__main__":
+    main()
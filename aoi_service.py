@@ -0,0 +1,559 @@
+#!/usr/bin/env python3
+"""Persistent local AOI service: the entire domain, its indices and the tool imports stay warm.
+
+Each run of TES_AOI_domainGEN.py, TES_AOI_surfdataGEN.py, select_random_gridids.py or
+shape2gridID.py pays for Python startup, the imports (pandas, scipy, pyproj, geopandas),
+a full read of the entire domain and the construction of its KD-trees and gridID
+lookup. `serve` does all of that once: it imports the tools, keeps every --domain file
+in memory with its gridID lookup, its xc/yc and xc_LCC/yc_LCC KD-trees and its TES
+raster (tes_grid.py), and forks a pool of workers that inherit this state. Jobs run on
+the pool with the working directory and environment of the client that sent them.
+
+Jobs arrive over a UNIX socket (<dir>/aoi_service.sock) or, with `run --queue`, as files
+in <dir>/queue/new/ that the service claims. <dir> is --dir, $AOI_SERVICE_DIR or
+~/.cache/aoi_service. The output of a job goes to <dir>/jobs/<id>.log and is streamed
+back to the client. `run` takes the arguments of the tool it replaces. Without a
+service it runs the tool in-process, so scripts can always call the client.
+
+A domain is used warm when the path a job names resolves to a loaded file (the
+./domain.lnd.TES_SE.4km.1d.nc link of TES_AOI_domainGEN.py included). A file changed
+on disk is reloaded by the service before it hands out the next job, and the pool is
+forked again so that every worker (and `status`) has the new copy; jobs already
+submitted finish on the old workers.
+
+Example use:
+  python3 aoi_service.py serve --domain <entire_domain>/domain.lnd.TES_SE.4km.1d.c240827.nc --workers 4 &
+  python3 aoi_service.py run domain <input_path> <output_path> <AOI_points_file>
+  python3 aoi_service.py run surfdata <input_path> <TES_surfdata> <output_path> <AOI_file_path> <AOI_points_file>
+  python3 aoi_service.py run sample --domain <domain.nc> --percent 1 5 10 --case-name TN
+  python3 aoi_service.py run shape <shapefile> <AOI> --domain <domain.nc>
+  python3 aoi_service.py status
+  python3 aoi_service.py stop
+"""
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr, redirect_stdout
+
+import numpy as np
+
+SERVICE_DIR_ENV = "AOI_SERVICE_DIR"
+SOCKET = "aoi_service.sock"
+QUEUE = "queue"
+JOBS = "jobs"
+POLL_SECONDS = 0.5
+LOG_DAYS = 7  # job logs older than this are removed when the service starts
+TOOLS = {
+    "domain": "TES_AOI_domainGEN",
+    "surfdata": "TES_AOI_surfdataGEN",
+    "sample": "select_random_gridids",
+    "shape": "shape2gridID",
+}
+
+
+def service_dir(path: str = None) -> str:
+    return path or os.environ.get(SERVICE_DIR_ENV) or os.path.join(os.path.expanduser("~"), ".cache", "aoi_service")
+
+
+def _stamp(path: str) -> tuple:
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+# --- warm state -----------------------------------------------------------------------
+
+class WarmDomain:
+    """An entire-domain file held in memory with its gridID lookup, KD-trees and raster."""
+
+    def __init__(self, path: str):
+        from scipy.spatial import cKDTree
+        from tes_grid import GRID_MAPPING, TESGrid
+
+        self.path = os.path.realpath(path)
+        self.stamp = _stamp(self.path)
+        with open(self.path, "rb") as f:
+            self.data = f.read()
+        with self.open() as src:
+            var = src["gridID"]
+            self.gridid = np.asarray(var[:]).reshape(-1).astype(np.int64)
+            # (grid_ids, var_attrs, global_attrs) as select_random_gridids.read_gridids returns them
+            self.gridids = (np.asarray(var[:]).reshape(-1), {k: var.getncattr(k) for k in var.ncattrs()},
+                            {k: src.getncattr(k) for k in src.ncattrs()}) if var.ndim == 2 and var.shape[0] == 1 else None
+            coords = {name: np.asarray(src[name][:], dtype=np.float64).reshape(-1)
+                      for name in ("xc", "yc", "xc_LCC", "yc_LCC") if name in src.variables}
+            mapping = {}
+            if GRID_MAPPING in src.variables:
+                mapping = {a: src[GRID_MAPPING].getncattr(a) for a in src[GRID_MAPPING].ncattrs()}
+        self.order = np.argsort(self.gridid, kind="stable")
+        self.sorted_ids = self.gridid[self.order]
+        self.trees = {}
+        if "xc" in coords and "yc" in coords:
+            self.trees["xcyc"] = cKDTree(np.column_stack([coords["xc"], coords["yc"]]))
+        self.grid = None
+        if "xc_LCC" in coords and "yc_LCC" in coords:
+            self.trees["lcc"] = cKDTree(np.column_stack([coords["xc_LCC"], coords["yc_LCC"]]))
+            try:
+                self.grid = TESGrid.from_centres(self.gridid, coords["xc_LCC"], coords["yc_LCC"], mapping)
+            except ValueError as e:
+                print(f"{self.path}: no TES raster ({e})")
+
+    def open(self):
+        import netCDF4 as nc
+        return nc.Dataset(self.path, "r", memory=self.data)
+
+    def positions(self, gridids) -> np.ndarray:
+        """Sorted source positions of the given gridIDs (those present in the domain)."""
+        ids = np.asarray(gridids).reshape(-1).astype(np.int64)
+        pos = np.clip(np.searchsorted(self.sorted_ids, ids), 0, self.sorted_ids.size - 1)
+        found = self.sorted_ids[pos] == ids
+        return np.unique(self.order[pos[found]])
+
+    def describe(self) -> dict:
+        return {"path": self.path, "cells": int(self.gridid.size), "mbytes": round(len(self.data) / 1e6, 1),
+                "trees": sorted(self.trees), "raster": list(self.grid.shape) if self.grid is not None else None}
+
+
+# loaded by the service before the workers fork; every worker starts with the same copy
+_DOMAINS = {}
+_MODULES = {}
+_UNAVAILABLE = {}
+_STRATA = {}
+
+
+def load_tools() -> None:
+    for tool, module in TOOLS.items():
+        try:
+            _MODULES[tool] = importlib.import_module(module)
+        except ImportError as e:
+            _UNAVAILABLE[tool] = str(e)
+
+
+def load_domain(path: str) -> WarmDomain:
+    start = time.time()
+    warm = WarmDomain(path)
+    _DOMAINS[warm.path] = warm
+    print(f"[aoi_service] loaded {warm.path}: {warm.gridid.size} cells in {time.time() - start:.1f}s")
+    return warm
+
+
+def refresh_domains() -> list:
+    """Reload the loaded domains whose file changed on disk; returns their paths."""
+    changed = [path for path, warm in _DOMAINS.items() if os.path.exists(path) and _stamp(path) != warm.stamp]
+    for path in changed:
+        load_domain(path)
+    return changed
+
+
+def warm_domain(path: str):
+    """The loaded domain behind path (reloaded if the file changed), or None."""
+    real = os.path.realpath(path)
+    warm = _DOMAINS.get(real)
+    if warm is None:
+        return None
+    if os.path.exists(real) and _stamp(real) != warm.stamp:
+        warm = load_domain(real)
+    return warm
+
+
+def _read_gridids(path):
+    warm = warm_domain(path)
+    if warm is not None and warm.gridids is not None:
+        return warm.gridids
+    return _MODULES["sample"].read_gridids(path)
+
+
+def _read_strata(domain_path, surfdata_path, grid_ids, stratify, block_km, soil_layers):
+    # strata of a surfdata file are kept by the worker for the next samples
+    key = (os.path.realpath(domain_path), os.path.realpath(surfdata_path) if surfdata_path else None,
+           tuple(sorted(stratify)), block_km, soil_layers)
+    stamps = tuple(_stamp(p) for p in key[:2] if p)
+    if key not in _STRATA or _STRATA[key][0] != stamps:
+        fields = _MODULES["sample"].read_strata_fields(domain_path, surfdata_path, grid_ids, stratify,
+                                                        block_km, soil_layers)
+        _STRATA[key] = (stamps, fields)
+    return _STRATA[key][1]
+
+
+def _load_grid(path):
+    warm = warm_domain(path)
+    if warm is not None and warm.grid is not None:
+        return warm.grid
+    return _MODULES["shape"].TESGrid.from_domain(path)
+
+
+def _tool_main(tool: str, argv: list) -> None:
+    if tool in _UNAVAILABLE:
+        raise RuntimeError(f"{TOOLS[tool]}.py cannot be imported here: {_UNAVAILABLE[tool]}")
+    if tool not in _MODULES:
+        _MODULES[tool] = importlib.import_module(TOOLS[tool])
+    module = _MODULES[tool]
+    if tool == "domain":
+        module.main(argv, warm=warm_domain(module.DOMAIN_SOURCE))
+    elif tool == "sample":
+        module.main(argv, gridids_reader=_read_gridids, strata_reader=_read_strata)
+    elif tool == "shape":
+        module.main(argv, grid_loader=_load_grid)
+    else:
+        module.main(argv)
+
+
+def _exit_status(code) -> int:
+    if code is None:
+        return 0
+    return code if isinstance(code, int) else 1
+
+
+def run_tool(tool: str, argv: list) -> int:
+    """Run a tool in this process, as its command line would; returns the exit status."""
+    try:
+        _tool_main(tool, argv)
+    except SystemExit as e:
+        return _exit_status(e.code)
+    return 0
+
+
+def run_job(job: dict, log_path: str) -> dict:
+    # workers run one job at a time, so the working directory, environment and output are the job's
+    start = time.time()
+    cwd, env = os.getcwd(), dict(os.environ)
+    with open(log_path, "a", buffering=1) as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            os.chdir(job["cwd"])
+            os.environ.clear()
+            os.environ.update(job.get("env", {}))
+            status = run_tool(job["tool"], job["argv"])
+        except Exception:
+            traceback.print_exc()
+            status = 1
+        finally:
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(env)
+    return {"id": job["id"], "tool": job["tool"], "status": status, "seconds": round(time.time() - start, 3)}
+
+
+# --- service ----------------------------------------------------------------------------
+
+class AOIService:
+    def __init__(self, directory: str, workers: int):
+        self.directory = directory
+        self.jobs_dir = os.path.join(directory, JOBS)
+        self.queue_dir = os.path.join(directory, QUEUE)
+        for sub in (self.jobs_dir, *(os.path.join(self.queue_dir, s) for s in ("new", "running", "done"))):
+            os.makedirs(sub, exist_ok=True)
+        cutoff = time.time() - LOG_DAYS * 86400
+        for name in os.listdir(self.jobs_dir):
+            path = os.path.join(self.jobs_dir, name)
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        self.workers = workers
+        self.executor = self._fork_pool()
+        self._pool_lock = threading.Lock()
+        self.started = time.time()
+        self.counts = {"submitted": 0, "done": 0, "failed": 0}
+        self.running = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def _fork_pool(self) -> ProcessPoolExecutor:
+        # fork: the workers inherit the loaded domains and imports instead of loading them again
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("fork"))
+
+    def _refresh(self) -> None:
+        # reload changed domains here and fork new workers from them (called with _pool_lock held)
+        if refresh_domains():
+            old, self.executor = self.executor, self._fork_pool()
+            old.shutdown(wait=False)  # the jobs it already has still run to completion
+
+    def log_path(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, f"{job_id}.log")
+
+    def submit(self, job: dict):
+        if job.get("tool") not in TOOLS:
+            raise ValueError(f"unknown tool {job.get('tool')!r}; one of {sorted(TOOLS)}")
+        job.setdefault("id", uuid.uuid4().hex[:12])
+        open(self.log_path(job["id"]), "w").close()
+        with self._pool_lock:
+            self._refresh()
+            future = self.executor.submit(run_job, job, self.log_path(job["id"]))
+        with self._lock:
+            self.counts["submitted"] += 1
+            self.running[job["id"]] = {"tool": job["tool"], "argv": job["argv"], "since": time.time()}
+        print(f"[aoi_service] {job['id']} {job['tool']} {' '.join(job['argv'])}")
+        future.add_done_callback(lambda fut, job_id=job["id"]: self._finished(job_id, fut))
+        return job["id"], future
+
+    def _finished(self, job_id: str, future) -> None:
+        result = future.result() if future.exception() is None else {"id": job_id, "status": 1}
+        with self._lock:
+            self.running.pop(job_id, None)
+            self.counts["done" if result["status"] == 0 else "failed"] += 1
+        print(f"[aoi_service] {job_id} finished with status {result['status']} ({result.get('seconds', 0)}s)")
+
+    def status(self) -> dict:
+        with self._pool_lock:
+            self._refresh()
+        with self._lock:
+            running = {k: dict(v, seconds=round(time.time() - v["since"], 1)) for k, v in self.running.items()}
+            counts = dict(self.counts)
+        return {"pid": os.getpid(), "dir": self.directory, "workers": self.workers,
+                "uptime": round(time.time() - self.started, 1),
+                "domains": [w.describe() for w in _DOMAINS.values()],
+                "tools": {t: ("unavailable: " + _UNAVAILABLE[t]) if t in _UNAVAILABLE else "ready" for t in TOOLS},
+                "jobs": counts, "running": running}
+
+    def poll_queue(self) -> None:
+        # file queue: clients drop <id>.json into queue/new; the rename claims a job exactly once
+        new, running, done = (os.path.join(self.queue_dir, s) for s in ("new", "running", "done"))
+        while not self._stop.is_set():
+            for name in sorted(os.listdir(new)):
+                if not name.endswith(".json"):
+                    continue
+                claimed = os.path.join(running, name)
+                try:
+                    os.rename(os.path.join(new, name), claimed)
+                except FileNotFoundError:
+                    continue
+                with open(claimed) as f:
+                    job = json.load(f)
+                job["id"] = name[:-len(".json")]
+                try:
+                    _, future = self.submit(job)
+                except ValueError as e:
+                    _write_json(os.path.join(done, name), {"id": job["id"], "status": 2, "error": str(e)})
+                    os.remove(claimed)
+                    continue
+                future.add_done_callback(lambda fut, name=name: self._queue_done(name, fut))
+            self._stop.wait(POLL_SECONDS)
+
+    def _queue_done(self, name: str, future) -> None:
+        result = future.result() if future.exception() is None else {"id": name[:-5], "status": 1}
+        _write_json(os.path.join(self.queue_dir, "done", name), result)
+        os.remove(os.path.join(self.queue_dir, "running", name))
+
+    def stop(self) -> None:
+        self._stop.set()
+
+
+def _write_json(path: str, record: dict) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(record, f)
+    os.replace(tmp, path)
+
+
+def _send(conn, record: dict) -> None:
+    conn.sendall((json.dumps(record) + "\n").encode())
+
+
+def _follow(path: str, offset: int):
+    with open(path) as f:
+        f.seek(offset)
+        text = f.read()
+    return text, offset + len(text.encode())
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        service = self.server.service
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            return
+        op = request.get("op")
+        if op == "status":
+            _send(self.connection, service.status())
+        elif op == "stop":
+            _send(self.connection, {"stopping": True})
+            service.stop()
+            threading.Thread(target=self.server.shutdown, daemon=True).start()
+        elif op == "run":
+            try:
+                job_id, future = service.submit(request["job"])
+            except ValueError as e:
+                _send(self.connection, {"done": True, "status": 2, "error": str(e)})
+                return
+            _send(self.connection, {"id": job_id})
+            # stream the job log until the job is over; a client that goes away leaves the job running
+            offset = 0
+            try:
+                while True:
+                    finished = future.done()
+                    text, offset = _follow(service.log_path(job_id), offset)
+                    if text:
+                        _send(self.connection, {"log": text})
+                    if finished:
+                        break
+                    time.sleep(0.2)
+                result = future.result() if future.exception() is None else {"status": 1}
+                _send(self.connection, dict(result, done=True))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def _connect(directory: str):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(os.path.join(directory, SOCKET))
+    return sock
+
+
+def serve(directory: str, domains: list, workers: int) -> None:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, SOCKET)
+    if os.path.exists(path):
+        try:
+            _connect(directory).close()
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(path)  # left over by a service that died
+        else:
+            raise SystemExit(f"An AOI service is already listening on {path}")
+
+    start = time.time()
+    load_tools()
+    for tool, reason in _UNAVAILABLE.items():
+        print(f"[aoi_service] {tool} unavailable: {reason}")
+    for domain in domains:
+        load_domain(domain)
+    service = AOIService(directory, workers)
+    print(f"[aoi_service] ready in {time.time() - start:.1f}s: {workers} workers, socket {path}, "
+          f"queue {service.queue_dir}/new")
+    sys.stdout.flush()
+
+    threading.Thread(target=service.poll_queue, daemon=True).start()
+    server = _Server(path, _Handler)
+    server.service = service
+    os.chmod(path, 0o600)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.stop()
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+        service.executor.shutdown(wait=True)
+        print("[aoi_service] stopped")
+
+
+# --- client -----------------------------------------------------------------------------
+
+def _job(tool: str, argv: list) -> dict:
+    return {"tool": tool, "argv": list(argv), "cwd": os.getcwd(), "env": dict(os.environ)}
+
+
+def _run_socket(directory: str, tool: str, argv: list) -> int:
+    sock = _connect(directory)
+    with sock, sock.makefile("r") as replies:
+        _send(sock, {"op": "run", "job": _job(tool, argv)})
+        for line in replies:
+            reply = json.loads(line)
+            if "log" in reply:
+                sys.stdout.write(reply["log"])
+                sys.stdout.flush()
+            if reply.get("done"):
+                if reply.get("error"):
+                    print(f"aoi_service: {reply['error']}", file=sys.stderr)
+                return reply["status"]
+    print("aoi_service: the service closed the connection before the job finished", file=sys.stderr)
+    return 1
+
+
+def _run_queued(directory: str, tool: str, argv: list, timeout: float = None) -> int:
+    queue = os.path.join(directory, QUEUE)
+    job_id = uuid.uuid4().hex[:12]
+    os.makedirs(os.path.join(queue, "new"), exist_ok=True)
+    tmp = os.path.join(queue, "new", f"{job_id}.json.tmp")
+    with open(tmp, "w") as f:
+        json.dump(_job(tool, argv), f)
+    os.replace(tmp, os.path.join(queue, "new", f"{job_id}.json"))
+    done = os.path.join(queue, "done", f"{job_id}.json")
+    log = os.path.join(directory, JOBS, f"{job_id}.log")
+    offset, start = 0, time.time()
+    while True:
+        finished = os.path.exists(done)
+        if os.path.exists(log):
+            text, offset = _follow(log, offset)
+            sys.stdout.write(text)
+            sys.stdout.flush()
+        if finished:
+            with open(done) as f:
+                result = json.load(f)
+            os.remove(done)
+            if result.get("error"):
+                print(f"aoi_service: {result['error']}", file=sys.stderr)
+            return result["status"]
+        if timeout is not None and time.time() - start > timeout:
+            print(f"aoi_service: job {job_id} not finished after {timeout:.0f}s (is the service running?)",
+                  file=sys.stderr)
+            return 1
+        time.sleep(POLL_SECONDS)
+
+
+def run_client(directory: str, tool: str, argv: list, queue: bool = False, fallback: bool = True,
+               timeout: float = None) -> int:
+    if queue:
+        return _run_queued(directory, tool, argv, timeout)
+    try:
+        return _run_socket(directory, tool, argv)
+    except (FileNotFoundError, ConnectionRefusedError):
+        if not fallback:
+            print(f"aoi_service: no service listening in {directory}", file=sys.stderr)
+            return 1
+    # no service: the client does the job itself, like the tool's own command line
+    return run_tool(tool, argv)
+
+
+def _request(directory: str, op: str) -> dict:
+    sock = _connect(directory)
+    with sock, sock.makefile("r") as replies:
+        _send(sock, {"op": op})
+        return json.loads(replies.readline())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Persistent local AOI service and its client")
+    parser.add_argument("--dir", default=None, help=f"Service directory (default: ${SERVICE_DIR_ENV} or ~/.cache/aoi_service)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    p_serve = sub.add_parser("serve", help="Load the domains and serve jobs until stopped")
+    p_serve.add_argument("--domain", action="append", default=[], help="Entire-domain file to keep loaded (repeatable)")
+    p_serve.add_argument("--workers", type=int, default=4, help="Worker processes (default: 4)")
+    p_run = sub.add_parser("run", help="Run a tool through the service, with the arguments of the tool")
+    p_run.add_argument("--queue", action="store_true", help="Submit through the file queue instead of the socket")
+    p_run.add_argument("--timeout", type=float, default=None, help="Give up waiting for a queued job after this many seconds")
+    p_run.add_argument("--no-fallback", action="store_true", help="Fail when no service is running instead of running locally")
+    p_run.add_argument("tool", choices=sorted(TOOLS), help=", ".join(f"{t}: {m}.py" for t, m in TOOLS.items()))
+    p_run.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the tool")
+    sub.add_parser("status", help="Print the loaded domains, tools and jobs")
+    sub.add_parser("stop", help="Stop the service after the running jobs")
+    args = parser.parse_args()
+    directory = service_dir(args.dir)
+
+    if args.cmd == "serve":
+        serve(directory, args.domain, args.workers)
+    elif args.cmd == "run":
+        sys.exit(run_client(directory, args.tool, args.args, args.queue, not args.no_fallback, args.timeout))
+    else:
+        try:
+            print(json.dumps(_request(directory, args.cmd), indent=1))
+        except (FileNotFoundError, ConnectionRefusedError):
+            sys.exit(f"No AOI service listening in {directory}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Use an existing super-AOI experiment as the source of a new AOI.
+
+The generators select cells by gridID, so the domain, surfdata and forcing files of an
+experiment whose gridIDs contain the new AOI are valid (and much smaller) sources.
+A candidate qualifies when
+  - its AOI domain, surfdata and complete forcing set exist,
+  - its gridID set is a superset of the new AOI gridIDs,
+  - it was generated from the same entire-domain sources (its scripts/experiment_config.json).
+Among qualifying candidates the one with the fewest cells is used.
+
+Example use:
+  python3 aoi_source.py --config knox_config.json                       # search sibling experiments
+  python3 aoi_source.py --config knox_config.json --from-experiment /path/to/TNdemo
+"""
+
+import argparse
+import json
+import os
+from pathlib import Path
+
+import numpy as np
+
+CONFIG_COPY = "experiment_config.json"
+SOURCE_KEYS = ("base_domain_file", "surfdata_dir", "surfdata_file", "forcing_dir")
+
+
+def _latest(directory: Path, pattern: str):
+    matches = sorted(directory.glob(pattern))
+    return matches[-1] if matches else None
+
+
+def experiment_outputs(exp_dir: Path):
+    """Domain, surfdata and forcing dir of a generated experiment, or None if incomplete."""
+    dom_surf = exp_dir / "domain_surfdata"
+    domain = _latest(dom_surf, "*_domain.lnd.*.nc")
+    surfdata = _latest(dom_surf, "*_surfdata.*.nc")
+    forcing = exp_dir / "forcing"
+    if domain is None or surfdata is None or not forcing.is_dir():
+        return None
+    return {"domain": domain, "surfdata": surfdata, "forcing": forcing}
+
+
+def read_gridids(path: Path) -> np.ndarray:
+    from TES_AOI_surfdataGEN import read_AOI_points
+    return np.unique(np.asarray(read_AOI_points(path.as_posix()), dtype=np.int64))
+
+
+def aoi_gridids(cfg: dict):
+    """AOI gridIDs of the config, or None for coordinate (xcyc) point lists."""
+    aoi_file = cfg["aoi_points"]["file"]
+    if not (aoi_file.endswith("gridID.csv") or ("domain" in aoi_file and aoi_file.endswith(".nc"))):
+        return None
+    return read_gridids(Path(cfg["aoi_points"]["dir"]).expanduser() / aoi_file)
+
+
+def _origin(cfg: dict) -> dict:
+    return cfg.get("source_origin", cfg["source"])
+
+
+def _norm(path: str) -> str:
+    return os.path.normpath(os.path.expanduser(path))
+
+
+def same_sources(exp_dir: Path, cfg: dict) -> bool:
+    """True if exp_dir was generated from the same entire-domain sources as cfg."""
+    config = exp_dir / "scripts" / CONFIG_COPY
+    if not config.exists():
+        return False
+    theirs = _origin(json.loads(config.read_text()))
+    ours = _origin(cfg)
+    return all(_norm(str(theirs.get(k, ""))) == _norm(str(ours[k])) for k in SOURCE_KEYS)
+
+
+def forcing_complete(forcing_dir: Path, origin_forcing_dir: str) -> bool:
+    """Every entire-domain forcing file has an AOI counterpart in forcing_dir."""
+    from TES_AOI_forcingGEN_mpi import source_stem
+
+    def _names(root, strip):
+        names = set()
+        for r, _, files in os.walk(root):
+            if os.path.basename(r).startswith("."):
+                continue
+            rel = os.path.relpath(r, root)
+            names.update((rel, source_stem(f) if strip else f) for f in files if f.endswith(".nc"))
+        return names
+
+    wanted = _names(origin_forcing_dir, False)
+    return bool(wanted) and wanted <= _names(forcing_dir, True)
+
+
+def candidate_experiments(cfg: dict) -> list:
+    """Sibling experiment directories of <experiment_root>."""
+    exp_root = Path(cfg["experiment_root"]).expanduser().resolve()
+    if not exp_root.parent.is_dir():
+        return []
+    return sorted(p for p in exp_root.parent.iterdir()
+                  if p.is_dir() and p.resolve() != exp_root and (p / "domain_surfdata").is_dir())
+
+
+def find_super_experiment(cfg: dict, candidates=None, require_same_sources: bool = True):
+    """Smallest experiment whose gridIDs contain the AOI: (exp_dir, outputs, ncells) or None."""
+    gridids = aoi_gridids(cfg)
+    if gridids is None or gridids.size == 0:
+        return None
+    best = None
+    for exp_dir in (candidate_experiments(cfg) if candidates is None else candidates):
+        exp_dir = Path(exp_dir).expanduser()
+        outputs = experiment_outputs(exp_dir)
+        if outputs is None:
+            continue
+        if require_same_sources and not same_sources(exp_dir, cfg):
+            continue
+        super_ids = read_gridids(outputs["domain"])
+        if best is not None and super_ids.size >= best[2]:
+            continue
+        if not np.isin(gridids, super_ids, assume_unique=True).all():
+            continue
+        if not forcing_complete(outputs["forcing"], _origin(cfg)["forcing_dir"]):
+            print(f"Skipping {exp_dir}: its forcing is incomplete")
+            continue
+        best = (exp_dir, outputs, int(super_ids.size))
+    return best
+
+
+def apply_super_source(cfg: dict, exp_dir: Path, outputs: dict) -> dict:
+    """Copy of cfg reading from the super-AOI outputs; the original sources move to source_origin."""
+    cfg = json.loads(json.dumps(cfg))
+    cfg["source_origin"] = _origin(cfg)
+    cfg["source"] = dict(cfg["source"],
+                         base_domain_file=outputs["domain"].as_posix(),
+                         surfdata_dir=outputs["surfdata"].parent.as_posix(),
+                         surfdata_file=outputs["surfdata"].name,
+                         forcing_dir=outputs["forcing"].as_posix())
+    cfg["source_experiment"] = Path(exp_dir).as_posix()
+    return cfg
+
+
+def resolve_source(cfg: dict, from_experiment: str = "auto") -> dict:
+    """Apply --from-experiment (auto, none or a directory) to cfg."""
+    if from_experiment in (None, "", "none"):
+        return cfg
+    if from_experiment == "auto":
+        found = find_super_experiment(cfg)
+    else:
+        found = find_super_experiment(cfg, [from_experiment], require_same_sources=False)
+        if found is None:
+            raise ValueError(f"{from_experiment} is not a complete experiment containing every AOI gridID")
+    if found is None:
+        return cfg
+    exp_dir, outputs, ncells = found
+    print(f"Using super-AOI experiment {exp_dir} ({ncells} cells) as source")
+    return apply_super_source(cfg, exp_dir, outputs)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Find an existing experiment that contains the AOI of a config.")
+    parser.add_argument("--config", required=True, help="Path to JSON config file")
+    parser.add_argument("--from-experiment", default="auto", help="auto (search siblings) or an experiment directory")
+    args = parser.parse_args()
+
+    from aoi_prepare_experiment import expand_config_vars
+
+    cfg = expand_config_vars(json.loads(Path(args.config).read_text()))
+    resolved = resolve_source(cfg, args.from_experiment)
+    if "source_experiment" not in resolved:
+        print("No containing experiment found; the entire-domain sources will be used")
+        return
+    print(json.dumps(resolved["source"], indent=2))
+
+
+if __name__ == "__main__":
+    main()
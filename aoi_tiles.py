@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""Split an AOI into spatially compact tiles and generate all tile inputs in one pass.
+
+The AOI cells are ordered along a Hilbert curve over the TES raster (tes_grid.py) and
+cut into N runs of equal cell count, so every tile is a compact patch of the map. Each
+tile is an ordinary experiment (<experiment_root>/<AOI>T<k>/) that can be run as a small
+ELM case; <experiment_root>/tiles.json is the mosaic manifest listing them.
+
+`generate` reads every source file once (the domain, the surfdata and each forcing file)
+and writes the subsets of all tiles from the same reads. Forcing files are processed in
+parallel by local worker processes. Afterwards the domain, surfdata and forcing stages of
+each tile are recorded as done for aoi_pipeline.py.
+
+Example use:
+  python3 aoi_prepare_experiment.py --config <cfg.json> --tiles 16      # prepare tiles + manifest
+  python3 aoi_tiles.py generate --manifest <experiment_root>/tiles.json --workers 16
+  python3 aoi_tiles.py show --manifest <experiment_root>/tiles.json
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from time import time
+
+import numpy as np
+
+MANIFEST = "tiles.json"
+TILE_GRIDID_DIR = "tile_gridids"
+FORCING_CHUNK_STEPS = 16  # time steps per read, as in AOI_forcing_save_1d
+SKIP_DATA = ("lambert_conformal_conic",)
+
+
+def tile_names(aoi: str, ntiles: int) -> list:
+    # no '_' in the name: the AOI is the filename prefix before the first '_'
+    width = len(str(ntiles))
+    return [f"{aoi}T{k + 1:0{width}d}" for k in range(ntiles)]
+
+
+def plan_tiles(grid, gridids, ntiles: int, cell_order: str = "source") -> list:
+    """gridID arrays of ntiles compact tiles: consecutive runs of equal size along a Hilbert curve.
+
+    Within a tile the cells are in gridID (source) order, or along cell_order.
+    """
+    gridids = np.unique(np.asarray(gridids, dtype=np.int64))
+    ntiles = max(1, min(int(ntiles), gridids.size))
+    ordered = gridids[grid.cell_order(gridids, "hilbert")]
+    parts = [np.sort(part) for part in np.array_split(ordered, ntiles)]
+    return [part[grid.cell_order(part, cell_order)] for part in parts]
+
+
+def tile_extent(grid, gridids) -> dict:
+    row, col = grid.rowcol(gridids)
+    return {"rows": [int(row.min()), int(row.max())], "cols": [int(col.min()), int(col.max())]}
+
+
+def write_tile_gridids(path: Path, gridids) -> None:
+    # same layout as the <AOI>_gridID.csv inputs (one header line, one gridID per line)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text("gridID\n" + "".join(f"{int(g)}\n" for g in gridids))
+
+
+def write_manifest(exp_root: Path, cfg: dict, tiles: list) -> Path:
+    manifest = {
+        "expid": cfg["expid"],
+        "experiment_root": exp_root.as_posix(),
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "ntiles": len(tiles),
+        "ncells": int(sum(t["ncells"] for t in tiles)),
+        "cell_order": cfg.get("cell_order", "source"),
+        "source": cfg["source"],
+        "source_origin": cfg.get("source_origin", cfg["source"]),
+        "tiles": tiles,
+    }
+    path = exp_root / MANIFEST
+    path.write_text(json.dumps(manifest, indent=2) + "\n")
+    return path
+
+
+def read_manifest(path: str) -> dict:
+    return json.loads(Path(path).expanduser().read_text())
+
+
+# --- one read pass, many outputs ------------------------------------------------------
+
+def _positions(src, outputs, cell_order):
+    from tes_grid import aoi_positions
+    source_ids = np.asarray(src["gridID"][:]).reshape(-1)
+    keep_order = cell_order != "source"
+    positions = []
+    for out in outputs:
+        pos = aoi_positions(source_ids, out["gridids"], keep_order)
+        if pos.size != out["gridids"].size:
+            raise ValueError(f"{out['path']}: {out['gridids'].size - pos.size} tile gridIDs are not in the source")
+        positions.append(pos)
+    return positions
+
+
+def split_file(source_file: str, outputs: list, cell_dims=("ni", "gridcell"), skip=(), keep_fill: bool = False,
+               chunk_steps: int = 1, cell_order: str = "source", attrs=None, qa: bool = False) -> None:
+    """Write the subset of every output {path, gridids, title} from one read of source_file.
+
+    Variables whose last dimension is a cell dimension are read in blocks of chunk_steps
+    along their first axis; each block is scattered to all outputs before the next read.
+    With qa, the statistics of every output are kept from the same blocks (aoi_qa.py).
+    """
+    import netCDF4 as nc
+    from aoi_qa import QAError, file_qa
+
+    src = nc.Dataset(source_file, "r")
+    positions = _positions(src, outputs, cell_order)
+    qas = [file_qa(out["path"], source_file) if qa else None for out in outputs]
+    dsts = []
+    try:
+        for out, pos in zip(outputs, positions):
+            if os.path.exists(out["path"]):
+                os.remove(out["path"])
+            os.makedirs(os.path.dirname(out["path"]), exist_ok=True)
+            dst = nc.Dataset(out["path"], "w", format="NETCDF3_64BIT")
+            dsts.append(dst)
+            for name in src.ncattrs():
+                dst.setncattr(name, src.getncattr(name))
+            for name, value in (attrs or {}).items():
+                dst.setncattr(name, value)
+            for name, dimension in src.dimensions.items():
+                size = pos.size if name in cell_dims else (None if dimension.isunlimited() else len(dimension))
+                dst.createDimension(name, size)
+            for name, variable in src.variables.items():
+                if name in skip:
+                    continue
+                fill = variable.getncattr("_FillValue") if keep_fill and "_FillValue" in variable.ncattrs() else None
+                dst.createVariable(name, variable.datatype, variable.dimensions, fill_value=fill)
+                for attr_name in variable.ncattrs():
+                    if attr_name != "_FillValue":
+                        dst[name].setncattr(attr_name, variable.getncattr(attr_name))
+            dst.title = out["title"]
+
+        for name, variable in src.variables.items():
+            if name in skip or name in SKIP_DATA:
+                continue
+            if not variable.dimensions or variable.dimensions[-1] not in cell_dims:
+                data = variable[...]
+                for dst in dsts:
+                    dst[name][...] = data
+                continue
+            stats = [q.variable(name, variable) if q is not None else None for q in qas]
+            if len(variable.dimensions) == 1:
+                data = variable[:]
+                for dst, pos, st in zip(dsts, positions, stats):
+                    dst[name][:] = data[pos]
+                    if st is not None:
+                        st.update(data[pos])
+            else:
+                for start in range(0, variable.shape[0], chunk_steps):
+                    end = min(start + chunk_steps, variable.shape[0])
+                    block = variable[start:end]
+                    for dst, pos, st in zip(dsts, positions, stats):
+                        tile_block = block[..., pos]
+                        dst[name][start:end] = tile_block
+                        if st is not None:
+                            st.update(tile_block)
+    finally:
+        for dst in dsts:
+            dst.close()
+        src.close()
+    # every tile gets its sidecar before a violation is raised
+    errors = []
+    for q in qas:
+        if q is not None:
+            try:
+                q.close()
+            except QAError as e:
+                errors.append(str(e))
+    if errors:
+        raise QAError("\n".join(errors))
+
+
+def _stamp():
+    from TES_AOI_surfdataGEN import formatted_date
+    return formatted_date
+
+
+def domain_outputs(manifest: dict) -> list:
+    date = _stamp()
+    source = manifest["source"]["base_domain_file"]
+    return [{"path": f"{t['experiment_root']}/domain_surfdata/{t['name']}_domain.lnd.TES_SE.4km.1d.c{date}.nc",
+             "gridids": _tile_gridids(t),
+             "title": f"1D domain for {t['name']}, generated on {date} with {source}"} for t in manifest["tiles"]]
+
+
+def surfdata_outputs(manifest: dict) -> list:
+    from TES_AOI_surfdataGEN import AOI_surfdata_name
+    date = _stamp()
+    source = os.path.join(manifest["source"]["surfdata_dir"], manifest["source"]["surfdata_file"])
+    return [{"path": AOI_surfdata_name(f"{t['experiment_root']}/domain_surfdata", t["name"]),
+             "gridids": _tile_gridids(t),
+             "title": f"1D surfdata for {t['name']}, generated on {date} with {source}"} for t in manifest["tiles"]]
+
+
+def forcing_outputs(manifest: dict, rel_dir: str, file_name: str) -> list:
+    from TES_AOI_forcingGEN_mpi import source_stem
+    date = _stamp()
+    source = os.path.join(manifest["source"]["forcing_dir"], rel_dir, file_name)
+    outputs = []
+    for t in manifest["tiles"]:
+        path = os.path.normpath(os.path.join(t["experiment_root"], "forcing", rel_dir,
+                                             f"{t['name']}_{source_stem(file_name)}"))
+        outputs.append({"path": path, "gridids": _tile_gridids(t),
+                        "title": f"{path} created from {source} on {date}"})
+    return outputs
+
+
+def _tile_gridids(tile: dict) -> np.ndarray:
+    return np.loadtxt(tile["gridid_file"], dtype=np.int64, skiprows=1, ndmin=1)
+
+
+def _split_forcing(manifest: dict, rel_dir: str, file_name: str) -> tuple:
+    start = time()
+    outputs = forcing_outputs(manifest, rel_dir, file_name)
+    split_file(os.path.join(manifest["source"]["forcing_dir"], rel_dir, file_name), outputs,
+               chunk_steps=FORCING_CHUNK_STEPS, cell_order=manifest.get("cell_order", "source"), qa=True)
+    return file_name, time() - start
+
+
+def generate(manifest: dict, workers: int = 1, stages=("domain", "surfdata", "forcing")) -> None:
+    """Domain, surfdata and forcing of every tile, each source file read once."""
+    from forcing_shards import discover_forcing_files
+
+    # tile gridID files are already in the requested cell order
+    order = manifest.get("cell_order", "source")
+    attrs = {"cell_order": order} if order != "source" else None
+    start = time()
+    if "domain" in stages:
+        outputs = domain_outputs(manifest)
+        split_file(manifest["source"]["base_domain_file"], outputs, cell_dims=("ni",), skip=("lon", "lat"),
+                   keep_fill=True, cell_order=order, attrs=attrs)
+        print(f"[tiles] {len(outputs)} domains written ({time() - start:.1f}s)")
+    if "surfdata" in stages:
+        outputs = surfdata_outputs(manifest)
+        split_file(os.path.join(manifest["source"]["surfdata_dir"], manifest["source"]["surfdata_file"]), outputs,
+                   cell_dims=("gridcell",), cell_order=order, qa=True)
+        print(f"[tiles] {len(outputs)} surfdata files written ({time() - start:.1f}s)")
+    if "forcing" in stages:
+        files = discover_forcing_files(manifest["source"]["forcing_dir"])
+        done = 0
+        if workers <= 1:
+            for f in files:
+                name, seconds = _split_forcing(manifest, f["dir"], f["file"])
+                done += 1
+                print(f"[tiles] {done}/{len(files)} {name} -> {manifest['ntiles']} tiles in {seconds:.1f}s")
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(_split_forcing, manifest, f["dir"], f["file"]) for f in files]
+                for fut in as_completed(futures):
+                    name, seconds = fut.result()
+                    done += 1
+                    print(f"[tiles] {done}/{len(files)} {name} -> {manifest['ntiles']} tiles in {seconds:.1f}s")
+        print(f"[tiles] forcing for {manifest['ntiles']} tiles written ({time() - start:.1f}s)")
+
+
+def record_tiles(manifest: dict, stages=("domain", "surfdata", "forcing")) -> None:
+    """Mark the generated stages of every tile as done for aoi_pipeline.py."""
+    from aoi_pipeline import STAGE_ORDER, build_stages, compute_fingerprints, load_config, record_success
+
+    for t in manifest["tiles"]:
+        exp_root = Path(t["experiment_root"])
+        scripts_dir = exp_root / "scripts"
+        cfg = load_config((scripts_dir / "experiment_config.json").as_posix())
+        built = build_stages(cfg, exp_root)
+        fingerprints = compute_fingerprints(built, [n for n in STAGE_ORDER if n in built], scripts_dir)
+        for name in stages:
+            record_success(scripts_dir, name, fingerprints[name], "tiles")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Generate or inspect the tiles of a tiled AOI experiment.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_gen = sub.add_parser("generate", help="Write domain, surfdata and forcing of all tiles in one pass")
+    p_gen.add_argument("--manifest", required=True, help=f"<experiment_root>/{MANIFEST}")
+    p_gen.add_argument("--workers", type=int, default=int(os.environ.get("FORCING_SERIAL_WORKERS", "8")),
+                       help="Local processes for the forcing files (default: $FORCING_SERIAL_WORKERS or 8)")
+    p_gen.add_argument("--stages", nargs="+", default=["domain", "surfdata", "forcing"],
+                       choices=["domain", "surfdata", "forcing"])
+    p_show = sub.add_parser("show", help="List the tiles of a manifest")
+    p_show.add_argument("--manifest", required=True)
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    manifest = read_manifest(args.manifest)
+    if args.command == "show":
+        for t in manifest["tiles"]:
+            print(f"{t['name']:16s} {t['ncells']:8d} cells  rows {t['rows'][0]}-{t['rows'][1]}  "
+                  f"cols {t['cols'][0]}-{t['cols'][1]}  {t['experiment_root']}")
+        return
+    generate(manifest, args.workers, args.stages)
+    record_tiles(manifest, args.stages)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""Local catalog of the entire-domain forcing tree.
+
+One SQLite row per source file records its stream (sub-directory), variable, period,
+size/mtime, dimensions, variables (dtype, shape, byte offset and size, packing and fill
+attributes), time range and a checksum of its gridID. Classic (CDF-1/2/5) files are described from their header
+bytes alone; netCDF-4 files are opened with netCDF4 (offsets are then unknown).
+
+A refresh only stats the tree and re-reads the files whose size or mtime changed, so
+after the first build planners (forcing_shards.py), estimators (aoi_resources.py) and
+generators (TES_AOI_forcingGEN_mpi.py) query the catalog instead of walking GPFS and
+opening every file.
+
+The catalog is ~/.cache/tes_forcing_catalog/<hash of forcing_dir>.sqlite, so shared and
+experiment forcing trees are left untouched; $FORCING_CATALOG names it explicitly, and
+FORCING_CATALOG=tree keeps it in the tree as <forcing_dir>/.forcing_catalog.sqlite.
+
+Example use:
+  python3 forcing_catalog.py refresh <forcing_dir>
+  python3 forcing_catalog.py summary <forcing_dir>
+  python3 forcing_catalog.py show <forcing_dir> --variable TBOT
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import struct
+from datetime import datetime
+
+import numpy as np
+
+CATALOG_ENV = "FORCING_CATALOG"
+CATALOG_IN_TREE = "tree"  # $FORCING_CATALOG value that stores the catalog inside the forcing tree
+CATALOG_NAME = ".forcing_catalog.sqlite"
+SCHEMA_VERSION = "2"
+# attributes that change the values read from the file (CF packing and fill)
+PACKING_ATTRS = ("scale_factor", "add_offset", "_FillValue", "missing_value")
+
+# netCDF classic header tags and external types
+NC_DIMENSION, NC_VARIABLE, NC_ATTRIBUTE = 0x0A, 0x0B, 0x0C
+NC_TYPES = {1: ">i1", 2: "S1", 3: ">i2", 4: ">i4", 5: ">f4", 6: ">f8",
+            7: ">u1", 8: ">u2", 9: ">u4", 10: ">i8", 11: ">u8"}
+
+COLUMNS = ("path", "dir", "file", "stream", "variable", "period", "size", "mtime_ns", "format",
+           "time_steps", "ncells", "time_first", "time_last", "time_units", "gridid_sha", "dims", "variables")
+
+
+class _Header:
+    """Sequential big-endian reader over a netCDF classic header."""
+
+    def __init__(self, f):
+        self.f = f
+        self.wide = False  # CDF-5: 64-bit counts
+
+    def read(self, n):
+        data = self.f.read(n)
+        if len(data) != n:
+            raise ValueError("truncated netCDF header")
+        return data
+
+    def int32(self):
+        return struct.unpack(">i", self.read(4))[0]
+
+    def count(self):
+        return struct.unpack(">q", self.read(8))[0] if self.wide else self.int32()
+
+    def name(self):
+        n = self.count()
+        raw = self.read(n)
+        self.read(-n % 4)
+        return raw.decode("utf-8")
+
+    def values(self, nc_type, n):
+        dtype = np.dtype(NC_TYPES[nc_type])
+        raw = self.read(n * dtype.itemsize)
+        self.read(-(n * dtype.itemsize) % 4)
+        if nc_type == 2:
+            return raw.decode("utf-8", "replace").rstrip("\x00")
+        values = np.frombuffer(raw, dtype=dtype)
+        return values[0] if n == 1 else values.tolist()  # a scalar keeps its netCDF type
+
+    def attributes(self):
+        tag, n = self.int32(), self.count()
+        if tag not in (0, NC_ATTRIBUTE):
+            raise ValueError("bad attribute list in netCDF header")
+        attrs = {}
+        for _ in range(n):
+            name = self.name()
+            nc_type = self.int32()
+            attrs[name] = self.values(nc_type, self.count())
+        return attrs
+
+
+def read_classic_header(path: str) -> dict:
+    """Dimensions, record count and variables (type, dims, shape, vsize, begin, attrs) of a CDF-1/2/5 file."""
+    with open(path, "rb") as f:
+        h = _Header(f)
+        magic = h.read(4)
+        if magic[:3] != b"CDF" or magic[3] not in (1, 2, 5):
+            raise ValueError(f"{path} is not a netCDF classic file")
+        version = magic[3]
+        h.wide = version == 5
+        numrecs = h.count()
+
+        tag, n = h.int32(), h.count()
+        if tag not in (0, NC_DIMENSION):
+            raise ValueError("bad dimension list in netCDF header")
+        dims = [(h.name(), h.count()) for _ in range(n)]
+        h.attributes()  # global attributes
+
+        tag, n = h.int32(), h.count()
+        if tag not in (0, NC_VARIABLE):
+            raise ValueError("bad variable list in netCDF header")
+        variables = {}
+        for _ in range(n):
+            name = h.name()
+            dimids = [h.count() for _ in range(h.count())]
+            attrs = h.attributes()
+            nc_type = h.int32()
+            vsize = h.count()
+            begin = struct.unpack(">q", h.read(8))[0] if version > 1 else h.int32()
+            variables[name] = {"type": nc_type, "dims": [dims[d][0] for d in dimids],
+                               "record": bool(dimids) and dims[dimids[0]][1] == 0,
+                               "vsize": vsize, "begin": begin, "attrs": attrs}
+
+    if numrecs < 0:  # streaming: derive from the file size
+        numrecs = None
+    record_vars = [v for v in variables.values() if v["record"]]
+    dim_len = dict(dims)
+    for v in variables.values():
+        v["shape"] = [numrecs if (v["record"] and i == 0) else dim_len[d] for i, d in enumerate(v["dims"])]
+        v["dtype"] = np.dtype(NC_TYPES[v["type"]]).str
+    if len(record_vars) == 1:  # a single record variable is not padded
+        v = record_vars[0]
+        recsize = int(np.prod(v["shape"][1:], dtype=np.int64)) * np.dtype(v["dtype"]).itemsize
+    else:
+        recsize = sum(v["vsize"] for v in record_vars)
+    if numrecs is None and record_vars:
+        first = min(v["begin"] for v in record_vars)
+        numrecs = (os.path.getsize(path) - first) // recsize if recsize else 0
+        for v in record_vars:
+            v["shape"][0] = numrecs
+    return {"format": f"CDF-{version}", "numrecs": numrecs or 0, "recsize": recsize,
+            "dims": dims, "variables": variables}
+
+
+def _read_values(path, var, recsize, index):
+    """Element(s) of a classic variable straight from the file: record index or whole fixed variable."""
+    dtype = np.dtype(var["dtype"])
+    if var["record"]:
+        count = int(np.prod(var["shape"][1:], dtype=np.int64))
+        offset = var["begin"] + index * recsize
+    else:
+        count = int(np.prod(var["shape"], dtype=np.int64))
+        offset = var["begin"]
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype)
+
+
+def _gridid_sha(values) -> str:
+    return hashlib.sha1(np.ascontiguousarray(values, dtype=">i8").tobytes()).hexdigest()
+
+
+def _packing(attrs, dtype) -> dict:
+    packing = {}
+    for name in PACKING_ATTRS:
+        if name in attrs:
+            value = attrs[name]
+            packing[name] = value.tolist() if hasattr(value, "tolist") else value
+    scale = [np.asarray(attrs[a]).dtype for a in ("scale_factor", "add_offset") if a in attrs]
+    if scale:
+        # numpy promotion of the stored values with the attribute types, as netCDF4 unpacks them
+        packing["unpacked_dtype"] = np.result_type(np.dtype(dtype).newbyteorder("="), *scale).str
+    return packing
+
+
+def is_packed(var) -> bool:
+    return "unpacked_dtype" in var.get("packing", {})
+
+
+def unpacked_dtype(var) -> np.dtype:
+    """dtype of a catalog variable once scale_factor/add_offset are applied."""
+    packing = var.get("packing", {})
+    return np.dtype(packing.get("unpacked_dtype", var["dtype"])).newbyteorder("=")
+
+
+def unpack_values(raw, var) -> np.ndarray:
+    """Raw values of a catalog variable as netCDF4 reads them: fill/missing values (the _FillValue
+    attribute or the netCDF default) as NaN, then scale_factor and add_offset applied."""
+    from netCDF4 import default_fillvals
+
+    packing = var.get("packing", {})
+    raw = np.asarray(raw)
+    dtype = np.dtype(var["dtype"])
+    fills = [packing[a] for a in ("_FillValue", "missing_value") if a in packing]
+    if "_FillValue" not in packing and dtype.itemsize > 1:
+        fills.append(default_fillvals.get(dtype.kind + str(dtype.itemsize)))
+    out_dtype = unpacked_dtype(var)
+    values = raw.astype(out_dtype if out_dtype.kind == "f" else np.float64)
+    mask = np.zeros(raw.shape, dtype=bool)
+    for fill in fills:
+        if fill is not None:
+            mask |= np.isin(raw, np.atleast_1d(np.asarray(fill, dtype=raw.dtype)))
+    if "scale_factor" in packing:
+        values *= values.dtype.type(packing["scale_factor"])
+    if "add_offset" in packing:
+        values += values.dtype.type(packing["add_offset"])
+    values[mask] = np.nan
+    return values
+
+
+def _name_fields(file_name):
+    # (variable, period) of [<AOI>_]clmforc.<dataset>.<res>.1d.<VAR>.<YYYY-MM>.nc
+    idx = file_name.find("clmforc")
+    parts = file_name[max(idx, 0):].split(".")
+    return (parts[4] if len(parts) > 4 else "", parts[5] if len(parts) > 5 else "")
+
+
+def describe_file(path: str) -> dict:
+    """Catalog fields of one forcing file read from its header (classic) or through netCDF4."""
+    try:
+        header = read_classic_header(path)
+    except ValueError:
+        header = None
+    if header is not None:
+        variables = header["variables"]
+        info = {"format": header["format"], "numrecs": header["numrecs"], "dims": dict(header["dims"])}
+        time = variables.get("time")
+        if time is not None and time["shape"] and time["shape"][0]:
+            last = time["shape"][0] - 1
+            if time["record"]:
+                first_v = _read_values(path, time, header["recsize"], 0)[0]
+                last_v = _read_values(path, time, header["recsize"], last)[0]
+            else:
+                values = _read_values(path, time, header["recsize"], 0)
+                first_v, last_v = values[0], values[-1]
+            info.update(time_first=float(first_v), time_last=float(last_v),
+                        time_units=str(time["attrs"].get("units", "")))
+        if "gridID" in variables and not variables["gridID"]["record"]:
+            info["gridid_sha"] = _gridid_sha(_read_values(path, variables["gridID"], header["recsize"], 0))
+        info["variables"] = {name: {"dtype": v["dtype"], "dims": v["dims"], "shape": v["shape"],
+                                    "offset": v["begin"], "vsize": v["vsize"], "record": v["record"],
+                                    "packing": _packing(v["attrs"], v["dtype"])}
+                             for name, v in variables.items()}
+    else:
+        import netCDF4 as nc
+        with nc.Dataset(path, "r") as src:
+            info = {"format": src.data_model, "dims": {k: len(d) for k, d in src.dimensions.items()},
+                    "numrecs": next((len(d) for d in src.dimensions.values() if d.isunlimited()), 0)}
+            if "time" in src.variables and src.variables["time"].size:
+                time = src.variables["time"]
+                info.update(time_first=float(time[0]), time_last=float(time[-1]),
+                            time_units=str(getattr(time, "units", "")))
+            if "gridID" in src.variables:
+                info["gridid_sha"] = _gridid_sha(np.asarray(src.variables["gridID"][:]))
+            info["variables"] = {name: {"dtype": v.dtype.str if hasattr(v.dtype, "str") else str(v.dtype),
+                                        "dims": list(v.dimensions), "shape": list(v.shape),
+                                        "offset": None, "vsize": None, "record": False,
+                                        "packing": _packing({k: v.getncattr(k) for k in v.ncattrs()}, v.dtype)}
+                                 for name, v in src.variables.items()}
+    dims = info["dims"]
+    info["time_steps"] = dims.get("time") or info["numrecs"]
+    info["ncells"] = dims.get("ni") or dims.get("gridcell") or 0
+    return info
+
+
+def catalog_path(forcing_dir: str) -> str:
+    value = os.environ.get(CATALOG_ENV)
+    if value == CATALOG_IN_TREE:
+        return os.path.join(forcing_dir, CATALOG_NAME)
+    if value:
+        return value
+    key = hashlib.sha256(os.path.realpath(forcing_dir).encode()).hexdigest()[:16]
+    return os.path.join(os.path.expanduser("~"), ".cache", "tes_forcing_catalog", f"{key}.sqlite")
+
+
+def _scan(forcing_dir: str) -> dict:
+    """{relative path: (dir, file, size, mtime_ns)} of every .nc file; stat only, hidden dirs skipped."""
+    found = {}
+    stack = [""]
+    while stack:
+        rel = stack.pop()
+        with os.scandir(os.path.join(forcing_dir, rel) if rel else forcing_dir) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    stack.append(os.path.join(rel, entry.name))
+                elif entry.name.endswith(".nc"):
+                    st = entry.stat()
+                    found[os.path.join(rel, entry.name)] = (rel or ".", entry.name, st.st_size, st.st_mtime_ns)
+    return found
+
+
+class ForcingCatalog:
+    def __init__(self, forcing_dir: str, path: str = None):
+        self.forcing_dir = os.path.normpath(os.path.expanduser(forcing_dir))
+        self.path = path or catalog_path(self.forcing_dir)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(self.path, timeout=60)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, dir TEXT, file TEXT, stream TEXT,"
+            " variable TEXT, period TEXT, size INTEGER, mtime_ns INTEGER, format TEXT, time_steps INTEGER,"
+            " ncells INTEGER, time_first REAL, time_last REAL, time_units TEXT, gridid_sha TEXT,"
+            " dims TEXT, variables TEXT);"
+            "CREATE INDEX IF NOT EXISTS files_stream ON files (stream, variable, period);")
+        version = self.db.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if version is not None and version[0] != SCHEMA_VERSION:
+            self.db.execute("DELETE FROM files")
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)", (SCHEMA_VERSION,))
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('forcing_dir', ?)", (self.forcing_dir,))
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def refresh(self) -> dict:
+        """Re-read new or changed files and drop vanished ones; returns the counts."""
+        found = _scan(self.forcing_dir)
+        known = {row["path"]: (row["size"], row["mtime_ns"])
+                 for row in self.db.execute("SELECT path, size, mtime_ns FROM files")}
+        changed = [p for p, (_, _, size, mtime) in found.items() if known.get(p) != (size, mtime)]
+        removed = known.keys() - found.keys()
+        for rel in changed:
+            directory, name, size, mtime = found[rel]
+            info = describe_file(os.path.join(self.forcing_dir, rel))
+            variable, period = _name_fields(name)
+            row = {"path": rel, "dir": directory, "file": name, "stream": directory, "variable": variable,
+                   "period": period, "size": size, "mtime_ns": mtime, "format": info["format"],
+                   "time_steps": info["time_steps"], "ncells": info["ncells"], "time_first": info.get("time_first"),
+                   "time_last": info.get("time_last"), "time_units": info.get("time_units"),
+                   "gridid_sha": info.get("gridid_sha"), "dims": json.dumps(info["dims"]),
+                   "variables": json.dumps(info["variables"])}
+            self.db.execute(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) "
+                            f"VALUES ({', '.join('?' * len(COLUMNS))})", [row[c] for c in COLUMNS])
+        self.db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+        self.db.execute("INSERT OR REPLACE INTO meta VALUES ('refreshed', ?)",
+                        (datetime.now().isoformat(timespec="seconds"),))
+        self.db.commit()
+        return {"files": len(found), "read": len(changed), "removed": len(removed)}
+
+    def files(self, stream: str = None, variable: str = None) -> list:
+        """Catalog rows as dicts (dims/variables decoded), sorted by dir and file."""
+        query, args = "SELECT * FROM files", []
+        where = [(c, v) for c, v in (("stream", stream), ("variable", variable)) if v]
+        if where:
+            query += " WHERE " + " AND ".join(f"{c} = ?" for c, _ in where)
+            args = [v for _, v in where]
+        rows = []
+        for row in self.db.execute(query + " ORDER BY dir, file", args):
+            row = dict(row)
+            row["dims"] = json.loads(row["dims"])
+            row["variables"] = json.loads(row["variables"])
+            rows.append(row)
+        return rows
+
+    def summary(self) -> dict:
+        streams = {}
+        for row in self.db.execute(
+                "SELECT stream, COUNT(*) AS files, SUM(size) AS bytes, MAX(size) AS max_file_bytes,"
+                " MIN(time_first) AS time_first, MAX(time_last) AS time_last, MAX(time_steps) AS time_steps,"
+                " MAX(ncells) AS ncells, COUNT(DISTINCT gridid_sha) AS gridid_sets"
+                " FROM files GROUP BY stream ORDER BY stream"):
+            streams[row["stream"]] = dict(row)
+        return streams
+
+
+def open_catalog(forcing_dir: str, refresh: bool = True) -> ForcingCatalog:
+    catalog = ForcingCatalog(forcing_dir)
+    if refresh:
+        catalog.refresh()
+    return catalog
+
+
+def catalog_files(forcing_dir: str) -> list:
+    """Refreshed catalog rows of forcing_dir."""
+    with open_catalog(forcing_dir) as catalog:
+        return catalog.files()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build and query the forcing source catalog.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name, text in (("refresh", "Re-read new or changed files"), ("summary", "Per-stream totals"),
+                       ("show", "List catalog rows")):
+        p = sub.add_parser(name, help=text)
+        p.add_argument("forcing_dir")
+        p.add_argument("--catalog", help=f"Catalog file (default: ${CATALOG_ENV} or next to the forcing)")
+        if name == "show":
+            p.add_argument("--stream")
+            p.add_argument("--variable")
+    args = parser.parse_args()
+
+    with ForcingCatalog(args.forcing_dir, args.catalog) as catalog:
+        counts = catalog.refresh()
+        if args.command == "refresh":
+            print(f"{catalog.path}: {counts['files']} files, {counts['read']} read, {counts['removed']} removed")
+        elif args.command == "summary":
+            for stream, s in catalog.summary().items():
+                print(f"{stream:16s} {s['files']:5d} files {s['bytes'] / 1e9:9.2f} GB  {s['ncells']} cells  "
+                      f"{s['time_steps']} steps/file  time {s['time_first']}..{s['time_last']}  "
+                      f"{s['gridid_sets']} gridID set(s)")
+        else:
+            for row in catalog.files(args.stream, args.variable):
+                offsets = {n: v["offset"] for n, v in row["variables"].items()}
+                print(f"{row['path']}  {row['variable']} {row['period']}  {row['format']}  {row['time_steps']} x "
+                      f"{row['ncells']}  time {row['time_first']}..{row['time_last']}  offsets {offsets}")
+
+
+if __name__ == "__main__":
+    main()
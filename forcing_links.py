@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""Incremental forcing/domain soft links under <experiment_root>/atm_forcing.datm7.km.1d.
+
+The link directory is compared with the target map computed from the experiment's
+forcing tree (and AOI domain); only links that are missing, point elsewhere or no
+longer have a source are added, replaced or removed, with os.symlink/os.replace
+directly. Link names follow the datm naming of the original link scripts:
+
+    <AOI>_clmforc.Daymet4.4km.1d.TBOT.1980-01.nc -> clmforc.Daymet.km.1d.TBOT.1980-01.nc
+    <AOI>_domain.lnd.TES_SE.4km.1d.c<date>.nc    -> domain.lnd.Daymet.km.1d.nc
+
+Targets are relative (../forcing/...), so an experiment directory can be moved.
+
+Example use (from <experiment_root>/scripts):
+  python3 forcing_links.py
+  python3 forcing_links.py --no-domain --dry-run
+"""
+
+import argparse
+import os
+
+LINK_DIR = "atm_forcing.datm7.km.1d"
+DOMAIN_LINK = "domain.lnd.Daymet.km.1d.nc"
+
+
+def link_name(file_name: str) -> str:
+    """datm name of an AOI forcing file: drop the AOI prefix, clmforc.<dataset>.<res> -> clmforc.Daymet.km."""
+    parts = file_name.split("_")
+    name = "_".join(parts[1:]) if len(parts) > 1 else file_name
+    prefix = "clmforc."
+    end_index = name.find(".1d")
+    return prefix + "Daymet.km" + name[end_index:]
+
+
+def _scan_forcing(forcing_dir: str, rel_root: str):
+    # os.scandir walk; hidden directories (cache, temporary shards) are skipped
+    stack = [(forcing_dir, rel_root)]
+    while stack:
+        directory, rel = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                if entry.is_dir():
+                    stack.append((entry.path, rel + "/" + entry.name))
+                elif "clmforc" in entry.name and entry.name.endswith(".nc"):
+                    yield entry.name, rel + "/" + entry.name
+
+
+def target_map(exp_root: str, include_domain: bool = True) -> dict:
+    """{link name: target relative to the link directory}; raises if two sources claim one link."""
+    targets, conflicts = {}, []
+    forcing_dir = os.path.join(exp_root, "forcing")
+    if os.path.isdir(forcing_dir):
+        for name, target in _scan_forcing(forcing_dir, "../forcing"):
+            link = link_name(name)
+            if link in targets and targets[link] != target:
+                conflicts.append(f"{link}: {targets[link]} and {target}")
+            targets[link] = target
+    if conflicts:
+        raise ValueError("Several forcing files map to the same link:\n  " + "\n  ".join(sorted(conflicts)))
+    if include_domain:
+        dom_surf = os.path.join(exp_root, "domain_surfdata")
+        domains = sorted(e.name for e in os.scandir(dom_surf) if "_domain.lnd" in e.name) if os.path.isdir(dom_surf) else []
+        if domains:
+            targets[DOMAIN_LINK] = "../domain_surfdata/" + domains[-1]
+    return targets
+
+
+def sync_links(link_dir: str, targets: dict, prune: bool = True, dry_run: bool = False) -> dict:
+    """Make the symlinks of link_dir match targets; returns the names added, updated, removed and kept."""
+    result = {"added": [], "updated": [], "removed": [], "kept": 0, "blocked": []}
+    existing = {}
+    if os.path.isdir(link_dir):
+        with os.scandir(link_dir) as entries:
+            for entry in entries:
+                if entry.is_symlink():
+                    existing[entry.name] = os.readlink(entry.path)
+                elif entry.name in targets:
+                    result["blocked"].append(entry.name)  # a regular file is never replaced
+    elif not dry_run:
+        os.makedirs(link_dir)
+
+    for name, target in targets.items():
+        if name in result["blocked"]:
+            continue
+        current = existing.get(name)
+        if current == target:
+            result["kept"] += 1
+            continue
+        result["added" if current is None else "updated"].append(name)
+        if dry_run:
+            continue
+        path = os.path.join(link_dir, name)
+        if current is None:
+            os.symlink(target, path)
+        else:
+            tmp = os.path.join(link_dir, f".{name}.{os.getpid()}")
+            os.symlink(target, tmp)
+            os.replace(tmp, path)
+
+    if prune:
+        for name in existing.keys() - targets.keys():
+            result["removed"].append(name)
+            if not dry_run:
+                os.unlink(os.path.join(link_dir, name))
+    return result
+
+
+def dangling_links(link_dir: str) -> list:
+    """Links whose target does not resolve (one stat per link)."""
+    if not os.path.isdir(link_dir):
+        return []
+    with os.scandir(link_dir) as entries:
+        return sorted(e.name for e in entries if e.is_symlink() and not os.path.exists(e.path))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Create or update the forcing/domain soft links of an experiment.")
+    parser.add_argument("--exp-root", default="..", help="Experiment root (default: .., i.e. run from scripts/)")
+    parser.add_argument("--no-domain", action="store_true", help="Only link forcing files, not the AOI domain")
+    parser.add_argument("--keep-extra", action="store_true", help="Keep links that no longer have a source file")
+    parser.add_argument("--dry-run", action="store_true", help="Report the changes without touching the links")
+    parser.add_argument("--verbose", action="store_true", help="List every changed link")
+    args = parser.parse_args()
+
+    link_dir = os.path.join(args.exp_root, LINK_DIR)
+    targets = target_map(args.exp_root, include_domain=not args.no_domain)
+    result = sync_links(link_dir, targets, prune=not args.keep_extra, dry_run=args.dry_run)
+    if args.verbose:
+        for key in ("added", "updated", "removed"):
+            for name in sorted(result[key]):
+                print(f"{key:8s} {name} -> {targets.get(name, '')}")
+    for name in result["blocked"]:
+        print(f"Warning: {os.path.join(link_dir, name)} is a regular file, not replaced")
+    print(f"{link_dir}: {len(result['added'])} added, {len(result['updated'])} updated, "
+          f"{len(result['removed'])} removed, {result['kept']} unchanged" + (" (dry run)" if args.dry_run else ""))
+    if not args.dry_run:
+        dangling = dangling_links(link_dir)
+        if dangling:
+            raise SystemExit(f"{len(dangling)} links do not resolve, e.g. {dangling[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""Progress channel for forcing generation.
+
+Every finished file produces an event (rank, file, bytes, seconds). The collector
+(rank 0 under MPI, the parent process of the local pool, or each job-array shard)
+appends the events to forcing_progress<tag>.jsonl and keeps forcing_status<tag>.json
+refreshed with files done, aggregate throughput and an ETA. Both files are written to
+$FORCING_PROGRESS_DIR, default the working directory (the experiment scripts dir).
+
+Example use:
+  python3 forcing_progress.py status            # from <experiment_root>/scripts
+  python3 forcing_progress.py status --watch 30
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+PROGRESS_DIR_ENV = "FORCING_PROGRESS_DIR"
+STATUS_PREFIX = "forcing_status"
+EVENTS_PREFIX = "forcing_progress"
+REFRESH_SECONDS = 5.0
+
+
+def progress_dir() -> str:
+    return os.environ.get(PROGRESS_DIR_ENV, os.getcwd())
+
+
+def file_event(rank, root, file, nbytes, seconds, failed: bool = False) -> dict:
+    return {
+        "event": "file_failed" if failed else "file_done",
+        "rank": rank,
+        "dir": os.path.basename(os.path.normpath(root)),
+        "file": file,
+        "bytes": nbytes,
+        "seconds": round(seconds, 3),
+        "time": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+class ProgressTracker:
+    """Collector side: event log plus an atomically replaced status file."""
+
+    def __init__(self, total_files: int, total_bytes: int, tag: str = "", directory: str = None,
+                 refresh: float = REFRESH_SECONDS):
+        directory = directory or progress_dir()
+        os.makedirs(directory, exist_ok=True)
+        self.status_path = os.path.join(directory, f"{STATUS_PREFIX}{tag}.json")
+        self.events_path = os.path.join(directory, f"{EVENTS_PREFIX}{tag}.jsonl")
+        self.total_files = total_files
+        self.total_bytes = total_bytes
+        self.files_done = 0
+        self.bytes_done = 0
+        self.per_rank = {}
+        self.failed = []
+        self.last = None
+        self.refresh = refresh
+        self.started = time.time()
+        self._written = 0.0
+        self._lock = threading.Lock()  # events may arrive on an MPI listener thread
+        self._events = open(self.events_path, "a")
+        self._log({"event": "start", "files": total_files, "bytes": total_bytes,
+                   "time": datetime.now().isoformat(timespec="seconds")})
+        self.write_status("running")
+
+    def _log(self, event: dict) -> None:
+        self._events.write(json.dumps(event) + "\n")
+        self._events.flush()
+
+    def file_done(self, event: dict) -> None:
+        with self._lock:
+            if event["event"] == "file_failed":
+                self.failed.append(event["file"])
+            else:
+                self.files_done += 1
+                self.bytes_done += event["bytes"]
+                self.per_rank[str(event["rank"])] = self.per_rank.get(str(event["rank"]), 0) + 1
+                self.last = event
+            self._log(event)
+            if time.time() - self._written >= self.refresh:
+                self.write_status("running")
+
+    def snapshot(self, state: str) -> dict:
+        elapsed = time.time() - self.started
+        rate = self.bytes_done / elapsed if elapsed > 0 else 0.0
+        remaining = max(self.total_bytes - self.bytes_done, 0)
+        eta = remaining / rate if rate > 0 else None
+        return {
+            "state": state,
+            "pid": os.getpid(),
+            "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+            "updated": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_s": round(elapsed, 1),
+            "files_done": self.files_done,
+            "files_total": self.total_files,
+            "bytes_done": self.bytes_done,
+            "bytes_total": self.total_bytes,
+            "percent": round(100.0 * self.bytes_done / self.total_bytes, 1) if self.total_bytes else 100.0,
+            "throughput_mb_s": round(rate / 1e6, 2),
+            "eta_s": round(eta, 1) if eta is not None and state == "running" else None,
+            "eta": (datetime.now() + timedelta(seconds=eta)).isoformat(timespec="seconds")
+                   if eta is not None and state == "running" else None,
+            "files_per_rank": self.per_rank,
+            "failed_files": self.failed,
+            "last_file": self.last["file"] if self.last else None,
+        }
+
+    def write_status(self, state: str) -> None:
+        tmp = f"{self.status_path}.{os.getpid()}"
+        with open(tmp, "w") as f:
+            json.dump(self.snapshot(state), f, indent=1)
+            f.write("\n")
+        os.replace(tmp, self.status_path)
+        self._written = time.time()
+
+    def finish(self, state: str = "finished") -> None:
+        self._log({"event": state, "files": self.files_done, "bytes": self.bytes_done,
+                   "time": datetime.now().isoformat(timespec="seconds")})
+        self.write_status(state)
+        self._events.close()
+
+
+def _format_seconds(seconds) -> str:
+    if seconds is None:
+        return "-"
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def read_statuses(directory: str) -> dict:
+    statuses = {}
+    for path in sorted(glob.glob(os.path.join(directory, f"{STATUS_PREFIX}*.json"))):
+        try:
+            with open(path) as f:
+                statuses[os.path.basename(path)] = json.load(f)
+        except (OSError, ValueError):
+            continue  # being replaced right now
+    return statuses
+
+
+def print_status(directory: str) -> int:
+    statuses = read_statuses(directory)
+    if not statuses:
+        print(f"No {STATUS_PREFIX}*.json in {directory}; has the forcing job started?")
+        return 1
+    for name, s in statuses.items():
+        print(f"{name:32s} {s['state']:9s} {s['files_done']:5d}/{s['files_total']:<5d} files "
+              f"{s['percent']:5.1f}%  {s['throughput_mb_s']:8.2f} MB/s  elapsed {_format_seconds(s['elapsed_s'])}  "
+              f"ETA {_format_seconds(s['eta_s'])}  (updated {s['updated']})")
+    if len(statuses) > 1:
+        files_done = sum(s["files_done"] for s in statuses.values())
+        files_total = sum(s["files_total"] for s in statuses.values())
+        bytes_done = sum(s["bytes_done"] for s in statuses.values())
+        bytes_total = sum(s["bytes_total"] for s in statuses.values())
+        rate = sum(s["throughput_mb_s"] for s in statuses.values() if s["state"] == "running")
+        running = [s["eta_s"] for s in statuses.values() if s["state"] == "running" and s["eta_s"] is not None]
+        print(f"{'total':32s} {len(running):3d} running {files_done:5d}/{files_total:<5d} files "
+              f"{100.0 * bytes_done / bytes_total if bytes_total else 100.0:5.1f}%  {rate:8.2f} MB/s  "
+              f"ETA {_format_seconds(max(running) if running else None)}")
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Report forcing generation progress.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_status = sub.add_parser("status", help="Summarise the forcing status files")
+    p_status.add_argument("--dir", default=progress_dir(), help="Directory with the status files (default: cwd)")
+    p_status.add_argument("--watch", type=float, default=0, help="Refresh every N seconds until interrupted")
+    args = parser.parse_args()
+
+    if args.watch > 0:
+        try:
+            while True:
+                print(f"--- {datetime.now().isoformat(timespec='seconds')}")
+                print_status(args.dir)
+                time.sleep(args.watch)
+        except KeyboardInterrupt:
+            return
+    sys.exit(print_status(args.dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""Shard plan for forcing generation as a Slurm job array.
+
+The entire-domain forcing files are split into N shards balanced by byte size. Each
+array element removes its completion marker, subsets one shard with AOI_forcing_save_1d
+and writes the marker again with a fingerprint of the shard files and the AOI gridIDs;
+a final job validates markers and outputs and lists the shards that need resubmitting.
+`run-local` executes the same plan without Slurm.
+
+Example use:
+  python3 forcing_shards.py plan --forcing-dir <forcing_dir> --shards 16 --out forcing_shards.json
+  python3 forcing_shards.py run --plan forcing_shards.json --shard 3 <output_path> <AOI_gridID_path> <AOI_points_file>
+  python3 forcing_shards.py run-local --plan forcing_shards.json --workers 4 <output_path> <AOI_gridID_path> <AOI_points_file>
+  python3 forcing_shards.py validate --plan forcing_shards.json <output_path> <AOI_gridID_path> <AOI_points_file>
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from datetime import datetime
+from time import time
+
+SHARD_MARKER_DIR = ".shards"
+
+
+def discover_forcing_files(forcing_dir: str) -> list:
+    """Every source .nc file under forcing_dir as {dir, file, size}; dir is relative to forcing_dir.
+
+    Listed from the forcing catalog (forcing_catalog.py) when it can be opened, so only
+    new or changed files are looked at; otherwise the tree is walked.
+    """
+    try:
+        from forcing_catalog import catalog_files
+        return [{"dir": r["dir"], "file": r["file"], "size": r["size"]} for r in catalog_files(forcing_dir)]
+    except (ImportError, OSError, ValueError, sqlite3.Error) as e:
+        print(f"Forcing catalog unavailable ({e}); walking {forcing_dir}")
+    files = []
+    for root, dirs, names in os.walk(forcing_dir):
+        dirs.sort()
+        for name in sorted(names):
+            if name.endswith('.nc'):
+                files.append({
+                    "dir": os.path.relpath(root, forcing_dir),
+                    "file": name,
+                    "size": os.path.getsize(os.path.join(root, name)),
+                })
+    return files
+
+
+def plan_shards(files: list, nshards: int) -> list:
+    """Greedy longest-first assignment of files to nshards shards of similar total size."""
+    nshards = max(1, min(nshards, len(files)))
+    shards = [{"index": k, "bytes": 0, "files": []} for k in range(nshards)]
+    for f in sorted(files, key=lambda f: f["size"], reverse=True):
+        target = min(shards, key=lambda s: s["bytes"])
+        target["files"].append(f)
+        target["bytes"] += f["size"]
+    for shard in shards:
+        shard["files"].sort(key=lambda f: (f["dir"], f["file"]))
+    return shards
+
+
+def write_plan(path: str, forcing_dir: str, shards: list) -> dict:
+    plan = {
+        "forcing_dir": forcing_dir,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "nshards": len(shards),
+        "total_files": sum(len(s["files"]) for s in shards),
+        "total_bytes": sum(s["bytes"] for s in shards),
+        "shards": shards,
+    }
+    with open(path, "w") as f:
+        json.dump(plan, f, indent=1)
+        f.write("\n")
+    return plan
+
+
+def read_plan(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def _marker_path(output_path: str, index: int) -> str:
+    return os.path.join(output_path, SHARD_MARKER_DIR, f"shard_{index:04d}.done")
+
+
+def shard_fingerprint(plan: dict, index: int, AOI_points, keep_order: bool) -> str:
+    """Hash of what a shard's outputs depend on: its source files and the AOI gridIDs in output order."""
+    import numpy as np
+    shard = plan["shards"][index]
+    h = hashlib.sha256(json.dumps([plan["forcing_dir"], shard["files"], keep_order], sort_keys=True).encode())
+    h.update(np.ascontiguousarray(np.asarray(AOI_points).reshape(-1), dtype="<i8").tobytes())
+    return h.hexdigest()
+
+
+def run_shard(plan: dict, index: int, output_path: str, aoi_path: str, aoi_file: str) -> int:
+    from forcing_progress import ProgressTracker
+    from TES_AOI_forcingGEN_mpi import _load_aoi_points, _process_task
+    from tes_grid import file_cell_order
+
+    shard = plan["shards"][index]
+    AOI = aoi_file.split('_')[0]
+    AOI_points = _load_aoi_points(aoi_path, aoi_file)
+    keep_order = file_cell_order(os.path.join(aoi_path, aoi_file)) != 'source'
+    forcing_dir = plan["forcing_dir"]
+    fingerprint = shard_fingerprint(plan, index, AOI_points, keep_order)
+
+    # a marker from an earlier run must not vouch for outputs this run is about to replace
+    marker = _marker_path(output_path, index)
+    if os.path.exists(marker):
+        os.remove(marker)
+
+    # one status file per shard; 'forcing_progress.py status' sums them up
+    tracker = ProgressTracker(len(shard["files"]), shard["bytes"], tag=f"_shard{index:04d}")
+    start_total = time()
+    for f in shard["files"]:
+        root = os.path.join(forcing_dir, f["dir"])
+        new_dir = os.path.join(output_path, f["dir"])
+        print(f"[shard {index}/{plan['nshards']}] processing {f['file']}")
+        try:
+            event = _process_task(root, f["file"], AOI, AOI_points, new_dir, rank=index, keep_order=keep_order)
+        except Exception:
+            tracker.finish("failed")
+            raise
+        tracker.file_done(event)
+        print(f"[shard {index}] Done {f['file']} in {event['seconds']:.2f}s")
+    tracker.finish()
+
+    os.makedirs(os.path.dirname(marker), exist_ok=True)
+    with open(marker, "w") as m:
+        json.dump({"shard": index, "files": len(shard["files"]), "fingerprint": fingerprint,
+                   "seconds": round(time() - start_total, 1),
+                   "finished": datetime.now().isoformat(timespec="seconds")}, m)
+    print(f"[shard {index}] Finished {len(shard['files'])} files in {time() - start_total:.2f}s")
+    return index
+
+
+def run_local(plan: dict, output_path: str, aoi_path: str, aoi_file: str, workers: int, shards=None) -> None:
+    """Stand-in for the job array: run the shards of the plan with a local process pool."""
+    indices = list(shards) if shards else list(range(plan["nshards"]))
+    if workers <= 1:
+        for i in indices:
+            run_shard(plan, i, output_path, aoi_path, aoi_file)
+        return
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_shard, plan, i, output_path, aoi_path, aoi_file) for i in indices]
+        for fut in as_completed(futures):
+            fut.result()
+
+
+def validate(plan: dict, output_path: str, aoi_path: str, aoi_file: str) -> list:
+    """Return the indices of shards whose marker or outputs are missing/inconsistent."""
+    import netCDF4 as nc
+    from TES_AOI_forcingGEN_mpi import _load_aoi_points, source_stem
+    from tes_grid import file_cell_order
+
+    AOI = aoi_file.split('_')[0]
+    AOI_points = _load_aoi_points(aoi_path, aoi_file)
+    npoints = AOI_points.size
+    keep_order = file_cell_order(os.path.join(aoi_path, aoi_file)) != 'source'
+    failed = []
+    for shard in plan["shards"]:
+        index = shard["index"]
+        problems = []
+        marker = _marker_path(output_path, index)
+        if not os.path.exists(marker):
+            problems.append("no completion marker")
+        else:
+            with open(marker) as m:
+                done = json.load(m)
+            if done.get("fingerprint") != shard_fingerprint(plan, index, AOI_points, keep_order):
+                problems.append("completion marker of a different plan or AOI")
+        for f in shard["files"]:
+            dst_name = os.path.join(output_path, f["dir"], AOI + '_' + source_stem(f["file"]))
+            if not os.path.exists(dst_name):
+                problems.append(f"missing {dst_name}")
+                continue
+            try:
+                with nc.Dataset(dst_name, 'r') as dst:
+                    dim = dst.dimensions.get('ni') or dst.dimensions.get('gridcell')
+                    if dim is None or len(dim) != npoints:
+                        problems.append(f"wrong gridcell size in {dst_name}")
+            except OSError as e:
+                problems.append(f"unreadable {dst_name}: {e}")
+        if problems:
+            failed.append(index)
+            print(f"[shard {index}] FAILED: " + "; ".join(problems[:3]) + (" ..." if len(problems) > 3 else ""))
+    return failed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Plan, run and validate forcing generation shards.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_plan = sub.add_parser("plan", help="Write a shard plan balanced by source file size")
+    p_plan.add_argument("--forcing-dir", required=True, help="Entire-domain forcing directory")
+    p_plan.add_argument("--shards", type=int, required=True, help="Number of shards (array elements)")
+    p_plan.add_argument("--out", default="forcing_shards.json", help="Plan file to write")
+
+    def _aoi_args(p):
+        p.add_argument("--plan", default="forcing_shards.json", help="Shard plan JSON")
+        p.add_argument("output_path", help="path for the 1D AOI forcing data directory")
+        p.add_argument("aoi_path", help="path to the AOI gridIDs (csv or domain.nc)")
+        p.add_argument("aoi_file", help="<AOI>_gridID.csv or <AOI>_domain.nc")
+
+    p_run = sub.add_parser("run", help="Process one shard (one job array element)")
+    p_run.add_argument("--shard", type=int, default=None,
+                       help="Shard index (default: $SLURM_ARRAY_TASK_ID)")
+    _aoi_args(p_run)
+
+    p_local = sub.add_parser("run-local", help="Process all (or selected) shards without Slurm")
+    p_local.add_argument("--workers", type=int, default=int(os.environ.get('FORCING_SERIAL_WORKERS', '4')))
+    p_local.add_argument("--shards", type=int, nargs="*", help="Only these shard indices")
+    _aoi_args(p_local)
+
+    p_val = sub.add_parser("validate", help="Check every shard's outputs; exit 1 listing shards to resubmit")
+    _aoi_args(p_val)
+
+    args = parser.parse_args()
+
+    if args.command == "plan":
+        files = discover_forcing_files(args.forcing_dir)
+        plan = write_plan(args.out, args.forcing_dir, plan_shards(files, args.shards))
+        sizes = [s["bytes"] for s in plan["shards"]]
+        print(f"{plan['total_files']} files in {plan['nshards']} shards, "
+              f"{min(sizes) / 1e9:.2f}-{max(sizes) / 1e9:.2f} GB per shard -> {args.out}")
+        return
+
+    plan = read_plan(args.plan)
+    if args.command == "run":
+        index = args.shard if args.shard is not None else int(os.environ["SLURM_ARRAY_TASK_ID"])
+        run_shard(plan, index, args.output_path, args.aoi_path, args.aoi_file)
+    elif args.command == "run-local":
+        run_local(plan, args.output_path, args.aoi_path, args.aoi_file, args.workers, args.shards)
+    elif args.command == "validate":
+        failed = validate(plan, args.output_path, args.aoi_path, args.aoi_file)
+        if failed:
+            print("Resubmit the failed shards with: bash submit_forcing_array.sh " + ",".join(map(str, failed)))
+            sys.exit(1)
+        print(f"All {plan['nshards']} shards ({plan['total_files']} files) validated.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Gridcell-major export of AOI forcing: one contiguous time series per cell and variable.
+
+AOI_forcing_save_1d writes (time, nj, ni) files per variable and period, so a 40-year
+series of one cell touches every file of its stream. This export concatenates all
+periods of every variable (all streams) and transposes them into a (gridcell, time)
+store that a training loader can memory-map:
+
+  <output>/index.json                  variables, streams, cells, time axes and shards
+  <output>/gridID.npy                  gridIDs in cell order (the AOI forcing order)
+  <output>/<VAR>/time.npy              time of every step, in the units of the first file
+  <output>/<VAR>/<VAR>.s<k>.npy        (cells of shard k, ntime), C order  (--format npy)
+  <output>/<VAR>.nc                    (gridcell, time), chunked, zlib     (--format netcdf4)
+
+The files are listed from the forcing catalog (forcing_catalog.py) and ordered by period.
+Packed variables (scale_factor/add_offset) are exported unpacked, in the float type
+netCDF4 unpacks them to, with fill values as NaN and without the packing attributes.
+Worker processes read whole files ahead of the writer (at most --workers files in
+flight); the writer gathers time blocks up to --memory-mb and writes each block into the
+shards, so memory stays bounded whatever the length of the series.
+
+Example use:
+  python3 forcing_timeseries_export.py --forcing-dir <experiment_root>/forcing --output <experiment_root>/timeseries
+  python3 forcing_timeseries_export.py --forcing-dir ../forcing --output ../timeseries --format netcdf4 --variables TBOT QBOT
+  python3 forcing_timeseries_export.py --show ../timeseries
+
+  store = TimeSeriesStore("<experiment_root>/timeseries")
+  tbot = store.series("TBOT", gridid)          # memory-mapped (ntime,) view
+"""
+
+import argparse
+import json
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import time
+
+import numpy as np
+import netCDF4 as nc
+
+from forcing_catalog import PACKING_ATTRS, catalog_files, is_packed, unpacked_dtype
+
+INDEX = "index.json"
+CELLS_PER_SHARD = 4096
+MEMORY_MB = 1024
+FORMATS = ("npy", "netcdf4")
+
+
+def _series_variables(row):
+    # data variables of a forcing file: (time, ..., cells) besides time itself
+    cell_dim = "ni" if "ni" in row["dims"] else "gridcell"
+    return [name for name, v in row["variables"].items()
+            if name != "time" and v["dims"][:1] == ["time"] and v["dims"][-1] == cell_dim]
+
+
+def plan_export(rows, variables=None):
+    """{variable: {stream, dtype, ntime, files: [{path, period, start, count}]}} in period order."""
+    plan = {}
+    for row in sorted(rows, key=lambda r: (r["period"], r["file"])):
+        for name in _series_variables(row):
+            if variables and name not in variables:
+                continue
+            var = row["variables"][name]
+            entry = plan.setdefault(name, {"stream": row["stream"], "dtype": unpacked_dtype(var).str,
+                                           "packed": is_packed(var), "ntime": 0,
+                                           "gridid_sha": row["gridid_sha"], "files": []})
+            if row["gridid_sha"] != entry["gridid_sha"]:
+                raise ValueError(f"{row['path']}: gridIDs differ from the other {name} files")
+            entry["files"].append({"path": row["path"], "period": row["period"],
+                                   "start": entry["ntime"], "count": row["time_steps"]})
+            entry["ntime"] += row["time_steps"]
+    if variables:
+        missing = set(variables) - plan.keys()
+        if missing:
+            raise ValueError(f"No forcing files hold {', '.join(sorted(missing))}")
+    return plan
+
+
+def shard_ranges(ncells, cells_per_shard=CELLS_PER_SHARD):
+    return [(s, min(s + cells_per_shard, ncells)) for s in range(0, ncells, cells_per_shard)]
+
+
+def read_block(path, variable, time_units=None, calendar="standard"):
+    """(cells, time) values of one forcing file (unpacked, packed fill values as NaN) and its time in time_units."""
+    with nc.Dataset(path, "r") as src:
+        var = src[variable]
+        packed = "scale_factor" in var.ncattrs() or "add_offset" in var.ncattrs()
+        var.set_auto_mask(packed)  # a fill value only means something before unpacking
+        data = np.ma.filled(var[:], np.nan) if packed else var[:]
+        times = np.asarray(src["time"][:], dtype=np.float64)
+        units = getattr(src["time"], "units", time_units)
+        cal = getattr(src["time"], "calendar", calendar)
+    if time_units and units != time_units:
+        times = np.asarray(nc.date2num(nc.num2date(times, units, cal), time_units, cal), dtype=np.float64)
+    return np.ascontiguousarray(data.reshape(data.shape[0], -1).T), times
+
+
+def _file_info(path):
+    with nc.Dataset(path, "r") as src:
+        gridid = np.asarray(src["gridID"][:]).reshape(-1).astype(np.int64)
+        time_var = src["time"]
+        return gridid, getattr(time_var, "units", ""), getattr(time_var, "calendar", "standard")
+
+
+class _ShardWriter:
+    """(cells, ntime) .npy shards of one variable, filled block by block through memory maps."""
+
+    def __init__(self, var_dir, name, dtype, ntime, shards):
+        self.paths = [os.path.join(var_dir, f"{name}.s{k:03d}.npy") for k in range(len(shards))]
+        self.shards = shards
+        self.maps = [np.lib.format.open_memmap(p, mode="w+", dtype=dtype, shape=(stop - start, ntime))
+                     for p, (start, stop) in zip(self.paths, shards)]
+
+    def write(self, t0, block):
+        for (start, stop), mm in zip(self.shards, self.maps):
+            mm[:, t0:t0 + block.shape[1]] = block[start:stop]
+
+    def close(self):
+        for mm in self.maps:
+            mm.flush()
+        self.maps = []
+
+
+class _NetCDFWriter:
+    """<VAR>.nc with a (gridcell, time) variable chunked by cell groups and file-sized time runs."""
+
+    def __init__(self, path, name, dtype, ntime, gridid, cell_chunk, time_chunk, attrs):
+        if os.path.exists(path):
+            os.remove(path)
+        self.dst = nc.Dataset(path, "w", format="NETCDF4")
+        self.dst.createDimension("gridcell", gridid.size)
+        self.dst.createDimension("time", ntime)
+        self.dst.createVariable("gridID", "i8", ("gridcell",))[:] = gridid
+        self.var = self.dst.createVariable(name, dtype, ("gridcell", "time"), zlib=True, complevel=1,
+                                           chunksizes=(min(cell_chunk, gridid.size), max(1, min(time_chunk, ntime))))
+        self.var.setncatts({k: v for k, v in attrs.items() if k != "_FillValue"})
+        self.time = self.dst.createVariable("time", "f8", ("time",))
+
+    def write(self, t0, block):
+        self.var[:, t0:t0 + block.shape[1]] = block
+
+    def close(self):
+        self.dst.close()
+
+
+def export_variable(forcing_dir, output, name, entry, gridid, fmt="npy", cells_per_shard=CELLS_PER_SHARD,
+                    memory_mb=MEMORY_MB, executor=None, workers=1):
+    """Write the (gridcell, time) store of one variable; returns its index entry."""
+    start_clock = time()
+    files = entry["files"]
+    first = os.path.join(forcing_dir, files[0]["path"])
+    _, time_units, calendar = _file_info(first)
+    with nc.Dataset(first, "r") as src:
+        attrs = {k: src[name].getncattr(k) for k in src[name].ncattrs()
+                 if not (entry.get("packed") and k in PACKING_ATTRS)}
+    dtype = np.dtype(entry["dtype"]).newbyteorder("=")
+    ncells, ntime = gridid.size, entry["ntime"]
+    shards = shard_ranges(ncells, cells_per_shard)
+    var_dir = os.path.join(output, name)
+    if fmt == "npy":
+        os.makedirs(var_dir, exist_ok=True)
+        writer = _ShardWriter(var_dir, name, dtype, ntime, shards)
+    else:
+        writer = _NetCDFWriter(os.path.join(output, name + ".nc"), name, dtype, ntime, gridid,
+                               min(cells_per_shard, 256), files[0]["count"], attrs)
+    times = np.empty(ntime, dtype=np.float64)
+    limit = max(1, memory_mb) * 2 ** 20
+
+    def submit(item):
+        args = (os.path.join(forcing_dir, item["path"]), name, time_units, calendar)
+        return executor.submit(read_block, *args) if executor is not None else read_block(*args)
+
+    pending, queue = deque(files), deque()
+    buffered, buffer_start, nbytes = [], 0, 0
+    try:
+        while pending or queue:
+            while pending and len(queue) < max(1, workers):
+                item = pending.popleft()
+                queue.append((item, submit(item)))
+            item, fut = queue.popleft()
+            block, block_time = fut.result() if executor is not None else fut
+            if block.shape != (ncells, item["count"]):
+                raise ValueError(f"{item['path']}: {name} has shape {block.shape[::-1]}, "
+                                 f"expected ({item['count']}, {ncells})")
+            times[item["start"]:item["start"] + item["count"]] = block_time
+            if not buffered:
+                buffer_start = item["start"]
+            buffered.append(block.astype(dtype, copy=False))
+            nbytes += block.nbytes
+            if nbytes >= limit or not (pending or queue):
+                writer.write(buffer_start, np.concatenate(buffered, axis=1))
+                buffered, nbytes = [], 0
+        if fmt == "npy":
+            np.save(os.path.join(var_dir, "time.npy"), times)
+        else:
+            writer.time.setncatts({"units": time_units, "calendar": calendar})
+            writer.time[:] = times
+    finally:
+        writer.close()
+
+    print(f"[export] {name}: {len(files)} files, {ncells} cells x {ntime} steps in {time() - start_clock:.1f}s")
+    result = {"stream": entry["stream"], "dtype": dtype.str, "ntime": ntime, "time_units": time_units,
+              "calendar": calendar, "attrs": {k: (v.tolist() if hasattr(v, "tolist") else v) for k, v in attrs.items()},
+              "periods": [{"period": f["period"], "start": f["start"], "count": f["count"]} for f in files]}
+    if fmt == "npy":
+        result.update(time=f"{name}/time.npy",
+                      shards=[{"file": os.path.relpath(p, output), "cells": list(r)}
+                              for p, r in zip(writer.paths, shards)])
+    else:
+        result.update(file=f"{name}.nc")
+    return result
+
+
+def export_forcing(forcing_dir, output, variables=None, fmt="npy", cells_per_shard=CELLS_PER_SHARD,
+                   memory_mb=MEMORY_MB, workers=1):
+    plan = plan_export(catalog_files(forcing_dir), variables)
+    if not plan:
+        raise ValueError(f"No forcing time series found under {forcing_dir}")
+    gridid, _, _ = _file_info(os.path.join(forcing_dir, next(iter(plan.values()))["files"][0]["path"]))
+    os.makedirs(output, exist_ok=True)
+    np.save(os.path.join(output, "gridID.npy"), gridid)
+    print(f"[export] {len(plan)} variables, {gridid.size} cells -> {output} ({fmt})")
+
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        exported = {name: export_variable(forcing_dir, output, name, entry, gridid, fmt, cells_per_shard,
+                                          memory_mb, executor, workers)
+                    for name, entry in sorted(plan.items())}
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    index = {"created": datetime.now().isoformat(timespec="seconds"), "forcing_dir": os.path.abspath(forcing_dir),
+             "format": fmt, "ncells": int(gridid.size), "gridID": "gridID.npy",
+             "cells_per_shard": cells_per_shard, "variables": exported}
+    tmp = os.path.join(output, INDEX + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1)
+        f.write("\n")
+    os.replace(tmp, os.path.join(output, INDEX))
+    return index
+
+
+class TimeSeriesStore:
+    """Read side of an npy export: per-cell series as memory-mapped views."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX)) as f:
+            self.index = json.load(f)
+        if self.index["format"] != "npy":
+            raise ValueError(f"{path} holds a {self.index['format']} export; open the .nc files instead")
+        self.gridid = np.load(os.path.join(path, self.index["gridID"]))
+        self._cell = {int(g): i for i, g in enumerate(self.gridid)}
+        self._maps = {}
+
+    @property
+    def variables(self):
+        return sorted(self.index["variables"])
+
+    def time(self, variable):
+        return np.load(os.path.join(self.path, self.index["variables"][variable]["time"]))
+
+    def _shard(self, variable, k):
+        key = (variable, k)
+        if key not in self._maps:
+            entry = self.index["variables"][variable]["shards"][k]
+            self._maps[key] = np.load(os.path.join(self.path, entry["file"]), mmap_mode="r")
+        return self._maps[key]
+
+    def series(self, variable, gridid):
+        """(ntime,) series of one cell, by gridID."""
+        cell = self._cell[int(gridid)]
+        k = cell // self.index["cells_per_shard"]
+        return self._shard(variable, k)[cell - k * self.index["cells_per_shard"]]
+
+
+def show(output):
+    with open(os.path.join(output, INDEX)) as f:
+        index = json.load(f)
+    print(f"{output}: {index['format']} export of {index['forcing_dir']}, {index['ncells']} cells ({index['created']})")
+    for name, entry in sorted(index["variables"].items()):
+        periods = entry["periods"]
+        print(f"  {name:10s} {entry['stream']:14s} {entry['ntime']:8d} steps  {periods[0]['period']}..{periods[-1]['period']}"
+              f"  {len(entry.get('shards', [])) or 1} file(s)")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export AOI forcing as gridcell-major time series.")
+    parser.add_argument("--forcing-dir", help="AOI forcing directory (<experiment_root>/forcing)")
+    parser.add_argument("--output", help="Store directory (e.g. <experiment_root>/timeseries)")
+    parser.add_argument("--variables", nargs="+", help="Variables to export (default: all)")
+    parser.add_argument("--format", default="npy", choices=FORMATS,
+                        help="npy: memory-mappable shards; netcdf4: one chunked file per variable (default: npy)")
+    parser.add_argument("--cells-per-shard", type=int, default=CELLS_PER_SHARD,
+                        help=f"Cells per .npy shard (default: {CELLS_PER_SHARD})")
+    parser.add_argument("--memory-mb", type=int, default=MEMORY_MB,
+                        help=f"Time block buffered before writing, in MB (default: {MEMORY_MB})")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("FORCING_SERIAL_WORKERS", "4")),
+                        help="Reader processes (default: $FORCING_SERIAL_WORKERS or 4)")
+    parser.add_argument("--show", metavar="STORE", help="Print the index of an export and exit")
+    args = parser.parse_args()
+
+    if args.show:
+        show(args.show)
+        return
+    if not args.forcing_dir or not args.output:
+        parser.error("--forcing-dir and --output are required")
+    export_forcing(args.forcing_dir, args.output, args.variables, args.format, args.cells_per_shard,
+                   args.memory_mb, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Batch GeoTIFF export of TES variables, time steps and sub-domains.
+
+Non-interactive counterpart of Variable2Geotiff.py: every requested variable, time step
+and bounding box is written as <prefix><variable>[_t<step>][_<bbox>].tif. The scatter
+index of the mask file is built once (tes_scatter.py) and shared with the worker
+processes; each worker reads a run of consecutive time steps with one hyperslab,
+scatters the whole stack at once and writes its GeoTIFFs.
+
+--cog writes cloud-optimized GeoTIFFs (tiled, compressed, internal overview pyramid,
+nodata set) and --multiband one file per variable and box with a band per time step.
+
+Time steps are indices or Python-style ranges (start:stop[:step]); bounding boxes are
+in the x/y coordinates of the mask, optionally named (NAME=xmin,ymin,xmax,ymax).
+
+Example use:
+  python3 geotiff_export.py --mask mask.nc --data data.nc --variables GPP TSA --times 0:365 --workers 16
+  python3 geotiff_export.py --variables GPP --times 0 10 20 --bbox TN=-90.3,34.9,-81.6,36.7 --output-dir tif
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import netCDF4 as nc
+
+from tes_scatter import ScatterIndex
+
+DEFAULT_CRS = "EPSG:4326"
+TIME_CHUNK = 32  # consecutive time steps read and scattered together
+
+_INDEX = None
+
+
+def parse_times(specs, ntime):
+    """Sorted unique time indices from indices and start:stop[:step] ranges (negative counts from the end)."""
+    if not specs:
+        return list(range(ntime))
+    steps = set()
+    for spec in specs:
+        for part in str(spec).split(","):
+            if ":" in part:
+                fields = [int(f) if f else None for f in part.split(":")]
+                steps.update(range(ntime)[slice(*fields)])
+            else:
+                t = int(part)
+                if not -ntime <= t < ntime:
+                    raise ValueError(f"Time step {t} is outside 0..{ntime - 1}")
+                steps.add(t % ntime)
+    return sorted(steps)
+
+
+def parse_bbox(spec, number):
+    name, _, bounds = spec.rpartition("=")
+    values = [float(v) for v in bounds.split(",")]
+    if len(values) != 4:
+        raise ValueError(f"Bounding box {spec!r} is not xmin,ymin,xmax,ymax")
+    return name or f"bbox{number}", tuple(values)
+
+
+def bbox_window(index, bounds):
+    """Rows and columns (r0, r1, c0, c1; end exclusive) of the mask raster inside bounds."""
+    xmin, ymin, xmax, ymax = bounds
+    cols = np.flatnonzero((index.x >= xmin) & (index.x <= xmax))
+    rows = np.flatnonzero((index.y >= ymin) & (index.y <= ymax))
+    if cols.size == 0 or rows.size == 0:
+        raise ValueError(f"Bounding box {bounds} contains no cell of the mask raster")
+    return (int(rows[0]), int(rows[-1]) + 1, int(cols[0]), int(cols[-1]) + 1)
+
+
+def window_transform(index, window):
+    """GDAL geotransform of a window of the mask raster, north up."""
+    r0, r1, c0, c1 = window
+    x, y = index.x, index.y
+    x_res = abs(x[1] - x[0]) if x.size > 1 else 1.0
+    y_res = abs(y[1] - y[0]) if y.size > 1 else 1.0
+    top = max(y[r0], y[r1 - 1])
+    return (min(x[c0], x[c1 - 1]) - x_res / 2, x_res, 0.0, top + y_res / 2, 0.0, -y_res)
+
+
+def north_up(index, raster):
+    # the mask y axis usually increases with the row; GeoTIFF rows go from north to south
+    if index.y.size > 1 and index.y[-1] > index.y[0]:
+        return raster[..., ::-1, :]
+    return raster
+
+
+def _overview_factors(height, width, tile):
+    factors, f = [], 2
+    while max(height, width) / f >= tile / 2:
+        factors.append(f)
+        f *= 2
+    return factors
+
+
+def _profile(height, width, count, transform, opts):
+    from affine import Affine
+
+    dtype = np.dtype(opts["dtype"])
+    profile = {"driver": "GTiff", "height": height, "width": width, "count": count, "dtype": dtype.name,
+               "crs": opts["crs"], "transform": Affine.from_gdal(*transform), "nodata": opts["nodata"]}
+    if opts["cog"]:
+        profile.update(tiled=True, blockxsize=opts["tile"], blockysize=opts["tile"], compress=opts["compress"],
+                       predictor=3 if dtype.kind == "f" else 2, BIGTIFF="IF_SAFER")
+    return profile
+
+
+def open_geotiff(path, height, width, count, transform, opts):
+    """Output dataset; cloud-optimized outputs are staged in a tiled <path>.tmp.tif and laid out on close."""
+    import rasterio
+
+    target = path + ".tmp.tif" if opts["cog"] else path
+    return rasterio.open(target, "w", **_profile(height, width, count, transform, opts))
+
+
+def close_geotiff(dst, path, opts):
+    dst.close()
+    if not opts["cog"]:
+        return
+    import rasterio
+    from rasterio.enums import Resampling
+    from rasterio.shutil import copy as rio_copy
+
+    tmp = dst.name
+    predictor = 3 if np.dtype(opts["dtype"]).kind == "f" else 2
+    try:
+        # GDAL >= 3.1: the COG driver orders tiles and overviews for range reads
+        rio_copy(tmp, path, driver="COG", compress=opts["compress"], predictor=predictor,
+                 blocksize=opts["tile"], overview_resampling=opts["resampling"], BIGTIFF="IF_SAFER")
+    except Exception:
+        with rasterio.open(tmp, "r+") as src:
+            src.build_overviews(_overview_factors(src.height, src.width, opts["tile"]),
+                                Resampling[opts["resampling"]])
+        rio_copy(tmp, path, driver="GTiff", copy_src_overviews=True, tiled=True, blockxsize=opts["tile"],
+                 blockysize=opts["tile"], compress=opts["compress"], predictor=predictor, BIGTIFF="IF_SAFER")
+    os.remove(tmp)
+
+
+def write_band(dst, band, data, opts, step=None, time=None):
+    data = np.asarray(data, dtype=opts["dtype"])
+    if opts["nodata"] is not None and not np.isnan(opts["nodata"]):
+        data = np.where(np.isnan(data), opts["nodata"], data)
+    dst.write(np.ascontiguousarray(data), band)
+    if step is not None:
+        dst.set_band_description(band, f"t{step:04d}")
+        tags = {"time_step": step}
+        if time is not None:
+            tags["time"] = time
+        dst.update_tags(band, **tags)
+
+
+def write_geotiff(path, data, transform, opts, step=None, time=None):
+    dst = open_geotiff(path, data.shape[-2], data.shape[-1], 1, transform, opts)
+    write_band(dst, 1, data, opts, step, time)
+    close_geotiff(dst, path, opts)
+
+
+def output_name(output_dir, prefix, variable, step, bbox_name):
+    name = f"{prefix}{variable}"
+    if step is not None:
+        name += f"_t{step:04d}"
+    if bbox_name:
+        name += f"_{bbox_name}"
+    return os.path.join(output_dir, name + ".tif")
+
+
+def _init_worker(index):
+    global _INDEX
+    _INDEX = index
+
+
+def _read_stack(index, var, run):
+    if run is None:
+        return index.fill(index.cells(var[:]))[None]
+    return index.fill(index.cells(var[run[0]:run[-1] + 1]))
+
+
+def _times(src, steps):
+    if steps is None or "time" not in src.variables:
+        return [None] * (1 if steps is None else len(steps))
+    time = src.variables["time"]
+    units = getattr(time, "units", "")
+    return [f"{float(v):g} {units}".strip() for v in np.asarray(time[steps])]
+
+
+def export_chunk(data_path, variable, steps, bboxes, opts):
+    """Write the GeoTIFFs of one variable for a run of consecutive time steps (or None for 2D variables)."""
+    index = _INDEX
+    with nc.Dataset(data_path, "r") as src:
+        stack = _read_stack(index, src.variables[variable], steps)
+        times = _times(src, steps)
+    written = []
+    for i, step in enumerate([None] if steps is None else steps):
+        for bbox_name, window in bboxes:
+            r0, r1, c0, c1 = window
+            path = output_name(opts["output_dir"], opts["prefix"], variable, step, bbox_name)
+            write_geotiff(path, north_up(index, stack[i, r0:r1, c0:c1]), window_transform(index, window), opts,
+                          step, times[i])
+            written.append(path)
+    return written
+
+
+def export_multiband(data_path, variable, steps, bboxes, opts):
+    """One file per bounding box with a band per time step, filled run by run."""
+    if steps is None:
+        return export_chunk(data_path, variable, steps, bboxes, opts)
+    index = _INDEX
+    outputs = []
+    for bbox_name, window in bboxes:
+        r0, r1, c0, c1 = window
+        path = output_name(opts["output_dir"], opts["prefix"], variable, None, bbox_name)
+        outputs.append((path, window, open_geotiff(path, r1 - r0, c1 - c0, len(steps), window_transform(index, window), opts)))
+    band = 1
+    with nc.Dataset(data_path, "r") as src:
+        var = src.variables[variable]
+        for run in _chunks(steps, TIME_CHUNK):
+            stack = _read_stack(index, var, run)
+            times = _times(src, run)
+            for i, step in enumerate(run):
+                for _, (r0, r1, c0, c1), dst in outputs:
+                    write_band(dst, band + i, north_up(index, stack[i, r0:r1, c0:c1]), opts, step, times[i])
+            band += len(run)
+    for path, _, dst in outputs:
+        close_geotiff(dst, path, opts)
+    return [path for path, _, _ in outputs]
+
+
+def _chunks(steps, size):
+    run = []
+    for t in steps:
+        if run and (t != run[-1] + 1 or len(run) == size):
+            yield run
+            run = []
+        run.append(t)
+    if run:
+        yield run
+
+
+def plan_tasks(index, data_path, variables, time_specs, workers=1, multiband=False):
+    """(variable, run of consecutive steps or None) work items, small enough to keep every worker busy;
+    with multiband one item per variable holding all of its steps."""
+    tasks = []
+    with nc.Dataset(data_path, "r") as src:
+        for variable in variables:
+            if variable not in src.variables:
+                raise ValueError(f"Variable {variable} not found in {data_path}")
+            shape = src.variables[variable].shape
+            layout = 1 if shape[-1] == index.ncells else 2
+            if len(shape) == layout:
+                tasks.append((variable, None))
+            elif len(shape) == layout + 1:
+                steps = parse_times(time_specs, shape[0])
+                if multiband:
+                    tasks.append((variable, steps))
+                    continue
+                size = max(1, min(TIME_CHUNK, -(-len(steps) * len(variables) // workers)))
+                for run in _chunks(steps, size):
+                    tasks.append((variable, run))
+            else:
+                raise ValueError(f"{variable} has dims {src.variables[variable].dimensions}; "
+                                 "only (y, x) or (time, y, x) layouts are exported")
+    return tasks
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Export TES variables to GeoTIFF in batch.")
+    parser.add_argument("--mask", default="mask.nc", help="Mask NetCDF with x, y and gridID (default: mask.nc)")
+    parser.add_argument("--data", default="data.nc", help="Data NetCDF (default: data.nc)")
+    parser.add_argument("--variables", nargs="+", required=True, help="Variables to export")
+    parser.add_argument("--times", nargs="+", help="Time steps: indices and/or start:stop[:step] ranges (default: all)")
+    parser.add_argument("--bbox", action="append", default=[],
+                        help="[NAME=]xmin,ymin,xmax,ymax in mask coordinates; repeat for several (default: whole raster)")
+    parser.add_argument("--crs", default=DEFAULT_CRS, help=f"CRS of the mask x/y coordinates (default: {DEFAULT_CRS})")
+    parser.add_argument("--output-dir", default=".", help="Output directory (default: .)")
+    parser.add_argument("--prefix", default="", help="Output file name prefix")
+    parser.add_argument("--cog", action="store_true",
+                        help="Cloud-optimized GeoTIFF: tiled, compressed, with internal overviews")
+    parser.add_argument("--multiband", action="store_true",
+                        help="One file per variable and bounding box with a band per time step")
+    parser.add_argument("--compress", default="deflate", help="Compression of --cog outputs (default: deflate)")
+    parser.add_argument("--tile", type=int, default=512, help="Tile size of --cog outputs (default: 512)")
+    parser.add_argument("--overview-resampling", default="average",
+                        help="Resampling of the --cog overviews (default: average)")
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float64"], help="Output data type (default: float32)")
+    parser.add_argument("--nodata", type=float, default=float("nan"), help="Nodata value written off the grid (default: nan)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    index = ScatterIndex.from_mask(args.mask)
+    if args.bbox:
+        bboxes = []
+        for number, spec in enumerate(args.bbox):
+            name, bounds = parse_bbox(spec, number)
+            bboxes.append((name, bbox_window(index, bounds)))
+    else:
+        bboxes = [("", (0, index.shape[0], 0, index.shape[1]))]
+    tasks = plan_tasks(index, args.data, args.variables, args.times, args.workers, args.multiband)
+    os.makedirs(args.output_dir, exist_ok=True)
+    opts = {"crs": args.crs, "output_dir": args.output_dir, "prefix": args.prefix, "cog": args.cog,
+            "compress": args.compress, "tile": args.tile, "resampling": args.overview_resampling,
+            "dtype": args.dtype, "nodata": args.nodata}
+    export = export_multiband if args.multiband else export_chunk
+    print(f"{len(tasks)} chunks of {', '.join(args.variables)} x {len(bboxes)} bounding boxes, {args.workers} workers")
+
+    written = 0
+    if args.workers <= 1:
+        _init_worker(index)
+        for variable, steps in tasks:
+            written += len(export(args.data, variable, steps, bboxes, opts))
+    else:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker, initargs=(index,)) as executor:
+            futures = [executor.submit(export, args.data, variable, steps, bboxes, opts) for variable, steps in tasks]
+            for fut in as_completed(futures):
+                paths = fut.result()
+                written += len(paths)
+                print(f"wrote {paths[0]}" + (f" ... ({len(paths)} files)" if len(paths) > 1 else ""))
+    print(f"{written} GeoTIFFs written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
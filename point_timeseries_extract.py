@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""Extract forcing time series at point sites straight from the entire-domain forcing files.
+
+For single-site AOIs (knox_xcyc.csv, helene_xcyc.csv) or a list of flux towers, the AOI
+pipeline would subset every forcing file into a 1-cell NetCDF. Here the sites are
+resolved once to their nearest TES gridcell (a KD-tree over the domain xc/yc, as in
+TES_AOI_domainGEN.py), and only the columns of those cells are read from each file:
+
+  - classic (CDF-1/2/5) files: the byte offsets come from the forcing catalog
+    (forcing_catalog.py) and the site values are gathered through a memory map, so only
+    the pages holding them are read - no netCDF library and no full-variable reads;
+  - netCDF-4 files: a netCDF4 hyperslab per site column.
+
+Both paths return the same unpacked values: scale_factor/add_offset applied (the catalog
+records them with _FillValue/missing_value) and fill values as NaN.
+
+Files are processed in parallel by worker processes (--workers), in chunks. The periods
+are concatenated per variable, and each site gets one time series file:
+<output_dir>/<site>.csv (time, date and one column per variable; one file per stream
+when the streams have different time axes) or <output_dir>/<site>.nc, plus sites.csv
+with the gridcell of every site and the time units.
+
+Sites files are csv with a header: xc, yc (lon, lat) as in <AOI>_xcyc.csv, xc_LCC,
+yc_LCC for *_xcyc_lcc.csv, or gridID; an optional name/site column names the sites
+(a repeated name is suffixed with the site's gridID).
+
+Example use:
+  python3 point_timeseries_extract.py --config aoi_knox_config.json
+  python3 point_timeseries_extract.py --domain <domain.nc> --forcing-dir <forcing> --sites towers.csv --output-dir towers --workers 32
+  python3 point_timeseries_extract.py --domain <domain.nc> --forcing-dir <forcing> --sites knox_xcyc.csv --periods 1980-01 1989-12 --format netcdf
+"""
+
+import argparse
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+
+import numpy as np
+import netCDF4 as nc
+import pandas as pd
+from scipy.spatial import cKDTree
+
+from forcing_catalog import catalog_files, unpack_values
+
+FILES_PER_TASK = 16
+NAME_COLUMNS = ("name", "site", "site_id", "id")
+
+
+class Site:
+    def __init__(self, name, gridid, index, x, y, cell_x, cell_y):
+        self.name = name
+        self.gridid = int(gridid)
+        self.index = int(index)  # position in the 1D domain
+        self.x, self.y = float(x), float(y)  # requested location
+        self.cell_x, self.cell_y = float(cell_x), float(cell_y)  # centre of the gridcell (xc, yc)
+
+    @property
+    def distance(self):
+        return float(np.hypot(self.x - self.cell_x, self.y - self.cell_y))
+
+
+def read_sites(sites_file):
+    """(names, kind, coordinates) of a sites csv; kind is 'xcyc', 'lcc' or 'gridID'."""
+    df = pd.read_csv(sites_file, sep=",", skipinitialspace=True, engine="python")
+    df.columns = [str(c).strip() for c in df.columns]
+    lower = {c.lower(): c for c in df.columns}
+    aoi = os.path.basename(sites_file).split("_")[0]
+    name_col = next((lower[c] for c in NAME_COLUMNS if c in lower), None)
+    if name_col is not None:
+        names = [str(n).strip() for n in df[name_col]]
+    else:
+        names = [aoi] if len(df) == 1 else [f"{aoi}{k + 1:0{len(str(len(df)))}d}" for k in range(len(df))]
+    if "gridid" in lower:
+        return names, "gridID", df[lower["gridid"]].to_numpy(dtype=np.int64)
+    if "xc_lcc" in lower and "yc_lcc" in lower:
+        return names, "lcc", df[[lower["xc_lcc"], lower["yc_lcc"]]].to_numpy(dtype=np.float64)
+    data = [c for c in df.columns if c != name_col]
+    if sites_file.endswith("xcyc_lcc.csv"):
+        return names, "lcc", df[data[:2]].to_numpy(dtype=np.float64)
+    return names, "xcyc", df[data[:2]].to_numpy(dtype=np.float64)
+
+
+def resolve_sites(domain_file, sites_file):
+    """Nearest TES gridcell of every site (KD-tree over the domain xc/yc or xc_LCC/yc_LCC)."""
+    names, kind, coords = read_sites(sites_file)
+    with nc.Dataset(domain_file, "r") as src:
+        gridid = np.asarray(src["gridID"][:]).reshape(-1).astype(np.int64)
+        xc = np.asarray(src["xc"][:], dtype=np.float64).reshape(-1)
+        yc = np.asarray(src["yc"][:], dtype=np.float64).reshape(-1)
+        if kind == "lcc":
+            px = np.asarray(src["xc_LCC"][:], dtype=np.float64).reshape(-1)
+            py = np.asarray(src["yc_LCC"][:], dtype=np.float64).reshape(-1)
+        else:
+            px, py = xc, yc
+    sites = []
+    if kind == "gridID":
+        order = np.argsort(gridid)
+        pos = np.searchsorted(gridid, coords, sorter=order)
+        for name, g, p in zip(names, coords, pos):
+            if p >= gridid.size or gridid[order[p]] != g:
+                print(f"site {name}: gridID {g} is not a land gridcell of the domain and is removed")
+                continue
+            i = order[p]
+            sites.append(Site(name, g, i, xc[i], yc[i], xc[i], yc[i]))
+        return _unique_names(sites)
+    tree = cKDTree(np.column_stack([px, py]))
+    _, idx = tree.query(coords, k=1)
+    for name, (x, y), i in zip(names, coords, idx):
+        if not (px.min() <= x <= px.max() and py.min() <= y <= py.max()):
+            print(f"site {name} ({x},{y}) is out of the TES domain and is removed")
+            continue
+        sites.append(Site(name, gridid[i], i, x, y, px[i], py[i]))
+    return _unique_names(sites)
+
+
+def _unique_names(sites):
+    # every site writes <name>.csv/.nc: repeated names get their gridID (and a count if still repeated)
+    counts = Counter(site.name for site in sites)
+    seen = Counter()
+    for site in sites:
+        if counts[site.name] < 2:
+            continue
+        name = f"{site.name}_{site.gridid}"
+        seen[name] += 1
+        if seen[name] > 1:
+            name += f"_{seen[name]}"
+        print(f"site {site.name}: name used by {counts[site.name]} sites, written as {name}")
+        site.name = name
+    return sites
+
+
+def _recsize(variables):
+    # bytes per record of a classic file (a single record variable is not padded)
+    record = [v for v in variables.values() if v["record"]]
+    if len(record) == 1:
+        return int(np.prod(record[0]["shape"][1:], dtype=np.int64)) * np.dtype(record[0]["dtype"]).itemsize
+    return sum(v["vsize"] for v in record)
+
+
+def gather_classic(path, var, recsize, columns):
+    """(time, len(columns)) values of a (time, ..., cells) classic variable through a memory map."""
+    dtype = np.dtype(var["dtype"])
+    ntime = var["shape"][0]
+    ncells = int(np.prod(var["shape"][1:], dtype=np.int64))
+    stride = recsize if var["record"] else ncells * dtype.itemsize
+    offsets = var["offset"] + np.arange(ntime, dtype=np.int64)[:, None] * stride \
+        + np.asarray(columns, dtype=np.int64)[None, :] * dtype.itemsize
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    raw = mm[offsets[..., None] + np.arange(dtype.itemsize)]
+    return raw.reshape(-1).view(dtype).reshape(offsets.shape).astype(dtype.newbyteorder("="))
+
+
+def _gather_netcdf(path, variable, columns):
+    # unpacked by netCDF4, fill/missing values as NaN like unpack_values on the classic path
+    with nc.Dataset(path, "r") as src:
+        var = src[variable]
+        lead = (slice(None),) + (0,) * (var.ndim - 2)
+        if var.ndim > 2 and any(n != 1 for n in var.shape[1:-1]):
+            data = var[:].reshape(var.shape[0], -1)[:, columns]
+        else:
+            data = np.ma.stack([var[lead + (int(c),)] for c in columns], axis=1)
+        if data.dtype.kind != "f":
+            data = data.astype(np.float64)
+        return np.ma.filled(data, np.nan)
+
+
+def _file_series(path, variables, columns, fmt):
+    """{variable: (time, nsites)} and the time values of one forcing file."""
+    if fmt["offsets"]:
+        recsize = _recsize(fmt["variables"])
+        values = {v: unpack_values(gather_classic(path, fmt["variables"][v], recsize, columns), fmt["variables"][v])
+                  for v in variables}
+        times = gather_classic(path, fmt["variables"]["time"], recsize, [0])[:, 0].astype(np.float64)
+        with_units = fmt["time_units"], fmt.get("calendar", "standard")
+    else:
+        values = {v: _gather_netcdf(path, v, columns) for v in variables}
+        with nc.Dataset(path, "r") as src:
+            times = np.asarray(src["time"][:], dtype=np.float64)
+            with_units = getattr(src["time"], "units", ""), getattr(src["time"], "calendar", "standard")
+    return values, times, with_units
+
+
+def extract_files(tasks):
+    """Worker: [(path, variables, columns, fmt)] -> [(path, values, times, (units, calendar))]."""
+    return [(path,) + _file_series(path, variables, columns, fmt) for path, variables, columns, fmt in tasks]
+
+
+def _columns(forcing_dir, row, gridids, cache):
+    # column of every site in a file; files with the same gridID checksum share the lookup
+    key = row["gridid_sha"] or row["path"]
+    if key not in cache:
+        with nc.Dataset(os.path.join(forcing_dir, row["path"]), "r") as src:
+            file_ids = np.asarray(src["gridID"][:]).reshape(-1).astype(np.int64)
+        order = np.argsort(file_ids)
+        pos = np.minimum(np.searchsorted(file_ids, gridids, sorter=order), file_ids.size - 1)
+        found = file_ids[order[pos]] == gridids
+        if not found.all():
+            raise ValueError(f"{row['path']}: gridIDs {gridids[~found].tolist()} are missing")
+        cache[key] = order[pos]
+    return cache[key]
+
+
+def plan_files(rows, variables=None, streams=None, periods=None):
+    """Catalog rows to read, with their data variables, in period order."""
+    selected = []
+    for row in sorted(rows, key=lambda r: (r["stream"], r["period"], r["file"])):
+        if streams and row["stream"] not in streams:
+            continue
+        if periods and row["period"] and not (periods[0] <= row["period"] <= periods[1]):
+            continue
+        cell_dim = "ni" if "ni" in row["dims"] else "gridcell"
+        names = [n for n, v in row["variables"].items()
+                 if n != "time" and v["dims"][:1] == ["time"] and v["dims"][-1] == cell_dim
+                 and (not variables or n in variables)]
+        if names:
+            selected.append((row, names))
+    return selected
+
+
+def extract(forcing_dir, sites, variables=None, streams=None, periods=None, workers=1):
+    """{variable: (stream, times, units, calendar, (ntime, nsites) values)} concatenated over the periods."""
+    files = plan_files(catalog_files(forcing_dir), variables, streams, periods)
+    if not files:
+        raise ValueError(f"No forcing files selected under {forcing_dir}")
+    gridids = np.array([s.gridid for s in sites], dtype=np.int64)
+    lookup, tasks, stream_of = {}, [], {}
+    for row, names in files:
+        offsets = row["format"].startswith("CDF") and all(row["variables"][n]["offset"] is not None
+                                                         for n in names + ["time"])
+        fmt = {"offsets": offsets, "variables": row["variables"], "time_units": row["time_units"]}
+        tasks.append((os.path.join(forcing_dir, row["path"]), names, _columns(forcing_dir, row, gridids, lookup), fmt))
+        for n in names:
+            stream_of.setdefault(n, row["stream"])
+    size = max(1, min(FILES_PER_TASK, -(-len(tasks) // (4 * workers))))
+    chunks = [tasks[i:i + size] for i in range(0, len(tasks), size)]
+    print(f"[points] {len(sites)} sites, {len(tasks)} files in {len(chunks)} chunks, {workers} workers")
+
+    results = {}
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for done in executor.map(extract_files, chunks):
+                results.update({r[0]: r[1:] for r in done})
+    else:
+        for chunk in chunks:
+            results.update({r[0]: r[1:] for r in extract_files(chunk)})
+
+    series = {}
+    for path, names, _, _ in tasks:
+        values, times, (units, calendar) = results[path]
+        for n in names:
+            entry = series.setdefault(n, {"stream": stream_of[n], "units": units, "calendar": calendar,
+                                          "times": [], "values": []})
+            if units != entry["units"]:
+                times = np.asarray(nc.date2num(nc.num2date(times, units, calendar), entry["units"], calendar))
+            entry["times"].append(np.asarray(times, dtype=np.float64))
+            entry["values"].append(values[n])
+    return {n: (e["stream"], np.concatenate(e["times"]), e["units"], e["calendar"], np.concatenate(e["values"]))
+            for n, e in series.items()}
+
+
+def _time_groups(series):
+    """Variables grouped by identical time axes: one group when all streams share the axis."""
+    groups = []
+    for name in sorted(series):
+        times = series[name][1]
+        for group in groups:
+            if series[group[0]][1].shape == times.shape and np.array_equal(series[group[0]][1], times):
+                group.append(name)
+                break
+        else:
+            groups.append([name])
+    return groups
+
+
+def _dates(times, units, calendar):
+    try:
+        return [d.isoformat() for d in nc.num2date(times, units, calendar)]
+    except (ValueError, TypeError):
+        return [""] * len(times)
+
+
+def write_csv(output_dir, sites, series):
+    groups = _time_groups(series)
+    written = []
+    for k, site in enumerate(sites):
+        for group in groups:
+            stream, times, units, calendar, _ = series[group[0]]
+            df = pd.DataFrame({"time": times, "date": _dates(times, units, calendar)})
+            for name in group:
+                df[name] = series[name][4][:, k]
+            suffix = "" if len(groups) == 1 else "_" + stream
+            path = os.path.join(output_dir, f"{site.name}{suffix}.csv")
+            df.to_csv(path, index=False)
+            written.append(path)
+    return written
+
+
+def write_site_table(output_dir, sites, series):
+    """sites.csv: the gridcell of every site and the time units of the outputs."""
+    first = series[sorted(series)[0]]
+    rows = [{"name": s.name, "gridID": s.gridid, "x": s.x, "y": s.y, "cell_xc": s.cell_x, "cell_yc": s.cell_y,
+             "distance": s.distance, "time_units": first[2], "calendar": first[3]} for s in sites]
+    path = os.path.join(output_dir, "sites.csv")
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+def write_netcdf(output_dir, sites, series):
+    groups = _time_groups(series)
+    written = []
+    for k, site in enumerate(sites):
+        path = os.path.join(output_dir, f"{site.name}.nc")
+        if os.path.exists(path):
+            os.remove(path)
+        with nc.Dataset(path, "w", format="NETCDF3_64BIT") as dst:
+            dst.setncatts({"site": site.name, "gridID": site.gridid, "site_x": site.x, "site_y": site.y,
+                           "cell_xc": site.cell_x, "cell_yc": site.cell_y,
+                           "title": "forcing time series extracted by point_timeseries_extract.py"})
+            for g, group in enumerate(groups):
+                stream, times, units, calendar, _ = series[group[0]]
+                tdim = "time" if len(groups) == 1 else f"time_{stream}"
+                dst.createDimension(tdim, times.size)
+                tvar = dst.createVariable(tdim, "f8", (tdim,))
+                tvar.setncatts({"units": units, "calendar": calendar})
+                tvar[:] = times
+                for name in group:
+                    values = series[name][4][:, k]
+                    dst.createVariable(name, values.dtype, (tdim,))[:] = values
+        written.append(path)
+    return written
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Extract forcing time series at point sites.")
+    parser.add_argument("--config", help="Experiment config: source.base_domain_file, source.forcing_dir, aoi_points")
+    parser.add_argument("--domain", help="Entire-domain 1D domain (default: source.base_domain_file)")
+    parser.add_argument("--forcing-dir", help="Entire-domain forcing tree (default: source.forcing_dir)")
+    parser.add_argument("--sites", help="Sites csv (xc,yc | xc_LCC,yc_LCC | gridID [, name]) (default: aoi_points)")
+    parser.add_argument("--output-dir", help="Output directory (default: <experiment_root>/point_timeseries or .)")
+    parser.add_argument("--format", default="csv", choices=["csv", "netcdf"], help="Output format (default: csv)")
+    parser.add_argument("--variables", nargs="+", help="Variables to extract (default: all)")
+    parser.add_argument("--streams", nargs="+", help="Forcing streams (sub-directories) to read (default: all)")
+    parser.add_argument("--periods", nargs=2, metavar=("FIRST", "LAST"), help="Period range, e.g. 1980-01 1989-12")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (default: all CPUs)")
+    args = parser.parse_args()
+
+    cfg = {}
+    if args.config:
+        from aoi_pipeline import load_config
+        cfg = load_config(args.config)
+    src = cfg.get("source", {})
+    domain = args.domain or src.get("base_domain_file")
+    forcing_dir = args.forcing_dir or src.get("forcing_dir")
+    sites_file = args.sites
+    if not sites_file and cfg.get("aoi_points"):
+        sites_file = os.path.join(os.path.expanduser(cfg["aoi_points"]["dir"]), cfg["aoi_points"]["file"])
+    if not (domain and forcing_dir and sites_file):
+        parser.error("--domain, --forcing-dir and --sites are required without --config")
+    output_dir = args.output_dir or (os.path.join(os.path.expanduser(cfg["experiment_root"]), "point_timeseries")
+                                     if cfg.get("experiment_root") else ".")
+
+    start = time()
+    sites = resolve_sites(os.path.expanduser(domain), sites_file)
+    if not sites:
+        raise SystemExit("No site inside the TES domain")
+    for site in sites:
+        print(f"site {site.name}: gridID {site.gridid} at ({site.cell_x:.4f}, {site.cell_y:.4f}), "
+              f"{site.distance:.4f} from ({site.x}, {site.y})")
+    series = extract(os.path.expanduser(forcing_dir), sites, args.variables, args.streams, args.periods, args.workers)
+    os.makedirs(output_dir, exist_ok=True)
+    written = (write_csv if args.format == "csv" else write_netcdf)(output_dir, sites, series)
+    write_site_table(output_dir, sites, series)
+    print(f"[points] {len(series)} variables for {len(sites)} sites -> {len(written)} files in {output_dir} "
+          f"({time() - start:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
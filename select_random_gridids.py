@@ -2,15 +2,17 @@
 
 import argparse
 import os
-from typing import Optional, Dict, Any, Tuple
+from typing import Optional, Dict, Any, List, Tuple
 
 import numpy as np
 from netCDF4 import Dataset
 
 
-def parse_args() -> argparse.Namespace:
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
     parser = argparse.ArgumentParser(
-        description="Randomly select a percentage of gridIDs from a domain NetCDF and write them to a new NetCDF file. If --out is not specified, the output name is constructed as <caseName><percent>pct_gridID.nc in --output-dir."
+        description="Randomly select a percentage of gridIDs from a domain NetCDF and write them to a new NetCDF file. If --out is not specified, the output name is constructed as <caseName><percent>pct_gridID.nc in --output-dir. "
+        "Several percents give a nested family (1%% within 5%% within 10%%) drawn from one permutation; --ensemble K writes K independently seeded families (<caseName><percent>pctE<k>_gridID.nc). "
+        "--stratify draws per-stratum quotas over dominant PFT, soil texture and/or spatial blocks instead of a uniform sample."
     )
     parser.add_argument(
         "--domain",
@@ -21,7 +23,15 @@ def parse_args() -> argparse.Namespace:
         "--percent",
         required=True,
         type=float,
-        help="Percentage of gridcells to sample. If <1, treated as a fraction; otherwise treated as percent in [0,100].",
+        nargs="+",
+        help="Percentage of gridcells to sample. If <1, treated as a fraction; otherwise treated as percent in [0,100]. "
+        "Several values produce nested samples, each contained in the next larger one.",
+    )
+    parser.add_argument(
+        "--ensemble",
+        type=int,
+        default=1,
+        help="Number of independent ensemble members; member seeds are spawned from --seed (default: 1).",
     )
     parser.add_argument(
         "--case-name",
@@ -31,7 +41,7 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument(
         "--out",
         required=False,
-        help="Output NetCDF path to write selected gridIDs.",
+        help="Output NetCDF path to write selected gridIDs (single --percent and --ensemble 1 only).",
     )
     parser.add_argument(
         "--output-dir",
@@ -49,12 +59,47 @@ def parse_args() -> argparse.Namespace:
         default="/gpfs/wolf2/cades/cli185/proj-shared/wangd/kiloCraft/uELM_TES_experiment/TNdemo_gridID.nc",
         help="Optional NetCDF file whose variable/global attributes to emulate (defaults to TNdemo_gridID.nc).",
     )
+    parser.add_argument(
+        "--stratify",
+        nargs="+",
+        choices=["pft", "soil", "block"],
+        help="Stratified sampling: dominant natural PFT (PCT_NAT_PFT), soil texture class (PCT_SAND/PCT_CLAY) "
+        "and/or spatial blocks of the LCC grid; strata are the combinations of the chosen fields.",
+    )
+    parser.add_argument(
+        "--surfdata",
+        help="Entire-domain surfdata NetCDF providing the 'pft' and 'soil' fields (matched by gridID).",
+    )
+    parser.add_argument(
+        "--allocation",
+        choices=["proportional", "sqrt", "equal"],
+        default="proportional",
+        help="Per-stratum quota: proportional to stratum size, to its square root, or equal (default: proportional).",
+    )
+    parser.add_argument(
+        "--min-per-stratum",
+        type=int,
+        default=1,
+        help="Cells taken from every stratum before the quotas apply (default: 1).",
+    )
+    parser.add_argument(
+        "--block-km",
+        type=float,
+        default=100.0,
+        help="Edge length of the spatial blocks for --stratify block (default: 100 km).",
+    )
+    parser.add_argument(
+        "--soil-layers",
+        type=int,
+        default=3,
+        help="Top soil layers averaged for the texture class (default: 3).",
+    )
     parser.add_argument(
         "--no-sort",
         action="store_true",
         help="Do not sort selected gridIDs; keep random order.",
     )
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 def _format_percent_token(percent: float) -> str:
@@ -66,8 +111,11 @@ def _format_percent_token(percent: float) -> str:
     return f"{pct_rounded}pct"
 
 
-def _derive_output_path(case_name: str, percent: float, output_dir: str) -> str:
+def _derive_output_path(case_name: str, percent: float, output_dir: str, member: Optional[int] = None) -> str:
     token = _format_percent_token(percent)
+    # the AOI name is everything before the first '_', so the member tag must not add one
+    if member is not None:
+        token += f"E{member:02d}"
     base = f"{case_name}{token}_gridID.nc"
     return os.path.join(output_dir or ".", base)
 
@@ -126,6 +174,121 @@ def select_indices(num_total: int, num_select: int, seed: Optional[int]) -> np.n
     return rng.choice(num_total, size=num_select, replace=False)
 
 
+def nested_indices(num_total: int, sizes: List[int], rng: np.random.Generator) -> List[np.ndarray]:
+    """
+    Prefixes of a single permutation: every sample contains all smaller ones.
+    """
+    perm = rng.permutation(num_total)
+    return [perm[:k] for k in sizes]
+
+
+def member_generators(seed: Optional[int], members: int) -> Tuple[List[np.random.Generator], np.random.SeedSequence]:
+    """
+    Independent generators for ensemble members, spawned from one SeedSequence.
+    """
+    seq = np.random.SeedSequence(seed)
+    return [np.random.default_rng(child) for child in seq.spawn(members)], seq
+
+
+SOIL_CLASSES = ("medium", "coarse", "fine", "silty")
+SURFDATA_CHUNK = 1 << 20  # gridcells per read of the surfdata fields
+
+
+def _soil_texture_class(sand: np.ndarray, clay: np.ndarray) -> np.ndarray:
+    """
+    Coarse grouping of the USDA texture triangle: fine (clay >= 40), coarse (sand >= 70),
+    silty (silt >= 50), medium otherwise; indices into SOIL_CLASSES.
+    """
+    silt = 100.0 - sand - clay
+    return np.select([clay >= 40.0, sand >= 70.0, silt >= 50.0], [2, 1, 3], default=0)
+
+
+def read_strata_fields(
+    domain_path: str,
+    surfdata_path: Optional[str],
+    grid_ids: np.ndarray,
+    stratify: List[str],
+    block_km: float,
+    soil_layers: int,
+) -> Dict[str, np.ndarray]:
+    """
+    One integer label per domain cell for every requested stratification field.
+    """
+    fields = {}
+    if "block" in stratify:
+        with Dataset(domain_path, mode="r") as ds:
+            x = np.asarray(ds.variables["xc_LCC"][:]).reshape(-1)
+            y = np.asarray(ds.variables["yc_LCC"][:]).reshape(-1)
+        size = block_km * 1000.0
+        bx = np.floor((x - x.min()) / size).astype(np.int64)
+        by = np.floor((y - y.min()) / size).astype(np.int64)
+        fields["block"] = by * (bx.max() + 1) + bx
+
+    wanted = [f for f in ("pft", "soil") if f in stratify]
+    if wanted:
+        if not surfdata_path:
+            raise ValueError("--surfdata is required to stratify by " + " and ".join(wanted))
+        with Dataset(surfdata_path, mode="r") as ds:
+            sgrid = np.asarray(ds.variables["gridID"][:]).reshape(-1)
+            ncell = sgrid.shape[0]
+            labels = {f: np.empty(ncell, dtype=np.int64) for f in wanted}
+            for start in range(0, ncell, SURFDATA_CHUNK):
+                end = min(start + SURFDATA_CHUNK, ncell)
+                if "pft" in labels:
+                    pct = np.ma.filled(ds.variables["PCT_NAT_PFT"][:, start:end], 0.0)
+                    labels["pft"][start:end] = np.argmax(pct, axis=0)
+                if "soil" in labels:
+                    sand = np.ma.filled(ds.variables["PCT_SAND"][:soil_layers, start:end], np.nan)
+                    clay = np.ma.filled(ds.variables["PCT_CLAY"][:soil_layers, start:end], np.nan)
+                    labels["soil"][start:end] = _soil_texture_class(np.nanmean(sand, axis=0), np.nanmean(clay, axis=0))
+        # surfdata gridcells are matched to the domain cells through gridID
+        order = np.argsort(sgrid)
+        pos = order[np.clip(np.searchsorted(sgrid, grid_ids, sorter=order), 0, ncell - 1)]
+        if not np.array_equal(sgrid[pos], grid_ids):
+            raise ValueError("Some domain gridIDs are missing from the surfdata file.")
+        for f in wanted:
+            fields[f] = labels[f][pos]
+    return fields
+
+
+def stratum_ids(fields: Dict[str, np.ndarray]) -> np.ndarray:
+    """
+    Combine the per-field labels into one stratum index per cell.
+    """
+    stacked = np.stack([fields[f] for f in sorted(fields)], axis=1)
+    _, inverse = np.unique(stacked, axis=0, return_inverse=True)
+    return inverse.reshape(-1)
+
+
+def stratified_order(
+    strata: np.ndarray, rng: np.random.Generator, allocation: str, min_per_stratum: int
+) -> np.ndarray:
+    """
+    A random ordering of all cells whose every prefix meets the per-stratum quotas.
+
+    Cells are shuffled within their stratum and the j-th cell of stratum h gets the key
+    (j + u) / w_h, with w_h the allocation weight (stratum size, its square root or 1). Sorting by
+    key interleaves the strata so the first k cells hold about k * w_h / sum(w) cells of each stratum
+    (capped by its size); the first min_per_stratum cells of every stratum come before all others.
+    Taking prefixes of one ordering keeps samples of several sizes nested.
+    """
+    num = strata.shape[0]
+    counts = np.bincount(strata)
+    perm = rng.permutation(num)
+    s_perm = strata[perm]
+    by_stratum = np.argsort(s_perm, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    ranks = np.empty(num, dtype=np.int64)
+    ranks[by_stratum] = np.arange(num) - starts[s_perm[by_stratum]]
+
+    weights = {"proportional": counts, "sqrt": np.sqrt(counts), "equal": np.ones_like(counts)}[allocation]
+    jitter = rng.random(num)
+    key = (ranks + jitter) / weights[s_perm]
+    guaranteed = ranks < min_per_stratum
+    key = np.where(guaranteed, ranks + jitter, key)
+    return perm[np.lexsort((key, ~guaranteed))]
+
+
 def write_output(
     out_path: str,
     selected_grid_ids: np.ndarray,
@@ -133,6 +296,7 @@ def write_output(
     like_global_attrs: Optional[Dict[str, Any]],
     fallback_var_attrs: Optional[Dict[str, Any]],
     title_annotation: str,
+    extra_global_attrs: Optional[Dict[str, Any]] = None,
 ) -> None:
     os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
     ni = int(selected_grid_ids.shape[0])
@@ -162,6 +326,10 @@ def write_output(
                 except Exception:
                     pass
 
+        # Sampling provenance (nesting, ensemble member, seed)
+        for k, v in (extra_global_attrs or {}).items():
+            setattr(ds_out, k, v)
+
         # Ensure a meaningful title is present/updated
         try:
             prev_title = getattr(ds_out, "title", "")
@@ -171,12 +339,99 @@ def write_output(
             pass
 
 
-def main() -> None:
-    args = parse_args()
-
-    grid_ids, domain_var_attrs, _ = read_gridids(args.domain)
+def write_families(
+    args: argparse.Namespace,
+    grid_ids: np.ndarray,
+    domain_var_attrs: Dict[str, Any],
+    strata: Optional[np.ndarray] = None,
+) -> None:
+    """
+    Nested (several --percent), ensemble (--ensemble K) and/or stratified samples from one domain read.
+    """
+    total = grid_ids.shape[0]
+    percents = sorted(set(args.percent), key=lambda p: compute_sample_size(total, p))
+    sizes = [compute_sample_size(total, p) for p in percents]
+    like_var_attrs, like_global_attrs = read_like_attrs(args.like)
+    generators, seq = member_generators(args.seed, args.ensemble)
+    num_strata = int(strata.max()) + 1 if strata is not None else 0
+
+    for m, rng in enumerate(generators):
+        member = m if args.ensemble > 1 else None
+        if args.out:
+            paths = [args.out]
+        else:
+            paths = [_derive_output_path(args.case_name, p, args.output_dir, member) for p in percents]
+        if strata is not None:
+            order = stratified_order(strata, rng, args.allocation, args.min_per_stratum)
+            samples = [order[:k] for k in sizes]
+        else:
+            samples = nested_indices(total, sizes, rng)
+        for i, indices in enumerate(samples):
+            selected = grid_ids[indices]
+            if not args.no_sort:
+                selected = np.sort(selected)
+            attrs = {
+                "sample_size": sizes[i],
+                "sample_total": total,
+                "sample_percent": 100.0 * sizes[i] / total,
+                "sample_domain": os.path.basename(args.domain),
+                "nested_family": ",".join(os.path.basename(p) for p in paths),
+                "nested_within": ",".join(os.path.basename(p) for p in paths[i + 1:]),
+                "nested_contains": ",".join(os.path.basename(p) for p in paths[:i]),
+                "seed_entropy": str(seq.entropy),
+            }
+            if member is not None:
+                attrs.update({"ensemble_member": member, "ensemble_size": args.ensemble,
+                              "seed_spawn_key": member})
+            covered = 0
+            if strata is not None:
+                covered = int(np.count_nonzero(np.bincount(strata[indices], minlength=num_strata)))
+                attrs.update({"stratify_by": ",".join(sorted(args.stratify)), "allocation": args.allocation,
+                              "min_per_stratum": args.min_per_stratum, "strata_total": num_strata,
+                              "strata_covered": covered})
+                if "block" in args.stratify:
+                    attrs["block_km"] = args.block_km
+            title_annotation = (
+                f"{'Stratified' if strata is not None else 'Random'} selection of {sizes[i]}/{total} gridIDs ({attrs['sample_percent']:.3f}%) "
+                f"from {os.path.basename(args.domain)}"
+                + (f", nested in {os.path.basename(paths[i + 1])}" if i + 1 < len(paths) else "")
+                + (f", ensemble member {member}/{args.ensemble}" if member is not None else "")
+            )
+            write_output(
+                out_path=paths[i],
+                selected_grid_ids=selected,
+                like_var_attrs=like_var_attrs,
+                like_global_attrs=like_global_attrs,
+                fallback_var_attrs=domain_var_attrs,
+                title_annotation=title_annotation,
+                extra_global_attrs=attrs,
+            )
+            print(f"{paths[i]}: {sizes[i]} gridIDs"
+                  + (f", {covered}/{num_strata} strata" if strata is not None else ""))
+
+
+def main(argv: Optional[List[str]] = None, gridids_reader=read_gridids, strata_reader=read_strata_fields) -> None:
+    """
+    The readers default to reading the files; aoi_service.py passes readers backed by its loaded domain.
+    """
+    args = parse_args(argv)
+    if args.ensemble < 1:
+        raise ValueError("--ensemble must be >= 1.")
+    if args.out and (len(args.percent) > 1 or args.ensemble > 1):
+        raise ValueError("--out names a single file; use --case-name/--output-dir for nested or ensemble samples.")
+
+    grid_ids, domain_var_attrs, _ = gridids_reader(args.domain)
+    if args.stratify:
+        fields = strata_reader(args.domain, args.surfdata, grid_ids, args.stratify, args.block_km, args.soil_layers)
+        write_families(args, grid_ids, domain_var_attrs, strata=stratum_ids(fields))
+        return
+    if len(args.percent) > 1 or args.ensemble > 1:
+        write_families(args, grid_ids, domain_var_attrs)
+        return
+
+    percent = args.percent[0]
     total = grid_ids.shape[0]
-    num_select = compute_sample_size(total, args.percent)
+    num_select = compute_sample_size(total, percent)
     indices = select_indices(total, num_select, args.seed)
     selected = grid_ids[indices]
 
@@ -185,7 +440,7 @@ def main() -> None:
 
     like_var_attrs, like_global_attrs = read_like_attrs(args.like)
 
-    out_path = args.out if args.out else _derive_output_path(args.case_name, args.percent, args.output_dir)
+    out_path = args.out if args.out else _derive_output_path(args.case_name, percent, args.output_dir)
 
     title_annotation = (
         f"Random selection of {num_select}/{total} gridIDs "
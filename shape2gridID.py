@@ -1,89 +1,183 @@
 
 ### This file uses a shapefile (GIS) to create a list of gridIDs from a large domain
-### These gridIDs are used by kiloCraft to create user-defined domain/surfdata/forcing for ELM simulations 
+### These gridIDs are used by kiloCraft to create user-defined domain/surfdata/forcing for ELM simulations
+### The shapes are burned onto the TES 2D raster (tes_grid.py) instead of testing every cell centre
 
 import argparse
+import json
+import os
+import re
 import geopandas as gpd
-import xarray as xr
 import numpy as np
 import netCDF4 as nc
+import pandas as pd
 
 
 from datetime import datetime
 
-def shape2grid(shapefile_path, aoi_name):
-    # Get current date
-    current_date = datetime.now()
-    # Format date to mmddyyyy
-    formatted_date = current_date.strftime('%y%m%d')
+from tes_grid import TESGrid, ENGINES
 
-    # Load the shapefile
-    shape = gpd.read_file(shapefile_path)
+DEFAULT_DOMAIN = 'domain.lnd.TES_SE.4km.1d.c240827.nc'
 
-    print('CRS', shape.crs)
-    # Define the target CRS (EPSG:4326, which is the ELM CRS)
-    elm_crs = "EPSG:4326"
 
-    # Check and convert the CRS if necessary
-    if shape.crs != elm_crs:
-        print(f"Shapefile CRS is {shape.crs}. Converting to {elm_crs}...")
-        shape = shape.to_crs(elm_crs)
-    else:
-        print(f"Shapefile is already in {elm_crs}.")
+def write_gridids(path, grid_ids, title, feature=None, feature_names=None):
+    if os.path.exists(path):
+        os.remove(path)
+    dst = nc.Dataset(path, 'w', format='NETCDF3_64BIT')
 
-    # save to the gridID  file
-    AOI_gridID = f"{aoi_name}_gridID.c{formatted_date}.nc"
-    dst = nc.Dataset(AOI_gridID, 'w', format='NETCDF3_64BIT')
+    # create the gridIDs, lon, and lat variable
+    ni_dim = dst.createDimension('ni', grid_ids.size)
+    nj_dim = dst.createDimension('nj', 1)
 
-    # Load the NetCDF file
-    netcdf_file_path = 'domain.lnd.TES_SE.4km.1d.c240827.nc'  # replace with the actual path to your NetCDF file
-    ds = xr.open_dataset(netcdf_file_path)
+    gridID_var = dst.createVariable('gridID', np.int32, ('nj','ni'), zlib=True, complevel=5)
+    gridID_var.long_name = 'gridId in the TESSFA2 domain'
+    gridID_var.decription = "start from #0 at the upper left corner of the domain, covering all land and ocean gridcells"
+    dst.variables['gridID'][...] = grid_ids
+    if feature is not None:
+        # labelled batch output: feature index of every gridcell, names in feature_names
+        feature_var = dst.createVariable('feature', np.int32, ('nj','ni'))
+        feature_var.long_name = 'index of the containing shapefile feature in feature_names'
+        dst.variables['feature'][...] = feature
+        dst.feature_names = json.dumps(feature_names)
+    dst.title = title
 
-    # Extract the xc and yc coordinates and the gridID
-    xc = ds['xc'].values.squeeze()
-    yc = ds['yc'].values.squeeze()
-    gridID = ds['gridID'].values.squeeze()
+    dst.close()
 
-    # Create a GeoDataFrame for the grid cells
-    grid_cells = gpd.GeoDataFrame({
-        'gridID': gridID,
-        'geometry': gpd.points_from_xy(xc, yc)
-    })
 
-    # Set the same coordinate reference system (CRS) as the shapefile
-    grid_cells.set_crs(epsg=4326, inplace=True)
+def read_shapes(shapefile_path, grid):
+    # Load the shapefile
+    shape = gpd.read_file(shapefile_path)
 
-    # Check which grid cells are within the TVA shape
-    grid_cells_within_AOI = grid_cells[grid_cells['geometry'].within(shape.unary_union)]
+    print('CRS', shape.crs)
+    # The TES raster is regular in its Lambert Conformal Conic projection
+    grid_crs = grid.crs()
 
-    # Get the list of gridIDs that are inside Tennessee
-    grid_ids_within_AOI = grid_cells_within_AOI['gridID'].values
+    # Check and convert the CRS if necessary
+    if shape.crs != grid_crs:
+        print(f"Shapefile CRS is {shape.crs}. Converting to the TES grid CRS...")
+        shape = shape.to_crs(grid_crs)
+    return shape
 
-    # Print the resulting grid IDs
-    print("Grid IDs within " + aoi_name +":", grid_ids_within_AOI)
 
-    # create the gridIDs, lon, and lat variable
-    ni_dim = dst.createDimension('ni', grid_ids_within_AOI.size)
-    nj_dim = dst.createDimension('nj', 1)
+def shape2grid(shapefile_path, aoi_name, domain_path=DEFAULT_DOMAIN, engine='auto', all_touched=False, grid=None):
+    # Get current date
+    current_date = datetime.now()
+    # Format date to mmddyyyy
+    formatted_date = current_date.strftime('%y%m%d')
 
-    gridID_var = dst.createVariable('gridID', np.int32, ('nj','ni'), zlib=True, complevel=5)
-    gridID_var.long_name = 'gridId in the TESSFA2 domain'
-    gridID_var.decription = "start from #0 at the upper left corner of the domain, covering all land and ocean gridcells" 
-    dst.variables['gridID'][...] = grid_ids_within_AOI
-    dst.title = aoi_name +' land gridcells in the TESSFA2 domain'
+    # Load the TES grid behind the domain gridIDs (unless already loaded) and the shapefile in its CRS
+    grid = grid or TESGrid.from_domain(domain_path)
+    shape = read_shapes(shapefile_path, grid)
 
-    dst.close()
+    # Burn the AOI polygons onto the TES raster and keep the land cells inside
+    grid_ids_within_AOI = grid.select(shape.geometry.values, all_touched=all_touched, engine=engine)
 
-if __name__ == '__main__':
+    # Print the resulting grid IDs
+    print("Grid IDs within " + aoi_name +":", grid_ids_within_AOI)
+    if grid_ids_within_AOI.size == 0:
+        print(f"No TES land gridcells inside {shapefile_path}; no gridID file written")
+        return None
+
+    # save to the gridID  file
+    AOI_gridID = f"{aoi_name}_gridID.c{formatted_date}.nc"
+    write_gridids(AOI_gridID, grid_ids_within_AOI, aoi_name +' land gridcells in the TESSFA2 domain')
+    return AOI_gridID
+
+
+def feature_aoi_names(aoi_prefix, names):
+    # the AOI name is the file name part before the first '_', so keep letters and digits only
+    aoi_names = [aoi_prefix + re.sub(r'[^A-Za-z0-9]', '', str(name)) for name in names]
+    duplicated = sorted({a for a in aoi_names if aoi_names.count(a) > 1})
+    if duplicated:
+        raise ValueError(f"Feature names collide after removing non-alphanumerics: {duplicated}")
+    return aoi_names
+
+
+def write_feature_config(template_path, aoi_name, gridid_file):
+    with open(template_path) as f:
+        cfg = json.load(f)
+    cfg['expid'] = aoi_name
+    cfg['experiment_root'] = os.path.join(os.path.dirname(cfg['experiment_root'].rstrip('/')), aoi_name)
+    cfg['aoi_points'] = {'dir': os.path.abspath(os.path.dirname(gridid_file)), 'file': os.path.basename(gridid_file)}
+    config_path = os.path.join(os.path.dirname(gridid_file), f"{aoi_name}_config.json")
+    with open(config_path, 'w') as f:
+        json.dump(cfg, f, indent=2)
+        f.write('\n')
+    return config_path
+
+
+def features2grid(grid, geometries, names, aoi_prefix='', output='files', output_dir='.',
+                  config_template=None, engine='auto', all_touched=False):
+    # Rows sharing a name (multi-part features) form one AOI
+    codes, unique_names = pd.factorize(pd.Series(names).astype(str))
+    aoi_names = feature_aoi_names(aoi_prefix, unique_names)
+
+    # One burn assigns every land cell to its feature (1-based, 0 = outside all features)
+    labels = grid.label_cells(geometries, codes + 1, all_touched=all_touched, engine=engine)
+    counts = np.bincount(labels, minlength=len(aoi_names) + 1)[1:]
+
+    formatted_date = datetime.now().strftime('%y%m%d')
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    if output == 'labelled':
+        inside = labels > 0
+        path = os.path.join(output_dir, f"{aoi_prefix or 'features'}_gridID.c{formatted_date}.nc")
+        write_gridids(path, grid.gridid[inside], f"{len(aoi_names)} shapefile features in the TESSFA2 domain",
+                      feature=labels[inside] - 1, feature_names=aoi_names)
+        written.append(path)
+        print(f"{path}: {int(inside.sum())} gridcells in {int(np.count_nonzero(counts))} features")
+
+    for code, aoi_name in enumerate(aoi_names):
+        if counts[code] == 0:
+            print(f"{aoi_name}: no TES land gridcells, skipped")
+            continue
+        if output == 'labelled':
+            continue
+        path = os.path.join(output_dir, f"{aoi_name}_gridID.c{formatted_date}.nc")
+        write_gridids(path, grid.gridid[labels == code + 1], aoi_name + ' land gridcells in the TESSFA2 domain')
+        written.append(path)
+        line = f"{path}: {counts[code]} gridcells"
+        if config_template:
+            line += ", config " + write_feature_config(config_template, aoi_name, path)
+        print(line)
+    return written
+
+
+def shape2grid_batch(shapefile_path, by, aoi_prefix='', domain_path=DEFAULT_DOMAIN, output='files', output_dir='.',
+                     config_template=None, engine='auto', all_touched=False, grid=None):
+    grid = grid or TESGrid.from_domain(domain_path)
+    shape = read_shapes(shapefile_path, grid)
+    if by not in shape.columns:
+        raise ValueError(f"{by} is not an attribute of {shapefile_path}; available: {list(shape.columns)}")
+    return features2grid(grid, shape.geometry.values, shape[by].values, aoi_prefix, output, output_dir,
+                         config_template, engine, all_touched)
+
+
+def main(argv=None, grid_loader=TESGrid.from_domain):
+    # grid_loader: aoi_service.py hands in the TES grid it keeps loaded
     parser = argparse.ArgumentParser(description='Process a shapefile to find gridIDs within in the AOI region.')
     parser.add_argument('shapefile_path', type=str, help='shapefile witht the full path')
-    parser.add_argument('aoi_name', type=str, help='Area of interest name')
-
-    args = parser.parse_args()
-    
-    shape2grid(args.shapefile_path, args.aoi_name)
-
-
-
+    parser.add_argument('aoi_name', type=str, help='Area of interest name (prefix of the feature AOI names with --by; may be "")')
+    parser.add_argument('--domain', type=str, default=DEFAULT_DOMAIN, help=f'TES 1D domain file (default: {DEFAULT_DOMAIN})')
+    parser.add_argument('--engine', choices=ENGINES, default='auto',
+                        help='auto (rasterio if installed, else numpy), rasterio, numpy, or points (centre-in-polygon via STRtree)')
+    parser.add_argument('--all-touched', action='store_true', help='Select every cell the shapes touch, not only cells whose centre is inside (rasterio)')
+
+    parser.add_argument('--by', type=str, help='Batch mode: attribute naming the features; one AOI <aoi_name><feature> per feature')
+    parser.add_argument('--batch-output', choices=['files', 'labelled'], default='files',
+                        help='files: one gridID file per feature; labelled: a single gridID file with a feature index variable')
+    parser.add_argument('--output-dir', type=str, default='.', help='Directory for the batch outputs (default: .)')
+    parser.add_argument('--config-template', type=str, help='aoi_prepare_experiment config to copy into <AOI>_config.json per feature')
+
+    args = parser.parse_args(argv)
+
+    grid = grid_loader(args.domain)
+    if args.by:
+        shape2grid_batch(args.shapefile_path, args.by, args.aoi_name, args.domain, args.batch_output, args.output_dir,
+                         args.config_template, args.engine, args.all_touched, grid)
+    else:
+        shape2grid(args.shapefile_path, args.aoi_name, args.domain, args.engine, args.all_touched, grid)
 
 
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Geometry of the TES 2D raster behind the 1D gridIDs, and polygon burning onto it.
+
+gridIDs number the cells of a regular Lambert Conformal Conic raster row by row,
+starting from #0 at the upper left corner (land and ocean cells). The 1D domain only
+keeps the land cells, so the raster is recovered from their LCC centres
+(xc_LCC, yc_LCC) and gridIDs:
+
+    gridID = row * ncols + col,  x = x0 + col * dx,  y = y0 - row * dy
+
+Polygons are burned onto the raster at cell centres, window by window (the bounding
+box of each polygon), instead of testing every cell centre against the polygons:
+  - rasterio   rasterio.features.rasterize (also supports all_touched)
+  - numpy      even-odd scanline fill; needs no GIS packages
+  - points     centre-in-polygon through an STRtree of prepared shapely geometries,
+               the semantics of the original shape2gridID within() test
+Geometries are shapely objects or GeoJSON-like mappings in the grid CRS (grid.crs()).
+
+AOI cells can also be ordered along a space-filling curve over the raster (Hilbert or
+Morton/Z-order), so that contiguous blocks of the 1D AOI files - what ELM hands to each
+land task - are compact on the map. TES_AOI_domainGEN.py applies AOI_CELL_ORDER and tags
+the AOI domain with a cell_order attribute; the surfdata, forcing and finidat generators
+then follow the AOI domain order instead of the source order. The raster is recovered from
+the entire domain ($TES_GRID_DOMAIN when the source domain is a sparse super-AOI subset,
+whose centres can be several cells apart everywhere).
+
+Example use:
+  python3 tes_grid.py domain.lnd.TES_SE.4km.1d.c240827.nc     # print the raster geometry
+"""
+
+import argparse
+import os
+
+import numpy as np
+import netCDF4 as nc
+
+GRID_MAPPING = "lambert_conformal_conic"
+ENGINES = ("auto", "rasterio", "numpy", "points")
+CELL_ORDERS = ("source", "hilbert", "morton")
+CELL_ORDER_ENV = "AOI_CELL_ORDER"
+GRID_DOMAIN_ENV = "TES_GRID_DOMAIN"  # entire-domain file the raster is recovered from
+
+
+def _rings(geom):
+    """Polygons of a geometry as lists of rings (exterior first); lines and points have no area."""
+    mapping = geom.__geo_interface__ if hasattr(geom, "__geo_interface__") else geom
+    kind = mapping["type"]
+    if kind == "Polygon":
+        return [mapping["coordinates"]]
+    if kind == "MultiPolygon":
+        return list(mapping["coordinates"])
+    if kind == "GeometryCollection":
+        return [p for g in mapping["geometries"] for p in _rings(g)]
+    if kind == "Feature":
+        return _rings(mapping["geometry"])
+    return []
+
+
+def _bounds(polygons):
+    xy = np.concatenate([np.asarray(ring, dtype=np.float64)[:, :2] for poly in polygons for ring in poly])
+    return xy[:, 0].min(), xy[:, 1].min(), xy[:, 0].max(), xy[:, 1].max()
+
+
+class TESGrid:
+    """Regular LCC raster: cell (row, col) has its centre at (x0 + col*dx, y0 - row*dy)."""
+
+    def __init__(self, nrows, ncols, x0, y0, dx, dy, gridid=None, mapping_attrs=None):
+        self.nrows = int(nrows)
+        self.ncols = int(ncols)
+        self.x0, self.y0 = float(x0), float(y0)
+        self.dx, self.dy = float(dx), float(dy)
+        self.gridid = gridid  # land cells of the domain, in domain order
+        self.mapping_attrs = mapping_attrs or {}
+
+    @classmethod
+    def from_domain(cls, domain_path: str) -> "TESGrid":
+        with nc.Dataset(domain_path, "r") as src:
+            if "xc_LCC" not in src.variables or "yc_LCC" not in src.variables:
+                raise ValueError(f"{domain_path} has no xc_LCC/yc_LCC; the TES raster cannot be recovered")
+            gridid = np.asarray(src["gridID"][:]).reshape(-1).astype(np.int64)
+            x = np.asarray(src["xc_LCC"][:], dtype=np.float64).reshape(-1)
+            y = np.asarray(src["yc_LCC"][:], dtype=np.float64).reshape(-1)
+            attrs = {}
+            if GRID_MAPPING in src.variables:
+                var = src[GRID_MAPPING]
+                attrs = {a: var.getncattr(a) for a in var.ncattrs()}
+        return cls.from_centres(gridid, x, y, attrs)
+
+    @classmethod
+    def from_centres(cls, gridid, x, y, mapping_attrs=None) -> "TESGrid":
+        dx = _spacing(x)
+        dy = _spacing(y)
+        col = np.rint((x - x.min()) / dx).astype(np.int64)
+        row = np.rint((y.max() - y) / dy).astype(np.int64)
+        # gridID - col = ncols * row + offset; solve from the extreme rows and check every cell
+        k = gridid - col
+        lo, hi = np.argmin(row), np.argmax(row)
+        if row[hi] == row[lo]:
+            ncols = int(col.max() + 1 + k[lo])
+        else:
+            ncols = int((k[hi] - k[lo]) // (row[hi] - row[lo]))
+        offset = k[lo] - ncols * row[lo]
+        if ncols <= 0 or not np.array_equal(k, ncols * row + offset):
+            raise ValueError("gridIDs are not row-major on the xc_LCC/yc_LCC raster "
+                             "(recover it from the entire domain, not a sparse subset)")
+        r0, c0 = divmod(int(offset), ncols)
+        nrows = int(gridid.max() // ncols + 1)
+        return cls(nrows, ncols, x.min() - c0 * dx, y.max() + r0 * dy, dx, dy, gridid, mapping_attrs)
+
+    @property
+    def shape(self):
+        return (self.nrows, self.ncols)
+
+    def crs(self):
+        """pyproj CRS of the raster from the CF grid mapping attributes."""
+        from pyproj import CRS
+        return CRS.from_cf(self.mapping_attrs)
+
+    def geotransform(self, window=None):
+        """GDAL geotransform of the raster (or of window = (r0, r1, c0, c1)), north up."""
+        r0, c0 = (window[0], window[2]) if window else (0, 0)
+        return (self.x0 + (c0 - 0.5) * self.dx, self.dx, 0.0, self.y0 - (r0 - 0.5) * self.dy, 0.0, -self.dy)
+
+    def rowcol(self, gridid):
+        return np.divmod(np.asarray(gridid, dtype=np.int64), self.ncols)
+
+    def centres(self, gridid=None):
+        row, col = self.rowcol(self.gridid if gridid is None else gridid)
+        return self.x0 + col * self.dx, self.y0 - row * self.dy
+
+    def cell_order(self, gridid, method: str = "hilbert") -> np.ndarray:
+        """Permutation of gridid along a Hilbert or Morton curve over the raster (stable for ties)."""
+        row, col = self.rowcol(gridid)
+        bits = max(int(max(self.nrows, self.ncols) - 1).bit_length(), 1)
+        if method == "hilbert":
+            key = hilbert_key(row, col, bits)
+        elif method == "morton":
+            key = morton_key(row, col, bits)
+        elif method == "source":
+            return np.arange(np.size(gridid))
+        else:
+            raise ValueError(f"Unknown cell order {method!r} (expected one of {', '.join(CELL_ORDERS)})")
+        return np.argsort(key, kind="stable")
+
+    def window(self, bounds):
+        """Rows and columns (r0, r1, c0, c1; end exclusive) whose centres fall in bounds, or None."""
+        minx, miny, maxx, maxy = bounds
+        c0 = max(int(np.ceil((minx - self.x0) / self.dx)), 0)
+        c1 = min(int(np.floor((maxx - self.x0) / self.dx)) + 1, self.ncols)
+        r0 = max(int(np.ceil((self.y0 - maxy) / self.dy)), 0)
+        r1 = min(int(np.floor((self.y0 - miny) / self.dy)) + 1, self.nrows)
+        if r0 >= r1 or c0 >= c1:
+            return None
+        return (r0, r1, c0, c1)
+
+    def _burn_numpy(self, polygons, window, all_touched):
+        if all_touched:
+            raise RuntimeError("all_touched burning needs rasterio")
+        r0, r1, c0, c1 = window
+        inside = np.zeros((r1 - r0, c1 - c0), dtype=bool)
+        for poly in polygons:
+            # even-odd rule: every ring crossing toggles the cells right of it
+            toggles = np.zeros((r1 - r0, c1 - c0 + 1), dtype=np.int32)
+            for ring in poly:
+                xy = np.asarray(ring, dtype=np.float64)[:, :2]
+                if not np.array_equal(xy[0], xy[-1]):
+                    xy = np.vstack([xy, xy[:1]])
+                fc = (xy[:, 0] - self.x0) / self.dx
+                fr = (self.y0 - xy[:, 1]) / self.dy
+                ar, br, ac, bc = fr[:-1], fr[1:], fc[:-1], fc[1:]
+                # an edge crosses the centre line of rows lo <= r < hi
+                lo = np.clip(np.ceil(np.minimum(ar, br)), r0, r1).astype(np.int64)
+                hi = np.clip(np.ceil(np.maximum(ar, br)), r0, r1).astype(np.int64)
+                n = hi - lo
+                if not n.any():
+                    continue
+                edge = np.repeat(np.arange(n.size), n)
+                r = lo[edge] + np.arange(edge.size) - np.repeat(np.cumsum(n) - n, n)
+                t = (r - ar[edge]) / (br[edge] - ar[edge])
+                c = ac[edge] + t * (bc[edge] - ac[edge])
+                ci = np.clip(np.ceil(c), c0, c1).astype(np.int64) - c0
+                np.add.at(toggles, (r - r0, ci), 1)
+            inside |= (np.cumsum(toggles, axis=1)[:, :-1] & 1).astype(bool)
+        return inside
+
+    def _burn_rasterio(self, geom, window, all_touched):
+        from affine import Affine
+        from rasterio.features import rasterize
+        r0, r1, c0, c1 = window
+        return rasterize([(geom, 1)], out_shape=(r1 - r0, c1 - c0),
+                         transform=Affine.from_gdal(*self.geotransform(window)),
+                         fill=0, all_touched=all_touched, dtype="uint8").astype(bool)
+
+    def burn(self, geometries, values=None, all_touched: bool = False, engine: str = "auto") -> np.ndarray:
+        """int32 raster holding values[i] (default i + 1) where geometry i covers a cell centre, 0 elsewhere.
+        Overlaps keep the later geometry."""
+        engine = resolve_engine(engine, points_ok=False)
+        labels = np.zeros(self.shape, dtype=np.int32)
+        for i, geom in enumerate(geometries):
+            polygons = _rings(geom)
+            if not polygons:
+                continue
+            window = self.window(_bounds(polygons))
+            if window is None:
+                continue  # bounding box prefilter: no cell centre can be inside
+            if engine == "rasterio":
+                mask = self._burn_rasterio(geom, window, all_touched)
+            else:
+                mask = self._burn_numpy(polygons, window, all_touched)
+            r0, r1, c0, c1 = window
+            labels[r0:r1, c0:c1][mask] = i + 1 if values is None else values[i]
+        return labels
+
+    def _label_points(self, geometries, values):
+        import shapely
+        geoms = np.asarray([shapely.geometry.shape(g) if not hasattr(g, "geom_type") else g for g in geometries])
+        labels = np.zeros(self.gridid.size, dtype=np.int32)
+        if geoms.size == 0:
+            return labels
+        x, y = self.centres()
+        minx, miny, maxx, maxy = shapely.total_bounds(geoms)
+        cand = np.flatnonzero((x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy))
+        shapely.prepare(geoms)
+        tree = shapely.STRtree(geoms)
+        pts, hit = tree.query(shapely.points(x[cand], y[cand]), predicate="within")
+        order = np.argsort(hit, kind="stable")  # later geometries win on overlaps
+        vals = hit[order] + 1 if values is None else np.asarray(values)[hit[order]]
+        labels[cand[pts[order]]] = vals
+        return labels
+
+    def label_cells(self, geometries, values=None, all_touched: bool = False, engine: str = "auto") -> np.ndarray:
+        """Burned value for every land cell of the domain (aligned with self.gridid)."""
+        geometries = list(geometries)
+        if resolve_engine(engine) == "points":
+            if all_touched:
+                raise RuntimeError("all_touched is not defined for the points engine")
+            return self._label_points(geometries, values)
+        labels = self.burn(geometries, values, all_touched, engine)
+        row, col = self.rowcol(self.gridid)
+        return labels[row, col]
+
+    def select(self, geometries, all_touched: bool = False, engine: str = "auto") -> np.ndarray:
+        """Land gridIDs (domain order) whose cells are inside any of the geometries."""
+        return self.gridid[self.label_cells(geometries, None, all_touched, engine) > 0]
+
+
+def _spacing(v):
+    u = np.unique(np.round(v, 3))
+    d = np.diff(u)
+    d = d[d > 0]
+    if d.size == 0:
+        return 1.0
+    return float(d.min())
+
+
+def morton_key(row, col, bits: int) -> np.ndarray:
+    """Z-order index: the bits of row and col interleaved."""
+    row = np.asarray(row, dtype=np.uint64)
+    col = np.asarray(col, dtype=np.uint64)
+    key = np.zeros(row.shape, dtype=np.uint64)
+    for b in range(bits):
+        key |= ((col >> np.uint64(b)) & np.uint64(1)) << np.uint64(2 * b)
+        key |= ((row >> np.uint64(b)) & np.uint64(1)) << np.uint64(2 * b + 1)
+    return key
+
+
+def hilbert_key(row, col, bits: int) -> np.ndarray:
+    """Distance along the Hilbert curve filling a 2**bits square (x = col, y = row)."""
+    x = np.array(col, dtype=np.int64)
+    y = np.array(row, dtype=np.int64)
+    n = np.int64(1) << bits
+    key = np.zeros(x.shape, dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        key += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # rotate the quadrant so the sub-curve starts where the parent curve enters it
+        flip = ~ry & rx
+        x[flip] = n - 1 - x[flip]
+        y[flip] = n - 1 - y[flip]
+        swap = ~ry
+        x[swap], y[swap] = y[swap], x[swap].copy()
+        s >>= 1
+    return key
+
+
+def cell_order_setting(value=None) -> str:
+    """Requested AOI cell order: value, else $AOI_CELL_ORDER, else source order."""
+    method = (value or os.environ.get(CELL_ORDER_ENV) or "source").lower()
+    if method not in CELL_ORDERS:
+        raise ValueError(f"Unknown cell order {method!r} (expected one of {', '.join(CELL_ORDERS)})")
+    return method
+
+
+def file_cell_order(path: str) -> str:
+    """cell_order attribute of an AOI file ("source" when absent or not a netCDF file)."""
+    if not str(path).endswith(".nc"):
+        return "source"
+    with nc.Dataset(path, "r") as src:
+        return str(getattr(src, "cell_order", "source"))
+
+
+def aoi_positions(source_gridid, aoi_gridid, keep_order: bool = False) -> np.ndarray:
+    """Positions of the AOI gridIDs in a source array: source order, or the AOI order when keep_order."""
+    source_gridid = np.asarray(source_gridid).reshape(-1)
+    aoi_gridid = np.asarray(aoi_gridid).reshape(-1)
+    if not keep_order:
+        return np.flatnonzero(np.isin(source_gridid, aoi_gridid))
+    sorter = np.argsort(source_gridid, kind="stable")
+    found = np.searchsorted(source_gridid, aoi_gridid, sorter=sorter)
+    found = np.minimum(found, source_gridid.size - 1)
+    positions = sorter[found]
+    hit = source_gridid[positions] == aoi_gridid
+    return positions[hit]
+
+
+def resolve_engine(engine: str = "auto", points_ok: bool = True) -> str:
+    if engine not in ENGINES or (engine == "points" and not points_ok):
+        raise ValueError(f"Unknown burn engine {engine!r}")
+    if engine != "auto":
+        return engine
+    try:
+        import rasterio.features  # noqa: F401
+        return "rasterio"
+    except ImportError:
+        return "numpy"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Print the TES raster geometry recovered from a 1D domain file.")
+    parser.add_argument("domain", help="1D domain NetCDF with gridID, xc_LCC and yc_LCC")
+    args = parser.parse_args()
+    grid = TESGrid.from_domain(args.domain)
+    print(f"raster {grid.nrows} x {grid.ncols}, dx {grid.dx:g} m, dy {grid.dy:g} m, "
+          f"first centre ({grid.x0:.1f}, {grid.y0:.1f}), {grid.gridid.size} land cells")
+    print("geotransform", grid.geotransform())
+
+
+if __name__ == "__main__":
+    main()
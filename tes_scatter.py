@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Vectorized 1D -> 2D scatter of TES gridcell values onto the raster of a mask file.
+
+The mask file (mask.nc) holds the raster coordinates x, y and a masked 2D gridID;
+its valid gridIDs are the flat raster positions (row-major, shape (len(y), len(x)))
+of the gridcells, in the order in which data variables list them once compressed.
+ScatterIndex precomputes these positions once, so a whole stack of time steps or
+levels is placed with a single assignment:
+
+    index = ScatterIndex.from_mask("mask.nc")
+    raster = index.fill(index.cells(data.variables["GPP"][:]))   # (..., ny, nx), NaN off-grid
+
+SliceCache reads single time slices of a variable by hyperslab, keeps the most recently
+viewed rasters and prefetches the neighbouring time steps in the background.
+
+Indexes are cached per mask file (path, size and mtime), in memory and as .npz under
+$TES_SCATTER_CACHE (default ~/.cache/tes_scatter; set it to "" to disable).
+
+Example use:
+  python3 tes_scatter.py mask.nc        # build/cache the index and print its size
+"""
+
+import argparse
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import netCDF4 as nc
+
+CACHE_ENV = "TES_SCATTER_CACHE"
+_MEMORY = {}
+
+
+def _cache_dir():
+    path = os.environ.get(CACHE_ENV, os.path.join(os.path.expanduser("~"), ".cache", "tes_scatter"))
+    return path or None
+
+
+def _cache_key(mask_path):
+    st = os.stat(mask_path)
+    ident = f"{os.path.realpath(mask_path)}:{st.st_size}:{st.st_mtime_ns}"
+    return hashlib.sha256(ident.encode()).hexdigest()[:32]
+
+
+class ScatterIndex:
+    """Flat raster positions of the gridcells of a mask file."""
+
+    def __init__(self, x, y, gridid, positions, layout_size):
+        self.x = np.asarray(x)
+        self.y = np.asarray(y)
+        self.shape = (self.y.size, self.x.size)
+        self.gridid = np.asarray(gridid, dtype=np.int64)  # compressed order
+        self.positions = np.asarray(positions, dtype=np.int64)  # valid cells within the mask's own 2D layout
+        self.layout_size = int(layout_size)
+        self.valid = (self.gridid >= 0) & (self.gridid < self.shape[0] * self.shape[1])
+        self.flat = self.gridid[self.valid]
+
+    @classmethod
+    def from_mask(cls, mask_path: str, cache: bool = True) -> "ScatterIndex":
+        key = _cache_key(mask_path)
+        if cache and key in _MEMORY:
+            return _MEMORY[key]
+        cache_dir = _cache_dir() if cache else None
+        npz = os.path.join(cache_dir, key + ".npz") if cache_dir else None
+        if npz and os.path.exists(npz):
+            with np.load(npz) as z:
+                index = cls(z["x"], z["y"], z["gridid"], z["positions"], z["layout_size"])
+        else:
+            with nc.Dataset(mask_path, "r") as src:
+                x = src.variables["x"][:]
+                y = src.variables["y"][:]
+                gridid = src.variables["gridID"][:]
+            positions = np.flatnonzero(~np.ma.getmaskarray(gridid))
+            index = cls(np.ma.filled(x, np.nan), np.ma.filled(y, np.nan), gridid.compressed(), positions, gridid.size)
+            if npz:
+                os.makedirs(cache_dir, exist_ok=True)
+                tmp = f"{npz}.{os.getpid()}.npz"
+                np.savez(tmp, x=index.x, y=index.y, gridid=index.gridid, positions=index.positions,
+                         layout_size=index.layout_size)
+                os.replace(tmp, npz)
+        if cache:
+            _MEMORY[key] = index
+        return index
+
+    @property
+    def ncells(self):
+        return self.gridid.size
+
+    def cells(self, data) -> np.ndarray:
+        """Gridcell values (..., ncells) of a variable laid out like the mask gridID (..., nj, ni)
+        or already 1D (..., ncells); equal to compressed() per time step or level."""
+        data = np.ma.asarray(data)
+        if data.shape[-1] == self.ncells:
+            return np.ma.filled(data.astype(np.float64), np.nan)
+        if data.ndim >= 2 and data.shape[-2] * data.shape[-1] == self.layout_size:
+            flat = data.reshape(data.shape[:-2] + (-1,))[..., self.positions]
+            return np.ma.filled(flat.astype(np.float64), np.nan)
+        raise ValueError(f"Data of shape {data.shape} does not match the {self.ncells} gridcells of the mask")
+
+    def fill(self, values, fill_value=np.nan, dtype=None) -> np.ndarray:
+        """Raster(s) (..., ny, nx) with the gridcell values (..., ncells) in place, fill_value elsewhere."""
+        values = np.asarray(values)
+        lead = values.shape[:-1]
+        dtype = dtype or np.result_type(values, fill_value)
+        out = np.full(lead + (self.shape[0] * self.shape[1],), fill_value, dtype=dtype)
+        out[..., self.flat] = values[..., self.valid]
+        return out.reshape(lead + self.shape)
+
+    def active(self) -> np.ndarray:
+        """0/1 raster of the gridcells of the mask."""
+        return self.fill(np.ones(self.ncells, dtype=int), fill_value=0, dtype=int)
+
+
+class SliceCache:
+    """LRU cache of scattered time slices var[t] of one (time, ...) variable, with prefetch of t +- 1..prefetch."""
+
+    def __init__(self, index, variable, maxsize: int = 16, prefetch: int = 1, lock=None):
+        self.index = index
+        self.variable = variable
+        self.ntime = variable.shape[0]
+        self.maxsize = maxsize
+        self.prefetch = prefetch
+        self.lock = lock or threading.Lock()  # netCDF4 handles are not thread-safe: one read at a time
+        self._slices = OrderedDict()
+        self._pending = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _read(self, t):
+        with self.lock:
+            data = self.variable[t]
+        return self.index.fill(self.index.cells(data))
+
+    def _store(self, t, raster):
+        self._slices[t] = raster
+        self._slices.move_to_end(t)
+        while len(self._slices) > self.maxsize:
+            self._slices.popitem(last=False)
+
+    def get(self, t: int) -> np.ndarray:
+        if not -self.ntime <= t < self.ntime:
+            raise IndexError(f"time step {t} is outside 0..{self.ntime - 1}")
+        t %= self.ntime
+        for done in [s for s, fut in self._pending.items() if fut.done() and s != t]:
+            self._store(done, self._pending.pop(done).result())
+        if t in self._slices:
+            self._slices.move_to_end(t)
+            raster = self._slices[t]
+        elif t in self._pending:
+            raster = self._pending.pop(t).result()
+            self._store(t, raster)
+        else:
+            raster = self._read(t)
+            self._store(t, raster)
+        for dt in range(1, self.prefetch + 1):
+            for s in (t + dt, t - dt):
+                if 0 <= s < self.ntime and s not in self._slices and s not in self._pending:
+                    self._pending[s] = self._executor.submit(self._read, s)
+        return raster
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        self._pending.clear()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Build (and cache) the scatter index of a mask file.")
+    parser.add_argument("mask", help="mask NetCDF with x, y and a 2D masked gridID")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the index cache")
+    args = parser.parse_args()
+    index = ScatterIndex.from_mask(args.mask, cache=not args.no_cache)
+    print(f"{index.ncells} gridcells on a {index.shape[0]} x {index.shape[1]} raster "
+          f"({index.ncells - index.flat.size} outside it)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import os
+import sys
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+# the tools are top-level scripts of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GRIDIDS = np.array([3, 7, 11, 20, 42], dtype=np.int32)
+# packed int16: 280.5 K etc. with scale 0.01 / offset 280; -32767 is the fill value
+TBOT = np.array([[280.5, 281.25, 283.5, 290.0, 275.75],
+                 [281.0, 282.5, 284.0, np.nan, 276.0],
+                 [279.5, 280.0, 285.25, 291.5, 277.25]])
+SCALE, OFFSET, FILL = 0.01, 280.0, np.int16(-32767)
+
+
+def pack(values):
+    packed = np.round((values - OFFSET) / SCALE)
+    return np.where(np.isnan(values), FILL, packed).astype(np.int16)
+
+
+def write_forcing(path, fmt="NETCDF3_64BIT", values=TBOT, gridids=GRIDIDS, packed=True, name="TBOT"):
+    """A (time, nj, ni) forcing file like AOI_forcing_save_1d writes."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with nc.Dataset(path, "w", format=fmt) as dst:
+        dst.createDimension("time", None)
+        dst.createDimension("nj", 1)
+        dst.createDimension("ni", gridids.size)
+        time = dst.createVariable("time", "f8", ("time",))
+        time.units = "days since 1980-01-01 00:00:00"
+        time.calendar = "noleap"
+        dst.createVariable("gridID", "i4", ("nj", "ni"))[:] = gridids[None, :]
+        if packed:
+            var = dst.createVariable(name, "i2", ("time", "nj", "ni"), fill_value=FILL)
+            var.scale_factor = SCALE
+            var.add_offset = OFFSET
+            var.set_auto_maskandscale(False)
+            var[:] = pack(values)[:, None, :]
+        else:
+            var = dst.createVariable(name, "f4", ("time", "nj", "ni"), fill_value=np.float32(1e36))
+            var[:] = np.where(np.isnan(values), 1e36, values)[:, None, :]
+        var.units = "K"
+        time[:] = np.arange(values.shape[0]) * 0.125
+    return path
+
+
+@pytest.fixture
+def catalog_env(tmp_path, monkeypatch):
+    monkeypatch.setenv("FORCING_CATALOG", str(tmp_path / "catalog.sqlite"))
+    return tmp_path / "catalog.sqlite"
@@ -0,0 +1,53 @@
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+import TES_AOI_domainGEN
+from tes_grid import TESGrid
+
+DX = 4000.0
+NROWS, NCOLS = 6, 8
+
+
+def write_domain(path, gridids):
+    row, col = np.divmod(np.asarray(gridids), NCOLS)
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as ds:
+        ds.createDimension("nj", 1)
+        ds.createDimension("ni", len(gridids))
+        for name, values in (("gridID", gridids), ("xc", col * 0.04), ("yc", 35.0 - row * 0.04),
+                             ("xc_LCC", col * DX), ("yc_LCC", -row * DX)):
+            ds.createVariable(name, "i4" if name == "gridID" else "f8", ("nj", "ni"))[:] = [values]
+
+
+@pytest.fixture
+def domains(tmp_path):
+    # the super-AOI domain holds every other row and column: its centres are all 2*DX apart
+    entire = np.arange(NROWS * NCOLS)
+    sparse = entire[(entire // NCOLS % 2 == 0) & (entire % NCOLS % 2 == 0)]
+    write_domain(str(tmp_path / "entire.nc"), entire)
+    write_domain(str(tmp_path / "super.nc"), sparse)
+    (tmp_path / "T1_gridID.csv").write_text("gridID\n" + "\n".join(str(g) for g in sparse[1:]) + "\n")
+    return tmp_path, sparse[1:]
+
+
+def test_sparse_source_is_ordered_on_the_entire_raster(domains, monkeypatch):
+    tmp_path, aoi = domains
+    monkeypatch.setenv("AOI_CELL_ORDER", "hilbert")
+    monkeypatch.setenv("TES_GRID_DOMAIN", str(tmp_path / "entire.nc"))
+    out = TES_AOI_domainGEN.create_AOI_domain(str(tmp_path), str(tmp_path), "T1_gridID.csv",
+                                              source_file=str(tmp_path / "super.nc"))
+    with nc.Dataset(out) as ds:
+        assert ds.cell_order == "hilbert"
+        ordered = np.asarray(ds["gridID"][:]).ravel()
+    grid = TESGrid.from_domain(str(tmp_path / "entire.nc"))
+    assert (grid.nrows, grid.ncols, grid.dx) == (NROWS, NCOLS, DX)
+    np.testing.assert_array_equal(ordered, aoi[grid.cell_order(aoi, "hilbert")])
+
+
+def test_sparse_source_alone_cannot_give_the_raster(domains, monkeypatch):
+    tmp_path, _ = domains
+    monkeypatch.setenv("AOI_CELL_ORDER", "hilbert")
+    monkeypatch.delenv("TES_GRID_DOMAIN", raising=False)
+    with pytest.raises(ValueError, match="entire domain"):
+        TES_AOI_domainGEN.create_AOI_domain(str(tmp_path), str(tmp_path), "T1_gridID.csv",
+                                            source_file=str(tmp_path / "super.nc"))
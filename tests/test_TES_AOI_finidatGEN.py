@@ -0,0 +1,111 @@
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+import TES_AOI_finidatGEN
+
+# restart gridcells in a different order than the 1D domain (gridIDs 10..15)
+DOMAIN_GRIDIDS = np.arange(10, 16)
+RESTART_ORDER = np.array([2, 0, 5, 1, 4, 3])  # domain position of each restart gridcell
+
+
+def write_domain(path):
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as ds:
+        ds.createDimension("nj", 1)
+        ds.createDimension("ni", DOMAIN_GRIDIDS.size)
+        ds.createVariable("gridID", "i4", ("nj", "ni"))[:] = [DOMAIN_GRIDIDS]
+
+
+def write_restart(path, seed=0):
+    """Restart with shuffled sub-grid entities; every entity's tag encodes its ancestry:
+    landunit gid*10+k, column landunit*10+c, pft column*10+p."""
+    rng = np.random.default_rng(seed)
+    gid = DOMAIN_GRIDIDS[RESTART_ORDER]
+    land = [(g, int(gid[g]) * 10 + k) for g in range(gid.size) for k in range(2)]
+    land = [land[i] for i in rng.permutation(len(land))]
+    cols = [(l, land[l][1] * 10 + c) for l in range(len(land)) for c in range(1 + land[l][1] % 2)]
+    cols = [cols[i] for i in rng.permutation(len(cols))]
+    pfts = [(c, cols[c][1] * 10 + p) for c in range(len(cols)) for p in range(2)]
+    pfts = [pfts[i] for i in rng.permutation(len(pfts))]
+
+    land_g = np.array([g for g, _ in land])
+    col_l = np.array([l for l, _ in cols])
+    pft_c = np.array([c for c, _ in pfts])
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as ds:
+        for dim, n in (("gridcell", gid.size), ("topounit", gid.size), ("landunit", len(land)),
+                       ("column", len(cols)), ("pft", len(pfts)), ("levgrnd", 3)):
+            ds.createDimension(dim, n)
+
+        def put(name, dims, values):
+            ds.createVariable(name, "i4", dims)[:] = values
+
+        put("grid1d_ixy", ("gridcell",), RESTART_ORDER + 1)
+        put("grid1d_jxy", ("gridcell",), np.ones(gid.size))
+        put("grid_tag", ("gridcell",), gid)
+        put("topo1d_gridcell", ("topounit",), np.arange(gid.size) + 1)
+        put("topo_tag", ("topounit",), gid)
+        put("land1d_gridcell", ("landunit",), land_g + 1)
+        put("land1d_topounit", ("landunit",), land_g + 1)
+        put("land1d_ixy", ("landunit",), RESTART_ORDER[land_g] + 1)
+        put("land_tag", ("landunit",), [t for _, t in land])
+        put("cols1d_gridcell", ("column",), land_g[col_l] + 1)
+        put("cols1d_landunit", ("column",), col_l + 1)
+        put("cols1d_ixy", ("column",), RESTART_ORDER[land_g[col_l]] + 1)
+        put("col_tag", ("column",), [t for _, t in cols])
+        put("T_SOISNO", ("column", "levgrnd"), np.array([t for _, t in cols])[:, None] + np.arange(3))
+        put("pfts1d_gridcell", ("pft",), land_g[col_l[pft_c]] + 1)
+        put("pfts1d_landunit", ("pft",), col_l[pft_c] + 1)
+        put("pfts1d_column", ("pft",), pft_c + 1)
+        put("pfts1d_ci", ("pft",), pft_c + 1)
+        put("pft_tag", ("pft",), [t for _, t in pfts])
+    return len(land), len(cols), len(pfts)
+
+
+@pytest.fixture
+def files(tmp_path):
+    write_domain(str(tmp_path / "domain.nc"))
+    write_restart(str(tmp_path / "case.elm.r.nc"))
+    return str(tmp_path / "case.elm.r.nc"), str(tmp_path / "domain.nc"), tmp_path
+
+
+@pytest.mark.parametrize("aoi, keep_order", [([14, 11, 12], False), ([14, 11, 12], True)])
+def test_parent_indices_follow_the_kept_entities(files, aoi, keep_order):
+    restart, domain, tmp_path = files
+    out = str(tmp_path / "out" / "T1_case.elm.r.nc")
+    grid_ids, sizes = TES_AOI_finidatGEN.create_AOI_finidat(restart, domain, out, "T1", np.array(aoi), keep_order)
+    expected = aoi if keep_order else sorted(aoi)
+    np.testing.assert_array_equal(grid_ids, expected)
+
+    with nc.Dataset(out) as ds:
+        v = {name: np.asarray(var[:]) for name, var in ds.variables.items()}
+    np.testing.assert_array_equal(v["grid_tag"], expected)
+    np.testing.assert_array_equal(v["grid1d_ixy"], np.arange(1, len(aoi) + 1))
+    np.testing.assert_array_equal(v["grid1d_jxy"], 1)
+    np.testing.assert_array_equal(v["topo_tag"][v["topo1d_gridcell"] - 1], v["topo_tag"])
+
+    # every entity of the AOI gridcells is kept, grouped by gridcell in AOI order
+    assert sorted(v["land_tag"] // 10) == sorted(np.repeat(aoi, 2))
+    assert sizes["pft"] == 2 * sizes["column"]
+    assert (np.diff(v["land1d_gridcell"]) >= 0).all() and (np.diff(v["pfts1d_gridcell"]) >= 0).all()
+
+    # remapped parent indices point at the same parents as in the restart
+    np.testing.assert_array_equal(v["grid_tag"][v["land1d_gridcell"] - 1], v["land_tag"] // 10)
+    np.testing.assert_array_equal(v["topo_tag"][v["land1d_topounit"] - 1], v["land_tag"] // 10)
+    np.testing.assert_array_equal(v["land_tag"][v["cols1d_landunit"] - 1], v["col_tag"] // 10)
+    np.testing.assert_array_equal(v["grid_tag"][v["cols1d_gridcell"] - 1], v["col_tag"] // 100)
+    np.testing.assert_array_equal(v["col_tag"][v["pfts1d_column"] - 1], v["pft_tag"] // 10)
+    np.testing.assert_array_equal(v["pfts1d_ci"], v["pfts1d_column"])
+    np.testing.assert_array_equal(v["land_tag"][v["pfts1d_landunit"] - 1], v["pft_tag"] // 100)
+    np.testing.assert_array_equal(v["grid_tag"][v["pfts1d_gridcell"] - 1], v["pft_tag"] // 1000)
+    # sub-grid ixy follow the new gridcell positions; multi-level data moves with its column
+    np.testing.assert_array_equal(v["land1d_ixy"], v["land1d_gridcell"])
+    np.testing.assert_array_equal(v["cols1d_ixy"], v["cols1d_gridcell"])
+    np.testing.assert_array_equal(v["T_SOISNO"], v["col_tag"][:, None] + np.arange(3))
+
+
+def test_aoi_cell_missing_from_the_restart(files):
+    restart, _, _ = files
+    with nc.Dataset(restart) as src:
+        # domain position 6 is past the restart's gridcells
+        with pytest.raises(ValueError, match="not in the restart"):
+            TES_AOI_finidatGEN.select_entities(src, np.array([1, 6]), 7)
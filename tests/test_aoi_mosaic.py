@@ -0,0 +1,118 @@
+import os
+import sys
+
+import numpy as np
+import netCDF4 as nc
+
+import aoi_mosaic
+
+NROWS, NCOLS, DX = 3, 4, 4000.0
+FILL = 1.0e36
+
+
+def write_base_domain(path):
+    """Entire-domain 1D domain of a 3 x 4 all-land raster (gridID row-major)."""
+    gridid = np.arange(NROWS * NCOLS)
+    row, col = np.divmod(gridid, NCOLS)
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as dst:
+        dst.createDimension("nj", 1)
+        dst.createDimension("ni", gridid.size)
+        dst.createVariable("gridID", "i4", ("nj", "ni"))[:] = gridid[None, :]
+        dst.createVariable("xc_LCC", "f8", ("nj", "ni"))[:] = (col * DX)[None, :]
+        dst.createVariable("yc_LCC", "f8", ("nj", "ni"))[:] = (-row * DX)[None, :]
+    return path
+
+
+def write_aoi(path, gridids, variables):
+    """1D AOI file: gridID plus (time, gridcell) variables {name: (values, packed)}."""
+    gridids = np.asarray(gridids)
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as dst:
+        dst.createDimension("time", None)
+        dst.createDimension("gridcell", gridids.size)
+        dst.createVariable("gridID", "i4", ("gridcell",))[:] = gridids
+        for name, (values, packed) in variables.items():
+            values = np.atleast_2d(values)
+            if packed:
+                var = dst.createVariable(name, "i2", ("time", "gridcell"), fill_value=np.int16(-32767))
+                var.scale_factor, var.add_offset = 0.25, 280.0
+            else:
+                var = dst.createVariable(name, "f4", ("time", "gridcell"), fill_value=np.float32(FILL))
+            var[:] = values
+    return path
+
+
+def run_mosaic(tmp_path, inputs, overlap="first", monkeypatch=None):
+    base = write_base_domain(str(tmp_path / "base_domain.nc"))
+    out = tmp_path / "mosaic"
+    argv = ["aoi_mosaic.py", "--domain", base, "--output-dir", str(out), "--overlap", overlap,
+            "--workers", "1", "--full"] + [str(p) for p in inputs]
+    monkeypatch.setattr(sys, "argv", argv)
+    aoi_mosaic.main()
+    names = os.listdir(out)
+    assert len(names) == 1
+    return nc.Dataset(str(out / names[0]))
+
+
+def test_packed_values_are_not_truncated(tmp_path, monkeypatch):
+    a = write_aoi(str(tmp_path / "A_surf.nc"), [0, 1, 2], {"TBOT": ([280.5, 281.25, 283.5], True)})
+    with run_mosaic(tmp_path, [a], monkeypatch=monkeypatch) as out:
+        var = out["TBOT"]
+        assert var.dtype == np.int16 and var.scale_factor == 0.25
+        np.testing.assert_array_equal(var[0, 0, :3], [280.5, 281.25, 283.5])
+        assert var[0, 1, :].mask.all()
+
+
+def test_mean_skips_fill_values(tmp_path, monkeypatch):
+    a = write_aoi(str(tmp_path / "A_surf.nc"), [0, 1], {"TSA": ([FILL, 280.0], False)})
+    b = write_aoi(str(tmp_path / "B_surf.nc"), [0, 1], {"TSA": ([290.0, 284.0], False)})
+    with run_mosaic(tmp_path, [a, b], "mean", monkeypatch) as out:
+        np.testing.assert_allclose(out["TSA"][0, 0, :2], [290.0, 282.0])
+
+
+def test_mean_of_fill_only_stays_fill(tmp_path, monkeypatch):
+    a = write_aoi(str(tmp_path / "A_surf.nc"), [5], {"TSA": ([FILL], False)})
+    b = write_aoi(str(tmp_path / "B_surf.nc"), [5], {"TSA": ([FILL], False)})
+    with run_mosaic(tmp_path, [a, b], "mean", monkeypatch) as out:
+        assert out["TSA"][0].mask.all()
+
+
+def overlapping_inputs(tmp_path, extra_a=None):
+    # A holds cells 0-2 and B cells 1-3: cells 1 and 2 overlap; two time steps
+    a_vars = {"TSA": ([[270.0, 271.0, 272.0], [370.0, 371.0, 372.0]], False)}
+    a_vars.update(extra_a or {})
+    a = write_aoi(str(tmp_path / "A_surf.nc"), [0, 1, 2], a_vars)
+    b = write_aoi(str(tmp_path / "B_surf.nc"), [1, 2, 3], {"TSA": ([[281.0, 282.0, 283.0], [381.0, 382.0, 383.0]], False)})
+    return a, b
+
+
+def test_first_keeps_the_first_input(tmp_path, monkeypatch):
+    with run_mosaic(tmp_path, overlapping_inputs(tmp_path), "first", monkeypatch) as out:
+        np.testing.assert_allclose(out["TSA"][:, 0, :], [[270, 271, 272, 283], [370, 371, 372, 383]])
+        assert out.mosaic_overlap == "first"
+
+
+def test_last_keeps_the_last_input(tmp_path, monkeypatch):
+    with run_mosaic(tmp_path, overlapping_inputs(tmp_path), "last", monkeypatch) as out:
+        np.testing.assert_allclose(out["TSA"][:, 0, :], [[270, 281, 282, 283], [370, 381, 382, 383]])
+
+
+def test_mean_averages_the_overlap(tmp_path, monkeypatch):
+    with run_mosaic(tmp_path, overlapping_inputs(tmp_path), "mean", monkeypatch) as out:
+        np.testing.assert_allclose(out["TSA"][:, 0, :], [[270, 276, 277, 283], [370, 376, 377, 383]])
+        assert out["TSA"][:, 1:, :].mask.all()
+
+
+def test_mean_keeps_the_first_integer_value(tmp_path, monkeypatch):
+    # packed (int16) variables are not averaged: the first input holding the cell wins
+    a, b = overlapping_inputs(tmp_path)
+    a = write_aoi(a, [0, 1, 2], {"TSA": ([270.0, 271.0, 272.0], True)})
+    b = write_aoi(b, [1, 2, 3], {"TSA": ([281.0, 282.0, 283.0], True)})
+    with run_mosaic(tmp_path, [a, b], "mean", monkeypatch) as out:
+        np.testing.assert_array_equal(out["TSA"][0, 0, :], [270, 271, 272, 283])
+
+
+def test_mean_of_a_variable_missing_in_one_input(tmp_path, monkeypatch):
+    inputs = overlapping_inputs(tmp_path, {"QFLX": ([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]], False)})
+    with run_mosaic(tmp_path, inputs, "mean", monkeypatch) as out:
+        np.testing.assert_allclose(out["QFLX"][:, 0, :3], [[1, 2, 3], [4, 5, 6]])
+        assert out["QFLX"][:, 0, 3].mask.all()
@@ -0,0 +1,43 @@
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+import aoi_resources
+from conftest import write_forcing
+
+
+def write_surfdata(path, ncells=5, nvars=6):
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as ds:
+        ds.createDimension("gridcell", ncells)
+        for k in range(nvars):
+            ds.createVariable(f"VAR{k}", "f8", ("gridcell",))[:] = np.arange(ncells)
+
+
+@pytest.fixture
+def config(tmp_path, catalog_env):
+    write_forcing(str(tmp_path / "forcing" / "TPHWL3Hrly" / "clmforc.Daymet4.4km.1d.TBOT.1980-01.nc"))
+    write_surfdata(str(tmp_path / "surfdata.nc"))
+    (tmp_path / "T1_gridID.csv").write_text("gridID\n7\n20\n")
+    return {
+        "aoi_points": {"dir": str(tmp_path), "file": "T1_gridID.csv"},
+        "source": {"forcing_dir": str(tmp_path / "forcing"), "surfdata_dir": str(tmp_path),
+                   "surfdata_file": "surfdata.nc"},
+        "scheduler": {"mem": "2GB"},
+        "sizing": {"safety_margin": 1.0, "rank_overhead_gb": 0.4},
+    }
+
+
+def test_node_mem_defaults_to_scheduler_mem(config):
+    # 2GB over workers of just above 0.4GB, well below the core limits
+    estimate = aoi_resources.estimate_resources(config)
+    assert estimate["surfdata_tasks"] == 4
+    config["sizing"]["node_mem"] = "3GB"
+    assert aoi_resources.estimate_resources(config)["surfdata_tasks"] == 6
+
+
+def test_surfdata_tasks_follow_the_compute_node(config, monkeypatch):
+    monkeypatch.setattr(aoi_resources.os, "cpu_count", lambda: 1)
+    config["scheduler"]["mem"] = "64GB"
+    assert aoi_resources.estimate_resources(config)["surfdata_tasks"] == 6
+    config["sizing"]["cores_per_node"] = 2
+    assert aoi_resources.estimate_resources(config)["surfdata_tasks"] == 2
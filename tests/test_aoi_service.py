@@ -0,0 +1,47 @@
+import os
+import types
+
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+import aoi_service
+
+
+def write_domain(path, ncells):
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as ds:
+        ds.createDimension("nj", 1)
+        ds.createDimension("ni", ncells)
+        ds.createVariable("gridID", "i4", ("nj", "ni"))[:] = [np.arange(ncells)]
+
+
+def report_cells(argv, warm=None):
+    print("cells", warm.gridid.size)
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(aoi_service, "_DOMAINS", {})
+    monkeypatch.setattr(aoi_service, "_MODULES", {"domain": types.SimpleNamespace(
+        main=report_cells, DOMAIN_SOURCE=str(tmp_path / "domain.nc"))})
+    write_domain(str(tmp_path / "domain.nc"), 3)
+    aoi_service.load_domain(str(tmp_path / "domain.nc"))
+    service = aoi_service.AOIService(str(tmp_path / "service"), 1)
+    yield service
+    service.executor.shutdown(wait=True)
+
+
+def run(service, tmp_path):
+    job_id, future = service.submit({"tool": "domain", "argv": [], "cwd": str(tmp_path), "env": {}})
+    assert future.result()["status"] == 0
+    with open(service.log_path(job_id)) as log:
+        return log.read()
+
+
+def test_changed_domain_reaches_workers_and_status(service, tmp_path):
+    assert run(service, tmp_path) == "cells 3\n"
+    path = str(tmp_path / "domain.nc")
+    write_domain(path, 5)
+    os.utime(path, ns=(0, 10**9))  # a different stamp even on coarse file-system clocks
+    assert [d["cells"] for d in service.status()["domains"]] == [5]
+    assert run(service, tmp_path) == "cells 5\n"
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+import aoi_tiles
+from tes_grid import TESGrid
+
+
+def raster(nrows=8, ncols=8):
+    return TESGrid(nrows, ncols, 0.0, 0.0, 4000.0, 4000.0, np.arange(nrows * ncols))
+
+
+@pytest.mark.parametrize("ntiles", [1, 3, 4, 7])
+def test_every_cell_in_exactly_one_tile(ntiles):
+    grid = raster(6, 9)
+    rng = np.random.default_rng(0)
+    gridids = rng.choice(grid.gridid, 40, replace=False)
+    parts = aoi_tiles.plan_tiles(grid, np.concatenate([gridids, gridids[:5]]), ntiles)
+    assert len(parts) == ntiles
+    merged = np.concatenate(parts)
+    assert merged.size == gridids.size  # duplicates are dropped
+    np.testing.assert_array_equal(np.sort(merged), np.sort(gridids))
+    sizes = [p.size for p in parts]
+    assert max(sizes) - min(sizes) <= 1
+
+
+def test_tiles_are_compact_quadrants():
+    grid = raster()
+    parts = aoi_tiles.plan_tiles(grid, grid.gridid, 4)
+    extents = sorted((tuple(e["rows"]), tuple(e["cols"])) for e in (aoi_tiles.tile_extent(grid, p) for p in parts))
+    assert extents == [((0, 3), (0, 3)), ((0, 3), (4, 7)), ((4, 7), (0, 3)), ((4, 7), (4, 7))]
+
+
+def test_more_tiles_than_cells():
+    parts = aoi_tiles.plan_tiles(raster(), [5, 9], 4)
+    assert [p.tolist() for p in sorted(parts, key=lambda p: p[0])] == [[5], [9]]
+
+
+def test_cell_order_within_tiles():
+    grid = raster()
+    for part in aoi_tiles.plan_tiles(grid, grid.gridid, 2):
+        np.testing.assert_array_equal(part, np.sort(part))
+    for part in aoi_tiles.plan_tiles(grid, grid.gridid, 2, "hilbert"):
+        np.testing.assert_array_equal(part, np.sort(part)[grid.cell_order(np.sort(part), "hilbert")])
+
+
+def test_tile_names_keep_the_aoi_prefix():
+    names = aoi_tiles.tile_names("TN", 12)
+    assert names[0] == "TNT01" and names[-1] == "TNT12"
+    assert all("_" not in n for n in names)
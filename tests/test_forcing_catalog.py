@@ -0,0 +1,68 @@
+import netCDF4 as nc
+import numpy as np
+import pytest
+
+import forcing_catalog
+from conftest import FILL, GRIDIDS, OFFSET, SCALE, TBOT, write_forcing
+
+CLASSIC = {"NETCDF3_CLASSIC": "CDF-1", "NETCDF3_64BIT": "CDF-2", "NETCDF3_64BIT_DATA": "CDF-5"}
+
+
+@pytest.mark.parametrize("fmt", sorted(CLASSIC))
+def test_header_matches_netcdf4(tmp_path, fmt):
+    path = write_forcing(str(tmp_path / "f.nc"), fmt=fmt)
+    header = forcing_catalog.read_classic_header(path)
+    assert header["format"] == CLASSIC[fmt]
+    assert header["numrecs"] == TBOT.shape[0]
+    assert header["dims"] == [("time", 0), ("nj", 1), ("ni", GRIDIDS.size)]
+
+    variables = header["variables"]
+    tbot = variables["TBOT"]
+    assert (tbot["dims"], tbot["shape"], tbot["record"]) == (["time", "nj", "ni"], [3, 1, 5], True)
+    assert np.dtype(tbot["dtype"]) == np.dtype(">i2")
+    assert tbot["attrs"]["scale_factor"] == SCALE and tbot["attrs"]["add_offset"] == OFFSET
+    assert tbot["attrs"]["_FillValue"] == FILL and tbot["attrs"]["units"] == "K"
+    assert not variables["gridID"]["record"]
+
+    # the offsets locate the same bytes netCDF4 reads
+    with nc.Dataset(path) as src:
+        src.set_auto_maskandscale(False)
+        np.testing.assert_array_equal(
+            forcing_catalog._read_values(path, variables["gridID"], header["recsize"], 0), src["gridID"][:].ravel())
+        for k in range(TBOT.shape[0]):
+            np.testing.assert_array_equal(
+                forcing_catalog._read_values(path, tbot, header["recsize"], k), src["TBOT"][k].ravel())
+            assert forcing_catalog._read_values(path, variables["time"], header["recsize"], k)[0] == src["time"][k]
+
+
+def test_single_record_variable_is_not_padded(tmp_path):
+    # 5 int16 values per record: 10 bytes, padded to 12 only when records hold several variables
+    path = str(tmp_path / "one.nc")
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as dst:
+        dst.createDimension("time", None)
+        dst.createDimension("ni", 5)
+        dst.createVariable("x", "i2", ("time", "ni"))[:] = np.arange(15).reshape(3, 5)
+    header = forcing_catalog.read_classic_header(path)
+    assert header["recsize"] == 10
+    np.testing.assert_array_equal(
+        forcing_catalog._read_values(path, header["variables"]["x"], header["recsize"], 2), [10, 11, 12, 13, 14])
+
+
+def test_netcdf4_is_not_classic(tmp_path):
+    path = write_forcing(str(tmp_path / "f.nc"), fmt="NETCDF4")
+    with pytest.raises(ValueError):
+        forcing_catalog.read_classic_header(path)
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_describe_file_agrees_across_formats(tmp_path, packed):
+    classic = forcing_catalog.describe_file(write_forcing(str(tmp_path / "c.nc"), packed=packed))
+    nc4 = forcing_catalog.describe_file(write_forcing(str(tmp_path / "h.nc"), fmt="NETCDF4", packed=packed))
+    assert classic["format"] == "CDF-2" and classic["variables"]["TBOT"]["offset"] is not None
+    for key in ("time_steps", "ncells", "time_first", "time_last", "time_units", "gridid_sha"):
+        assert classic[key] == nc4[key], key
+    for info in (classic, nc4):
+        var = info["variables"]["TBOT"]
+        assert forcing_catalog.is_packed(var) is packed
+        assert forcing_catalog.unpacked_dtype(var) == np.dtype("f8" if packed else "f4")
+    assert classic["variables"]["TBOT"]["packing"] == nc4["variables"]["TBOT"]["packing"]
@@ -0,0 +1,57 @@
+import os
+
+import netCDF4 as nc
+import pytest
+
+import forcing_shards
+from conftest import write_forcing
+
+FILES = ("TPHWL3Hrly/clmforc.Daymet4.4km.1d.TBOT.1980-01.nc",
+         "TPHWL3Hrly/clmforc.Daymet4.4km.1d.TBOT.1980-02.nc")
+
+
+def write_aoi(path, gridids):
+    with nc.Dataset(path, "w", format="NETCDF3_64BIT") as ds:
+        ds.createDimension("nj", 1)
+        ds.createDimension("ni", len(gridids))
+        ds.createVariable("gridID", "i4", ("nj", "ni"))[:] = [gridids]
+
+
+@pytest.fixture
+def experiment(tmp_path, catalog_env, monkeypatch):
+    monkeypatch.setenv("AOI_QA", "off")
+    monkeypatch.chdir(tmp_path)  # the shard status files are written to the working directory
+    source = tmp_path / "source"
+    for name in FILES:
+        write_forcing(str(source / name))
+    aoi = tmp_path / "aoi"
+    aoi.mkdir()
+    write_aoi(str(aoi / "T1_domain.nc"), [7, 20])
+    write_aoi(str(aoi / "T2_domain.nc"), [3, 42])
+    shards = forcing_shards.plan_shards(forcing_shards.discover_forcing_files(str(source)), 1)
+    plan = forcing_shards.write_plan(str(tmp_path / "plan.json"), str(source), shards)
+    return plan, str(tmp_path / "out"), str(aoi) + "/"
+
+
+def test_validate_accepts_a_finished_shard(experiment):
+    plan, out, aoi = experiment
+    forcing_shards.run_shard(plan, 0, out, aoi, "T1_domain.nc")
+    assert forcing_shards.validate(plan, out, aoi, "T1_domain.nc") == []
+
+
+def test_failed_rerun_removes_the_marker(experiment):
+    plan, out, aoi = experiment
+    forcing_shards.run_shard(plan, 0, out, aoi, "T1_domain.nc")
+    broken = dict(plan, forcing_dir=plan["forcing_dir"] + "_missing")
+    with pytest.raises(OSError):
+        forcing_shards.run_shard(broken, 0, out, aoi, "T1_domain.nc")
+    assert not os.path.exists(forcing_shards._marker_path(out, 0))
+    assert forcing_shards.validate(plan, out, aoi, "T1_domain.nc") == [0]
+
+
+def test_marker_of_another_aoi_is_rejected(experiment):
+    plan, out, aoi = experiment
+    forcing_shards.run_shard(plan, 0, out, aoi, "T1_domain.nc")
+    # same AOI name and cell count, different gridIDs: the outputs exist but are stale
+    os.replace(os.path.join(aoi, "T2_domain.nc"), os.path.join(aoi, "T1_domain.nc"))
+    assert forcing_shards.validate(plan, out, aoi, "T1_domain.nc") == [0]
@@ -0,0 +1,45 @@
+import json
+import os
+
+import numpy as np
+import netCDF4 as nc
+import pytest
+
+from conftest import GRIDIDS, TBOT, write_forcing
+from forcing_timeseries_export import TimeSeriesStore, export_forcing
+
+FILES = ("TPHWL3Hrly/T1_clmforc.Daymet4.4km.1d.TBOT.1980-01.nc",
+         "TPHWL3Hrly/T1_clmforc.Daymet4.4km.1d.TBOT.1980-02.nc")
+
+
+@pytest.fixture
+def packed_forcing(tmp_path, catalog_env):
+    forcing = tmp_path / "forcing"
+    for k, name in enumerate(FILES):
+        write_forcing(str(forcing / name), values=TBOT + k)
+    return str(forcing)
+
+
+def test_packed_npy_round_trip(tmp_path, packed_forcing):
+    output = str(tmp_path / "ts")
+    export_forcing(packed_forcing, output, fmt="npy", cells_per_shard=2)
+    store = TimeSeriesStore(output)
+    expected = np.concatenate([TBOT, TBOT + 1]).T
+    for cell, gridid in enumerate(GRIDIDS):
+        series = np.asarray(store.series("TBOT", gridid))
+        assert series.dtype.kind == "f"
+        np.testing.assert_allclose(series, expected[cell], atol=1e-6, equal_nan=True)
+    with open(os.path.join(output, "index.json")) as f:
+        attrs = json.load(f)["variables"]["TBOT"]["attrs"]
+    assert not {"scale_factor", "add_offset", "_FillValue"} & attrs.keys()
+    assert attrs["units"] == "K"
+
+
+def test_packed_netcdf4_round_trip(tmp_path, packed_forcing):
+    output = str(tmp_path / "ts")
+    export_forcing(packed_forcing, output, fmt="netcdf4")
+    with nc.Dataset(os.path.join(output, "TBOT.nc")) as src:
+        var = src["TBOT"]
+        assert "scale_factor" not in var.ncattrs()
+        values = np.ma.filled(var[:], np.nan)
+    np.testing.assert_allclose(values, np.concatenate([TBOT, TBOT + 1]).T, atol=1e-6, equal_nan=True)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+
+from conftest import GRIDIDS, TBOT, write_forcing
+from point_timeseries_extract import Site, extract
+
+FILE = "TPHWL3Hrly/clmforc.Daymet4.4km.1d.TBOT.1980-01.nc"
+
+
+def _sites(gridids):
+    return [Site(f"s{g}", int(g), 0, 0.0, 0.0, 0.0, 0.0) for g in gridids]
+
+
+@pytest.mark.parametrize("packed", [True, False])
+def test_classic_and_netcdf4_agree(tmp_path, catalog_env, packed):
+    sites = _sites(GRIDIDS[[4, 0, 3]])
+    results = {}
+    for fmt in ("NETCDF3_64BIT", "NETCDF4"):
+        forcing = tmp_path / fmt
+        write_forcing(str(forcing / FILE), fmt, packed=packed)
+        catalog_env.unlink(missing_ok=True)
+        results[fmt] = extract(str(forcing), sites)["TBOT"][4]
+    expected = TBOT[:, [4, 0, 3]]
+    for values in results.values():
+        np.testing.assert_allclose(values, expected, rtol=0, atol=1e-5, equal_nan=True)
+    np.testing.assert_array_equal(results["NETCDF3_64BIT"], results["NETCDF4"])